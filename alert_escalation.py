@@ -0,0 +1,200 @@
+"""
+AI-CARE Lung Pro - 警示升級排程
+================================
+
+待處理警示依等級與建立時間（黃燈合併升為紅燈者為升級時間）計算處理時限（SLA），逾時即升級：
+- 以最小堆積（heap）依到期時間排列，背景執行緒睡到下一個到期時間才醒來，不需反覆掃描所有警示
+- 警示只新增不刪除：資料檔異動時只讀入新增的警示，並檢查仍開啟的警示是否已處理
+- 升級時發出事件（監聽函式 + 最近事件紀錄），待處理佇列依升級等級、紅黃燈、建立時間排序
+"""
+
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import data_manager
+
+try:
+    from config import ALERT_ESCALATION_MINUTES
+except ImportError:
+    ALERT_ESCALATION_MINUTES = {"red": [30, 120], "yellow": [240, 1440]}
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_LABELS = {1: "⏰ 逾時", 2: "🚨 嚴重逾時"}
+SYNC_INTERVAL_SECONDS = 30
+EVENT_HISTORY = 200
+
+
+def _created_at(alert: Dict, field: str = "timestamp") -> float:
+    try:
+        return datetime.fromisoformat(alert[field]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+class EscalationScheduler:
+    """待處理警示的升級排程"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.RLock())
+        self.version = None
+        self.n_seen = 0
+        self.open: Dict[str, Dict] = {}     # alert_id -> {"alert", "pos", "stage", "created", "since"}
+        self._heap = []                     # (到期時間, 警示 ID, 升級等級)
+        self.events = deque(maxlen=EVENT_HISTORY)
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._thread = None
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """註冊升級事件監聽函式 callback(event)"""
+        self._listeners.append(callback)
+
+    # ------------------------------------------
+    # 排程
+    # ------------------------------------------
+    @staticmethod
+    def _due(entry: Dict, stage: int) -> Optional[float]:
+        """依警示目前等級，升至 stage 級的到期時間"""
+        thresholds = ALERT_ESCALATION_MINUTES.get(entry["alert"].get("level"), [])
+        if stage > len(thresholds):
+            return None
+        return entry["since"] + thresholds[stage - 1] * 60
+
+    def _schedule_next(self, alert_id: str):
+        entry = self.open[alert_id]
+        due = self._due(entry, entry["stage"] + 1)
+        if due is not None:
+            heapq.heappush(self._heap, (due, alert_id, entry["stage"] + 1))
+            self._cond.notify()
+
+    def _track(self, alert: Dict, pos: int, now: float):
+        created = _created_at(alert)
+        # 處理時限的起算時間：升為紅燈的警示由升級時間起算
+        since = _created_at(alert, "upgraded_at") if alert.get("upgraded_at") else created
+        thresholds = ALERT_ESCALATION_MINUTES.get(alert.get("level"), [])
+        # 啟動時已逾時的警示直接給定目前等級，不補發事件
+        stage = sum(1 for minutes in thresholds if now >= since + minutes * 60)
+        self.open[alert["id"]] = {"alert": alert, "pos": pos, "stage": stage, "created": created, "since": since}
+        self._schedule_next(alert["id"])
+
+    def sync(self):
+        """同步資料檔：加入新警示、移除已處理的警示"""
+        with self._cond:
+            version = data_manager.data_version()
+            if version == self.version:
+                return
+            alerts = data_manager.load_data().get("alerts", [])
+            now = time.time()
+            if len(alerts) < self.n_seen:
+                self.open, self._heap, self.n_seen = {}, [], 0
+
+            for alert_id, entry in list(self.open.items()):
+                pos = entry["pos"]
+                current = alerts[pos] if pos < len(alerts) and alerts[pos].get("id") == alert_id else None
+                if current is None or current.get("status") != "pending":
+                    # 堆積中的項目留待到期時略過
+                    del self.open[alert_id]
+                elif current.get("level") != entry["alert"].get("level"):
+                    # 合併後升為紅燈：依新等級的時限重新排程
+                    self._track(current, pos, now)
+                else:
+                    entry["alert"] = current
+
+            for pos in range(self.n_seen, len(alerts)):
+                alert = alerts[pos]
+                if alert.get("status") == "pending" and alert.get("id"):
+                    self._track(alert, pos, now)
+            self.n_seen = len(alerts)
+            self.version = version
+
+    def fire_due(self, now: Optional[float] = None) -> List[Dict]:
+        """處理已到期的升級，回傳本次發出的事件"""
+        now = time.time() if now is None else now
+        fired = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due, alert_id, stage = heapq.heappop(self._heap)
+                entry = self.open.get(alert_id)
+                if entry is None or entry["stage"] >= stage or due != self._due(entry, stage):
+                    # 已處理、已升級過，或為等級變更前排入的舊項目
+                    continue
+                entry["stage"] = stage
+                alert = entry["alert"]
+                event = {
+                    "type": "escalated",
+                    "alert_id": alert_id,
+                    "patient_id": alert.get("patient_id"),
+                    "level": alert.get("level"),
+                    "stage": stage,
+                    "label": ESCALATION_LABELS.get(stage, f"第 {stage} 級"),
+                    "waited_minutes": int((now - entry["created"]) // 60),
+                    "at": datetime.now().isoformat(),
+                }
+                self.events.append(event)
+                fired.append(event)
+                self._schedule_next(alert_id)
+
+        for event in fired:
+            for callback in self._listeners:
+                try:
+                    callback(event)
+                except Exception:
+                    logger.exception("警示升級事件處理失敗")
+        return fired
+
+    def _run(self):
+        while True:
+            with self._cond:
+                timeout = SYNC_INTERVAL_SECONDS
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+                self._cond.wait(timeout)
+            try:
+                self.sync()
+                self.fire_due()
+            except Exception:
+                logger.exception("警示升級排程錯誤")
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="alert-escalation", daemon=True)
+                self._thread.start()
+
+    # ------------------------------------------
+    # 查詢
+    # ------------------------------------------
+    def triage_queue(self) -> List[Dict]:
+        """待處理警示（依升級等級、紅燈優先、等待時間排序），附 escalation / waited_minutes 欄位"""
+        now = time.time()
+        with self._cond:
+            entries = list(self.open.values())
+        entries.sort(key=lambda e: (-e["stage"], e["alert"].get("level") != "red", e["created"]))
+        return [
+            {**e["alert"], "escalation": e["stage"], "waited_minutes": int((now - e["created"]) // 60)}
+            for e in entries
+        ]
+
+    def recent_events(self, limit: int = 20) -> List[Dict]:
+        with self._cond:
+            return list(self.events)[-limit:][::-1]
+
+
+_scheduler = EscalationScheduler()
+
+
+def get_escalation_scheduler() -> EscalationScheduler:
+    """取得已同步資料檔並已啟動背景執行緒的升級排程"""
+    _scheduler.start()
+    _scheduler.sync()
+    _scheduler.fire_due()
+    return _scheduler
+
+
+def get_triage_queue() -> List[Dict]:
+    return get_escalation_scheduler().triage_queue()
@@ -0,0 +1,197 @@
+"""
+AI-CARE Lung Pro - 警示評分
+============================
+
+症狀回報的警示判定，由多條規則組成，取最高等級：
+- ThresholdRule：整體分數閾值（config.ALERT_THRESHOLD_*）與列出症狀的個別閾值（SYMPTOM_ALERT_THRESHOLDS）
+- TrendRule：較病人近期水準明顯上升（ALERT_TREND_DELTA；優先使用病人資料中的症狀基準值）
+- PostOpLimitRule：依術後階段的症狀上限（POST_OP_SYMPTOM_LIMITS）
+
+各病人近期分數保存在記憶體中的滾動視窗（每個症狀最近 N 筆），
+資料檔異動時只讀入新增的回報，每次回報只需 O(症狀數) 即可完成評分。
+可用 register_rule() 加入自訂規則。
+"""
+
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from config import ALERT_THRESHOLD_RED, ALERT_THRESHOLD_YELLOW
+except ImportError:
+    ALERT_THRESHOLD_RED = 7
+    ALERT_THRESHOLD_YELLOW = 4
+
+try:
+    from config import SYMPTOM_ALERT_THRESHOLDS, ALERT_TREND_DELTA, ALERT_TREND_WINDOW, POST_OP_SYMPTOM_LIMITS
+except ImportError:
+    SYMPTOM_ALERT_THRESHOLDS = {}
+    ALERT_TREND_DELTA = 3
+    ALERT_TREND_WINDOW = 7
+    POST_OP_SYMPTOM_LIMITS = []
+
+OVERALL = "整體分數"
+LEVEL_RANK = {None: 0, "yellow": 1, "red": 2}
+MIN_TREND_SAMPLES = 3
+
+
+def report_scores(report: Dict) -> Dict[str, float]:
+    """回報中的分數：整體分數 + 各症狀分數（無法轉為數字者略過）"""
+    scores = {}
+    for symptom, score in {OVERALL: report.get("overall_score"), **(report.get("scores") or {})}.items():
+        try:
+            scores[symptom] = float(score)
+        except (TypeError, ValueError):
+            continue
+    return scores
+
+
+class ScoringContext:
+    """評分時可用的病人資訊"""
+
+    def __init__(self, patient_id: str, post_op_day: Optional[int], window: Dict[str, deque],
+                 baselines: Optional[Dict] = None):
+        self.patient_id = patient_id
+        self.post_op_day = post_op_day
+        self.window = window            # 症狀 -> 最近 N 筆分數（不含本次回報）
+        self.baselines = baselines or {}  # 病人資料中保存的症狀基準值（見 symptom_baseline）
+
+    def recent_mean(self, symptom: str) -> Optional[float]:
+        """近期平均：優先使用病人的基準值（EWMA），否則使用滾動視窗"""
+        baseline = self.baselines.get(symptom)
+        if baseline and baseline.get("n", 0) >= MIN_TREND_SAMPLES:
+            return baseline["ewma"]
+        values = self.window.get(symptom)
+        if not values or len(values) < MIN_TREND_SAMPLES:
+            return None
+        return sum(values) / len(values)
+
+
+# ============================================
+# 規則
+# ============================================
+class AlertRule:
+    """警示規則：evaluate 回傳 [(等級, 原因), ...]"""
+
+    name = ""
+
+    def evaluate(self, scores: Dict[str, float], context: ScoringContext) -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+
+class ThresholdRule(AlertRule):
+    name = "threshold"
+
+    def evaluate(self, scores, context):
+        results = []
+        for symptom, score in scores.items():
+            # 整體閾值只用於整體分數；個別症狀只判斷 SYMPTOM_ALERT_THRESHOLDS 列出者
+            if symptom == OVERALL:
+                limits = {"red": ALERT_THRESHOLD_RED, "yellow": ALERT_THRESHOLD_YELLOW}
+            else:
+                limits = SYMPTOM_ALERT_THRESHOLDS.get(symptom)
+                if limits is None:
+                    continue
+            red = limits.get("red", float("inf"))
+            yellow = limits.get("yellow", red)
+            if score >= red:
+                results.append(("red", f"{symptom} {score:g} 分（≥{red}）"))
+            elif score >= yellow:
+                results.append(("yellow", f"{symptom} {score:g} 分（≥{yellow}）"))
+        return results
+
+
+class TrendRule(AlertRule):
+    name = "trend"
+
+    def evaluate(self, scores, context):
+        results = []
+        for symptom, score in scores.items():
+            mean = context.recent_mean(symptom)
+            if mean is not None and score - mean >= ALERT_TREND_DELTA:
+                results.append(("yellow", f"{symptom} 較近期平均 {mean:.1f} 分上升 {score - mean:.1f} 分"))
+        return results
+
+
+class PostOpLimitRule(AlertRule):
+    name = "post_op_limit"
+
+    def evaluate(self, scores, context):
+        day = context.post_op_day
+        if day is None:
+            return []
+        results = []
+        for start, end, limits in POST_OP_SYMPTOM_LIMITS:
+            if day < start or (end is not None and day > end):
+                continue
+            for symptom, limit in limits.items():
+                if scores.get(symptom, 0) > limit:
+                    results.append(("yellow", f"術後第 {day} 天 {symptom} {scores[symptom]:g} 分（上限 {limit}）"))
+        return results
+
+
+DEFAULT_RULES = [ThresholdRule(), TrendRule(), PostOpLimitRule()]
+
+
+# ============================================
+# 評分引擎
+# ============================================
+class AlertScoringEngine:
+    """依規則評分，並維護各病人各症狀的近期分數視窗"""
+
+    def __init__(self, rules: Optional[List[AlertRule]] = None, window_size: int = ALERT_TREND_WINDOW):
+        self._lock = threading.Lock()
+        self.rules = list(rules if rules is not None else DEFAULT_RULES)
+        self.window_size = window_size
+        self.version = None
+        self.n_seen = 0
+        self.windows: Dict[str, Dict[str, deque]] = {}  # patient_id -> 症狀 -> 最近分數
+
+    def register_rule(self, rule: AlertRule):
+        self.rules.append(rule)
+
+    def observe(self, report: Dict):
+        """將回報分數加入病人的滾動視窗"""
+        window = self.windows.setdefault(report.get("patient_id"), {})
+        for symptom, score in report_scores(report).items():
+            values = window.get(symptom)
+            if values is None:
+                values = window[symptom] = deque(maxlen=self.window_size)
+            values.append(score)
+        self.n_seen += 1
+
+    def sync(self, reports: List[Dict], version):
+        """資料檔異動後只讀入新增的回報"""
+        with self._lock:
+            if version is not None and version == self.version:
+                return
+            if len(reports) < self.n_seen:
+                self.windows, self.n_seen = {}, 0
+            for report in reports[self.n_seen:]:
+                self.observe(report)
+            self.version = version
+
+    def evaluate(self, patient_id: str, report: Dict, post_op_day: Optional[int] = None,
+                 baselines: Optional[Dict] = None) -> Tuple[Optional[str], List[str]]:
+        """回傳 (警示等級 red / yellow / None, 觸發原因)"""
+        context = ScoringContext(patient_id, post_op_day, self.windows.get(patient_id, {}), baselines)
+        scores = report_scores(report)
+        level, reasons = None, []
+        for rule in self.rules:
+            for rule_level, reason in rule.evaluate(scores, context):
+                reasons.append(reason)
+                if LEVEL_RANK[rule_level] > LEVEL_RANK[level]:
+                    level = rule_level
+        return level, reasons
+
+
+_engine = AlertScoringEngine()
+
+
+def get_scoring_engine() -> AlertScoringEngine:
+    return _engine
+
+
+def register_rule(rule: AlertRule):
+    """加入自訂警示規則"""
+    _engine.register_rule(rule)
@@ -0,0 +1,213 @@
+"""
+AI-CARE Lung Pro - 報表統計
+============================
+
+報表頁的資料來源：將回報、警示轉為快取的 DataFrame，並以 pandas group-by 彙整
+- 回報為只增不減的資料，資料檔異動時只把新增的回報轉成 DataFrame 附加
+- 警示狀態會改變，資料檔異動時整批重建（數量遠少於回報）
+- 冷啟動時若有 Parquet 快照，已快照的回報直接由快照讀取需要的欄位
+"""
+
+import threading
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+from analytics_snapshot import PARQUET_AVAILABLE, read_table
+from symptom_vocabulary import OTHER, normalize_symptoms, report_symptom_codes, symptom_name
+
+try:
+    from config import ALERT_THRESHOLD_RED, ALERT_THRESHOLD_YELLOW
+except ImportError:
+    ALERT_THRESHOLD_RED = 7
+    ALERT_THRESHOLD_YELLOW = 4
+
+STATUS_LABELS = {"normal": "正常追蹤", "warning": "黃色警示", "alert": "紅色警示", "no_report": "尚未回報"}
+
+
+def _reports_frame(reports: List[Dict]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "id": [r.get("id") for r in reports],
+        "patient_id": [r.get("patient_id") for r in reports],
+        "timestamp": pd.to_datetime([r.get("timestamp") for r in reports], errors="coerce", format="ISO8601"),
+        "overall_score": pd.to_numeric([r.get("overall_score", 0) for r in reports], errors="coerce"),
+    })
+
+
+def _codes_or_other(codes: List[int], symptoms) -> List[int]:
+    """有症狀文字但無法對應標準詞彙者歸為「其他」"""
+    if codes or symptoms is None or len(symptoms) == 0:
+        return codes
+    return [OTHER]
+
+
+def _symptoms_frame(reports: List[Dict], offset: int) -> pd.DataFrame:
+    """回報症狀展開表：每個 (回報, 標準症狀代碼) 一列"""
+    rows, codes = [], []
+    for i, report in enumerate(reports):
+        for code in _codes_or_other(report_symptom_codes(report), report.get("symptoms")):
+            rows.append(offset + i)
+            codes.append(code)
+    return pd.DataFrame({"report_row": np.array(rows, dtype=np.int64), "code": np.array(codes, dtype=np.int64)})
+
+
+class ReportAnalytics:
+    """報表用 DataFrame 快取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.n_reports = 0
+        self._report_chunks: List[pd.DataFrame] = []
+        self._symptom_chunks: List[pd.DataFrame] = []
+        self._reports = None
+        self._symptoms = None
+        self.alerts = pd.DataFrame(columns=["id", "patient_id", "level", "status", "timestamp"])
+        self.patient_ids: List[str] = []
+
+    def refresh(self):
+        """同步資料檔：附加新回報、重建警示"""
+        with self._lock:
+            version = data_manager.data_version()
+            if version == self.version:
+                return
+            data = data_manager.load_data()
+            reports = data.get("reports", [])
+
+            if len(reports) < self.n_reports:
+                # 回報被刪除：整批重建
+                self.n_reports = 0
+                self._report_chunks = []
+                self._symptom_chunks = []
+            if self.n_reports == 0:
+                self._seed_from_snapshot(reports)
+            if len(reports) > self.n_reports:
+                new_reports = reports[self.n_reports:]
+                self._report_chunks.append(_reports_frame(new_reports))
+                self._symptom_chunks.append(_symptoms_frame(new_reports, self.n_reports))
+                self.n_reports = len(reports)
+            self._reports = None
+            self._symptoms = None
+
+            alerts = data.get("alerts", [])
+            self.alerts = pd.DataFrame({
+                "id": [a.get("id") for a in alerts],
+                "patient_id": [a.get("patient_id") for a in alerts],
+                "level": [a.get("level") for a in alerts],
+                "status": [a.get("status") for a in alerts],
+                "timestamp": pd.to_datetime([a.get("timestamp") for a in alerts], errors="coerce", format="ISO8601"),
+            })
+            self.patient_ids = list(data.get("patients", {}).keys())
+            self.version = version
+
+    def _seed_from_snapshot(self, reports: List[Dict]):
+        """由 Parquet 快照載入回報（快照須為目前回報清單的前段）"""
+        if not PARQUET_AVAILABLE:
+            return
+        try:
+            df = read_table("reports", columns=["seq", "id", "patient_id", "timestamp", "overall_score", "symptoms"])
+        except (OSError, ValueError):
+            return
+        n = len(df)
+        if not n or n > len(reports):
+            return
+        df = df.sort_values("seq", ignore_index=True)
+        if not (df["seq"].to_numpy() == np.arange(n)).all() or df["id"].iat[-1] != reports[n - 1].get("id"):
+            return
+
+        # 快照只保存症狀文字：換算為標準代碼（相同文字只比對一次）
+        exploded = df["symptoms"].map(lambda s: _codes_or_other(normalize_symptoms(s), s)).explode().dropna()
+        self._report_chunks.append(df[["id", "patient_id", "timestamp", "overall_score"]])
+        self._symptom_chunks.append(pd.DataFrame({
+            "report_row": exploded.index.to_numpy(dtype=np.int64),
+            "code": exploded.to_numpy(dtype=np.int64),
+        }))
+        self.n_reports = n
+
+    @property
+    def reports(self) -> pd.DataFrame:
+        if self._reports is None:
+            self._reports = (pd.concat(self._report_chunks, ignore_index=True)
+                             if self._report_chunks else _reports_frame([]))
+        return self._reports
+
+    @property
+    def symptoms(self) -> pd.DataFrame:
+        if self._symptoms is None:
+            self._symptoms = (pd.concat(self._symptom_chunks, ignore_index=True)
+                              if self._symptom_chunks else _symptoms_frame([], 0))
+        return self._symptoms
+
+    # ------------------------------------------
+    # 彙整
+    # ------------------------------------------
+    def status_distribution(self) -> pd.Series:
+        """依每位病人最新一筆回報分類的收案狀態"""
+        reports = self.reports
+        latest = (reports.sort_values("timestamp")
+                  .drop_duplicates("patient_id", keep="last")
+                  .set_index("patient_id")["overall_score"])
+        latest = latest[latest.index.isin(self.patient_ids)]
+        status = pd.cut(
+            latest,
+            bins=[float("-inf"), ALERT_THRESHOLD_YELLOW, ALERT_THRESHOLD_RED, float("inf")],
+            labels=["normal", "warning", "alert"],
+            right=False,
+        )
+        counts = status.value_counts().reindex(["normal", "warning", "alert"], fill_value=0)
+        counts["no_report"] = len(self.patient_ids) - len(latest)
+        return counts.rename(index=STATUS_LABELS)
+
+    def symptom_frequency(self, days: Optional[int] = None, top: int = 10) -> pd.Series:
+        """症狀出現次數（依標準症狀代碼計數，可限定最近 N 天）"""
+        symptoms = self.symptoms
+        if days is not None and len(symptoms):
+            since = pd.Timestamp(date.today() - timedelta(days=days - 1))
+            recent = self.reports["timestamp"].to_numpy() >= since.to_datetime64()
+            symptoms = symptoms[recent[symptoms["report_row"].to_numpy()]]
+        counts = symptoms["code"].value_counts().head(top)
+        counts.index = counts.index.map(symptom_name)
+        return counts
+
+    def alert_trend(self, days: int = 30) -> pd.DataFrame:
+        """每日新增警示數（依等級）"""
+        start = date.today() - timedelta(days=days - 1)
+        index = pd.date_range(start, date.today(), freq="D")
+        alerts = self.alerts.dropna(subset=["timestamp"])
+        alerts = alerts[alerts["timestamp"] >= pd.Timestamp(start)]
+        trend = (alerts.groupby([alerts["timestamp"].dt.normalize(), "level"]).size()
+                 .unstack(fill_value=0)
+                 .reindex(index=index, columns=["red", "yellow"], fill_value=0))
+        trend.index.name = "date"
+        return trend
+
+    def daily_reports(self, days: int = 30) -> pd.Series:
+        """每日回報數"""
+        start = date.today() - timedelta(days=days - 1)
+        index = pd.date_range(start, date.today(), freq="D")
+        reports = self.reports.dropna(subset=["timestamp"])
+        reports = reports[reports["timestamp"] >= pd.Timestamp(start)]
+        return reports.groupby(reports["timestamp"].dt.normalize()).size().reindex(index, fill_value=0)
+
+    def summary(self) -> Dict:
+        reports = self.reports
+        today = pd.Timestamp(date.today())
+        alerts = self.alerts
+        return {
+            "total_patients": len(self.patient_ids),
+            "total_reports": len(reports),
+            "today_reports": int((reports["timestamp"] >= today).sum()),
+            "pending_alerts": int((alerts["status"] == "pending").sum()) if len(alerts) else 0,
+        }
+
+
+_analytics = ReportAnalytics()
+
+
+def get_analytics() -> ReportAnalytics:
+    """取得已同步資料檔的報表快取"""
+    _analytics.refresh()
+    return _analytics
@@ -0,0 +1,366 @@
+"""
+AI-CARE Lung Pro - 研究分析快照
+================================
+
+定期將回報、警示、介入紀錄、衛教推送紀錄與臨床資料寫成 Parquet 快照，
+供研究分析與報表只讀取需要的欄位（memory-mapped），不必解析整個 patient_records.json：
+
+    data/snapshot/
+        _manifest.json
+        reports/month=2026-10/part-0.parquet
+        alerts/month=2026-10/part-0.parquet
+        interventions/month=.../part-0.parquet
+        pushes/month=.../part-0.parquet
+        clinical/part-0.parquet          # 目前狀態，不分月
+
+- 各表欄位型別固定（SNAPSHOT_COLUMNS），新舊快照可直接合併讀取
+- 只重寫內容有變動的月份分區
+- 姓名、電話、對話內容、自由文字紀錄（警示備註、介入內容）與人員帳號不寫入快照
+  （與 export_pipeline 去識別化移除的欄位一致）
+- pyarrow 為選用套件，未安裝時 PARQUET_AVAILABLE 為 False
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import clinical_store
+import data_manager
+from id_generator import new_id
+from state_service import data_lock
+from clinical_options import (
+    CLINICAL_FIELD_OPTIONS, CLINICAL_MULTI_FIELDS, CLINICAL_NUMERIC_FIELDS,
+    CLINICAL_BOOL_FIELDS, CLINICAL_DATE_FIELDS
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+try:
+    from config import SNAPSHOT_DIR, SNAPSHOT_INTERVAL_MINUTES
+except ImportError:
+    SNAPSHOT_DIR = "data/snapshot"
+    SNAPSHOT_INTERVAL_MINUTES = 60
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "_manifest.json"
+PART_FILE = "part-0.parquet"
+
+# 各表欄位與型別（只列可供研究使用的欄位）：string / float / bool / timestamp / date / list（字串清單）/ json（以 JSON 字串保存）
+# seq 為資料在原始清單中的位置，讀回後依 seq 排序即為原始順序
+SNAPSHOT_COLUMNS = {
+    "reports": [
+        ("seq", "int"), ("id", "string"), ("patient_id", "string"), ("timestamp", "timestamp"),
+        ("symptoms", "list"), ("scores", "json"), ("overall_score", "float"), ("status", "string"),
+    ],
+    "alerts": [
+        ("seq", "int"), ("id", "string"), ("patient_id", "string"), ("level", "string"),
+        ("score", "float"), ("symptoms", "list"), ("timestamp", "timestamp"), ("status", "string"),
+        ("handled_at", "timestamp"),
+    ],
+    "interventions": [
+        ("seq", "int"), ("id", "string"), ("patient_id", "string"), ("timestamp", "timestamp"),
+        ("type", "string"), ("duration", "string"), ("referral", "string"),
+    ],
+    "pushes": [
+        ("seq", "int"), ("id", "string"), ("patient_id", "string"), ("material_id", "string"),
+        ("material_title", "string"), ("category", "string"), ("push_type", "string"),
+        ("pushed_at", "timestamp"), ("read_at", "timestamp"), ("status", "string"),
+    ],
+    "clinical": (
+        [("patient_id", "string")]
+        + [(f, "string") for f in CLINICAL_FIELD_OPTIONS]
+        + [(f, "list") for f in CLINICAL_MULTI_FIELDS]
+        + [(f, "float") for f in CLINICAL_NUMERIC_FIELDS]
+        + [(f, "bool") for f in CLINICAL_BOOL_FIELDS]
+        + [(f, "date") for f in CLINICAL_DATE_FIELDS]
+    ),
+}
+
+# 依月份分區的時間欄位
+PARTITION_FIELD = {
+    "reports": "timestamp",
+    "alerts": "timestamp",
+    "interventions": "timestamp",
+    "pushes": "pushed_at",
+}
+
+SNAPSHOT_TABLES = list(SNAPSHOT_COLUMNS)
+
+_lock = threading.Lock()
+_scheduler = {"thread": None}
+
+
+# ============================================
+# 型別轉換
+# ============================================
+def _arrow_type(kind: str):
+    return {
+        "int": pa.int64(),
+        "string": pa.string(),
+        "json": pa.string(),
+        "float": pa.float64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("us"),
+        "date": pa.date32(),
+        "list": pa.list_(pa.string()),
+    }[kind]
+
+
+def table_schema(table: str):
+    """資料表的固定 Arrow schema"""
+    return pa.schema([(name, _arrow_type(kind)) for name, kind in SNAPSHOT_COLUMNS[table]])
+
+
+def _convert(value, kind: str):
+    if value is None or value == "":
+        return [] if kind == "list" else None
+    try:
+        if kind == "int":
+            return int(value)
+        if kind == "string":
+            return str(value)
+        if kind == "json":
+            return json.dumps(value, ensure_ascii=False, default=str)
+        if kind == "float":
+            return float(value)
+        if kind == "bool":
+            return bool(value)
+        if kind == "timestamp":
+            return datetime.fromisoformat(str(value))
+        if kind == "date":
+            return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+        if kind == "list":
+            return [str(v) for v in value] if isinstance(value, list) else [str(value)]
+    except (TypeError, ValueError):
+        return [] if kind == "list" else None
+    return value
+
+
+def _month_of(value) -> str:
+    value = str(value or "")
+    return value[:7] if len(value) >= 7 and value[4] == "-" else "unknown"
+
+
+# ============================================
+# 來源
+# ============================================
+def _source_records(data: Dict, table: str) -> List[Dict]:
+    if table == "clinical":
+        return [
+            {**clinical_store.get_clinical(pid, patient.get("clinical")), "patient_id": pid}
+            for pid, patient in data.get("patients", {}).items()
+        ]
+    if table == "pushes":
+        # 推送紀錄保存在衛教模組（多工作程序部署時在共用狀態服務中，透過代理的方法讀取）
+        try:
+            from education_system import education_manager
+        except ImportError:
+            return []
+        records = education_manager.history_snapshot()
+    else:
+        records = data.get(table, [])
+    return [{**record, "seq": i} for i, record in enumerate(records)]
+
+
+def _partitions(data: Dict, table: str) -> Dict[str, List[Dict]]:
+    """月份 -> 原始資料（不分月的表以空字串為鍵）"""
+    records = _source_records(data, table)
+    time_field = PARTITION_FIELD.get(table)
+    if time_field is None:
+        return {"": records}
+    partitions = {}
+    for record in records:
+        partitions.setdefault(_month_of(record.get(time_field)), []).append(record)
+    return partitions
+
+
+def _partition_dir(table: str, month: str) -> str:
+    if not month:
+        return os.path.join(SNAPSHOT_DIR, table)
+    return os.path.join(SNAPSHOT_DIR, table, f"month={month}")
+
+
+def _content_hash(table: str, records: List[Dict]) -> str:
+    """只計算快照欄位；欄位定義變更時雜湊不同，既有分區會重寫"""
+    names = [name for name, _ in SNAPSHOT_COLUMNS[table]]
+    digest = hashlib.sha1(json.dumps(names).encode("utf-8"))
+    for record in records:
+        row = [record.get(name) for name in names]
+        digest.update(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# ============================================
+# 寫入
+# ============================================
+def load_manifest() -> Dict:
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"tables": {}}
+
+
+def _tmp_path(path: str) -> str:
+    """每次寫入使用不同的暫存檔名（程序 ID + 識別碼），避免多個程序同時寫入同一暫存檔"""
+    return f"{path}.{os.getpid()}.{new_id()}.tmp"
+
+
+def _write_partition(table: str, month: str, records: List[Dict]):
+    columns = SNAPSHOT_COLUMNS[table]
+    arrays = {name: [_convert(r.get(name), kind) for r in records] for name, kind in columns}
+    arrow_table = pa.Table.from_pydict(arrays, schema=table_schema(table))
+
+    directory = _partition_dir(table, month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PART_FILE)
+    tmp_path = _tmp_path(path)
+    pq.write_table(arrow_table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+
+def _source_version() -> List:
+    data_version = data_manager.data_version()
+    # 以 list 表示，與 manifest（JSON）讀回的值可直接比較；資料檔尚未建立時為 None
+    version = [list(data_version) if data_version else None, clinical_store.log_version()]
+    try:
+        from education_system import education_manager
+        version.append(list(education_manager.history_version()))
+    except ImportError:
+        version.append(0)
+    return version
+
+
+def write_snapshot(force: bool = False, tables: Optional[List[str]] = None) -> Dict:
+    """寫入快照，回傳 manifest；來源未異動時直接回傳既有 manifest
+
+    tables 可限定要更新的資料表，其餘資料表保留既有快照。
+    """
+    if not PARQUET_AVAILABLE:
+        raise ImportError("寫入 Parquet 快照需要安裝 pyarrow")
+
+    # 每個工作程序都會啟動排程；data_lock() 跨程序互斥，後進入者讀到新的 manifest 即直接回傳
+    with _lock, data_lock():
+        manifest = load_manifest()
+        version = _source_version()
+        if not force and manifest.get("source_version") == version:
+            return manifest
+
+        data = data_manager.load_data()
+        written = {}
+        for table in tables or SNAPSHOT_TABLES:
+            old_partitions = manifest.get("tables", {}).get(table, {}).get("partitions", {})
+            partitions = {}
+            for month, records in _partitions(data, table).items():
+                content_hash = _content_hash(table, records)
+                path = os.path.join(_partition_dir(table, month), PART_FILE)
+                unchanged = old_partitions.get(month, {}).get("hash") == content_hash and os.path.exists(path)
+                if force or not unchanged:
+                    _write_partition(table, month, records)
+                partitions[month] = {"rows": len(records), "hash": content_hash}
+
+            # 來源已不存在的月份
+            for month in set(old_partitions) - set(partitions):
+                directory = _partition_dir(table, month)
+                if month:
+                    shutil.rmtree(directory, ignore_errors=True)
+                elif os.path.exists(os.path.join(directory, PART_FILE)):
+                    os.remove(os.path.join(directory, PART_FILE))
+
+            written[table] = {"rows": sum(p["rows"] for p in partitions.values()), "partitions": partitions}
+
+        manifest = {
+            "created_at": datetime.now().isoformat(),
+            "source_version": version,
+            "tables": {**manifest.get("tables", {}), **written},
+        }
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        manifest_path = os.path.join(SNAPSHOT_DIR, MANIFEST_FILE)
+        tmp_path = _tmp_path(manifest_path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest
+
+
+def _scheduler_loop(interval_seconds: float):
+    while True:
+        try:
+            write_snapshot()
+        except Exception:
+            logger.exception("分析快照寫入失敗")
+        time.sleep(interval_seconds)
+
+
+def start_snapshot_scheduler(interval_minutes: float = SNAPSHOT_INTERVAL_MINUTES) -> bool:
+    """啟動背景定期快照（同一程序只啟動一次），回傳是否已在執行"""
+    if not PARQUET_AVAILABLE:
+        return False
+    with _lock:
+        if _scheduler["thread"] is None:
+            thread = threading.Thread(target=_scheduler_loop, args=(interval_minutes * 60,),
+                                      name="analytics-snapshot", daemon=True)
+            thread.start()
+            _scheduler["thread"] = thread
+    return True
+
+
+# ============================================
+# 讀取
+# ============================================
+def snapshot_months(table: str) -> List[str]:
+    return sorted(load_manifest().get("tables", {}).get(table, {}).get("partitions", {}))
+
+
+def read_table(table: str, columns: Optional[List[str]] = None, months: Optional[List[str]] = None):
+    """讀取快照資料表為 DataFrame，只讀取指定欄位與月份（memory-mapped）
+
+    分區表會附加 month 欄位；依 seq 排序即為原始資料順序。
+    """
+    if not PARQUET_AVAILABLE:
+        raise ImportError("讀取 Parquet 快照需要安裝 pyarrow")
+
+    file_columns = None if columns is None else [c for c in columns if c != "month"]
+    partitioned = table in PARTITION_FIELD
+    pieces = []
+    for month in snapshot_months(table):
+        if months is not None and month not in months:
+            continue
+        path = os.path.join(_partition_dir(table, month), PART_FILE)
+        if not os.path.exists(path):
+            continue
+        piece = pq.read_table(path, columns=file_columns, memory_map=True)
+        if partitioned:
+            piece = piece.append_column("month", pa.array([month] * piece.num_rows, type=pa.string()))
+        pieces.append(piece)
+
+    if not pieces:
+        schema = table_schema(table)
+        if partitioned:
+            schema = schema.append(pa.field("month", pa.string()))
+        empty = schema.empty_table()
+        return empty.select(columns).to_pandas() if columns else empty.to_pandas()
+
+    arrow_table = pa.concat_tables(pieces)
+    if columns is not None:
+        arrow_table = arrow_table.select(columns)
+    return arrow_table.to_pandas()
+
+
+if __name__ == "__main__":
+    # 獨立執行時沒有衛教推送紀錄（保存在主程式記憶體中），保留既有的推送快照
+    result = write_snapshot(force=True, tables=[t for t in SNAPSHOT_TABLES if t != "pushes"])
+    for name, info in result["tables"].items():
+        print(f"{name}: {info['rows']} 筆，{len(info['partitions'])} 個分區")
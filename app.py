@@ -12,6 +12,9 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import json
+import os
+
+from clinical_options import CLINICAL_OPTIONS, CLINICAL_FIELD_OPTIONS, T_STAGE, N_STAGE, M_STAGE
 
 # 載入設定
 try:
@@ -31,115 +34,37 @@ except:
 try:
     from data_manager import (
         get_all_patients, get_pending_alerts, get_all_alerts,
-        update_alert_status, get_interventions, save_intervention,
-        get_patient_reports, get_statistics, load_data, save_data
+        update_alert_status, get_interventions, save_intervention, count_interventions,
+        attach_patient_info,
+        get_patient_reports, get_statistics, load_data, save_data,
+        save_clinical_data
     )
+    from clinical_store import get_change_history
+    from cohort_query import query_cohort
+    from analytics import get_analytics
+    from alert_escalation import get_escalation_scheduler, ESCALATION_LABELS
+    from symptom_baseline import baseline_summary
+    from symptom_timeline import get_timeline_index, DOWNSAMPLE_MODES
+    from export_pipeline import EXPORT_FORMATS, EXPORT_TABLES
+    from export_jobs import submit_export, list_jobs, has_active_jobs
+    from analytics_snapshot import PARQUET_AVAILABLE, write_snapshot, load_manifest, start_snapshot_scheduler
+    from missed_reports import get_overdue_patients, start_missed_report_sweep
+    from state_service import connection_error
     DATA_MANAGER_AVAILABLE = True
 except:
     DATA_MANAGER_AVAILABLE = False
+    PARQUET_AVAILABLE = False
 
-# ============================================
-# 臨床資料選項定義
-# ============================================
-CLINICAL_OPTIONS = {
-    # 基本資料
-    "gender": ["男", "女"],
-    "smoking_status": ["從未吸菸", "已戒菸", "目前吸菸"],
-    "asa_class": ["I", "II", "III", "IV"],
-    "ecog": ["0", "1", "2", "3", "4"],
-    
-    # 共病
-    "comorbidities": [
-        "COPD", "ILD", "高血壓", "冠心病", "心房顫動", "心衰竭",
-        "糖尿病", "慢性腎臟病", "肝硬化", "腦中風", "其他惡性腫瘤"
-    ],
-    
-    # 腫瘤位置
-    "tumor_location": ["周邊型", "中央型"],
-    "lobe": ["RUL", "RML", "RLL", "LUL", "LLL", "Lingula"],
-    
-    # 手術方式
-    "surgery_type": [
-        "Wedge resection",
-        "Segmentectomy", 
-        "Lobectomy",
-        "Bilobectomy",
-        "Pneumonectomy",
-        "Sleeve resection"
-    ],
-    "surgery_approach": [
-        "VATS (多孔)",
-        "Uniportal VATS",
-        "RATS",
-        "開胸手術",
-        "轉換開胸"
-    ],
-    "ln_dissection": ["系統性淋巴結廓清", "淋巴結取樣", "未執行"],
-    
-    # 病理
-    "pathology_type": [
-        "AIS (原位腺癌)",
-        "MIA (微浸潤腺癌)",
-        "Invasive adenocarcinoma",
-        "Squamous cell carcinoma",
-        "Large cell carcinoma",
-        "Small cell carcinoma",
-        "Carcinoid",
-        "其他"
-    ],
-    "adenocarcinoma_subtype": [
-        "Lepidic", "Acinar", "Papillary", "Micropapillary", "Solid",
-        "Invasive mucinous", "Colloid", "Fetal", "Enteric"
-    ],
-    "margin_status": ["R0 (完全切除)", "R1 (顯微殘留)", "R2 (肉眼殘留)"],
-    "lvi": ["無", "有"],
-    "vpi": ["PL0", "PL1", "PL2", "PL3"],
-    "stas": ["無", "有", "未檢測"],
-    
-    # 分子檢測
-    "egfr_status": ["Wild type", "Exon 19 del", "L858R", "T790M", "Exon 20 ins", "其他突變", "未檢測"],
-    "alk_status": ["陰性", "陽性", "未檢測"],
-    "pdl1_status": ["<1%", "1-49%", "≥50%", "未檢測"],
-    
-    # 術後併發症
-    "complications": [
-        "延遲性氣漏 (>5天)",
-        "肺炎",
-        "心房顫動",
-        "ARDS",
-        "乳糜胸",
-        "術後出血",
-        "再手術",
-        "呼吸衰竭插管",
-        "其他"
-    ],
-    
-    # 術後輔助治療
-    "adjuvant_therapy": [
-        "無需輔助治療",
-        "輔助化療",
-        "輔助標靶治療 (TKI)",
-        "輔助免疫治療",
-        "輔助放射治療",
-        "化療 + 免疫",
-        "待 MDT 討論"
-    ],
-    
-    # 疼痛控制
-    "pain_control": [
-        "PCA",
-        "Intercostal nerve block",
-        "ESP block",
-        "Paravertebral block",
-        "口服止痛藥",
-        "其他"
-    ]
-}
+# 共用狀態服務（多工作程序部署）：連線失敗不影響模組載入，於頁面上提示
+STATE_SERVICE_ERROR = connection_error() if DATA_MANAGER_AVAILABLE else None
+
+# 研究分析快照（需要 pyarrow）
+if DATA_MANAGER_AVAILABLE and PARQUET_AVAILABLE:
+    start_snapshot_scheduler()
 
-# T 分期
-T_STAGE = ["Tis", "T1mi", "T1a", "T1b", "T1c", "T2a", "T2b", "T3", "T4"]
-N_STAGE = ["N0", "N1", "N2", "N3"]
-M_STAGE = ["M0", "M1a", "M1b", "M1c"]
+# 逾期未回報偵測（背景定期檢查並產生追蹤警示）
+if DATA_MANAGER_AVAILABLE:
+    start_missed_report_sweep()
 
 # ============================================
 # 頁面設定
@@ -247,6 +172,10 @@ if 'admin_page' not in st.session_state:
     st.session_state.admin_page = "dashboard"
 if 'selected_patient' not in st.session_state:
     st.session_state.selected_patient = None
+if 'clinical_drafts' not in st.session_state:
+    st.session_state.clinical_drafts = {}  # patient_id -> 尚未儲存的臨床欄位
+if 'clinical_bases' not in st.session_state:
+    st.session_state.clinical_bases = {}  # patient_id -> 開始編輯時載入的臨床資料（儲存時的比對基準）
 
 # ============================================
 # 模擬數據
@@ -284,6 +213,14 @@ def get_alerts_data():
     return MOCK_ALERTS
 
 def get_pending_alerts_data():
+    """待處理警示，依升級排程的分流順序（逾時者優先）"""
+    if DATA_MANAGER_AVAILABLE:
+        try:
+            alerts = get_escalation_scheduler().triage_queue()
+            if alerts:
+                return attach_patient_info(alerts)
+        except:
+            pass
     alerts = get_alerts_data()
     return [a for a in alerts if a.get("status") == "pending"]
 
@@ -299,20 +236,33 @@ def get_stats_data():
         "pending_alerts": len(pending)
     }
 
-def save_patient_clinical_data(patient_id, clinical_data):
-    """儲存病人臨床資料"""
+def stash_clinical_draft(patient_id, section_data):
+    """暫存單一區塊中與載入值不同的欄位（僅存於 session，按下儲存才寫入）"""
+    base = st.session_state.clinical_bases.get(patient_id, {})
+    draft = st.session_state.clinical_drafts.setdefault(patient_id, {})
+    for field, value in section_data.items():
+        if field in base and base[field] == value:
+            draft.pop(field, None)
+        else:
+            draft[field] = value
+    if not draft:
+        st.session_state.clinical_drafts.pop(patient_id, None)
+
+def save_patient_clinical_data(patient_id, base_clinical, clinical_data, legacy=None):
+    """儲存病人臨床資料（欄位層級異動），回傳寫入結果；失敗時回傳 None
+
+    base_clinical 為開始編輯時載入的資料，只有與其不同的欄位會寫入。
+    """
     if DATA_MANAGER_AVAILABLE:
         try:
-            data = load_data()
-            if patient_id in data.get("patients", {}):
-                data["patients"][patient_id]["clinical"] = clinical_data
-                data["patients"][patient_id]["clinical_updated_at"] = datetime.now().isoformat()
-                data["patients"][patient_id]["clinical_updated_by"] = st.session_state.username
-                save_data(data)
-                return True
+            return save_clinical_data(
+                patient_id, base_clinical, clinical_data,
+                user=st.session_state.username,
+                legacy=base_clinical if legacy is None else legacy
+            )
         except Exception as e:
             st.error(f"儲存失敗: {e}")
-    return False
+    return None
 
 # ============================================
 # 登入功能
@@ -458,11 +408,13 @@ def render_alerts():
     st.markdown("## ⚠️ 警示處理")
     all_alerts = get_alerts_data()
     
-    pending = [a for a in all_alerts if a.get("status") == "pending"]
+    pending = get_pending_alerts_data()
     contacted = [a for a in all_alerts if a.get("status") == "contacted"]
     resolved = [a for a in all_alerts if a.get("status") == "resolved"]
+    overdue = get_overdue_patients() if DATA_MANAGER_AVAILABLE else []
     
-    tab1, tab2, tab3 = st.tabs([f"⏳ 待處理 ({len(pending)})", f"📞 聯繫中 ({len(contacted)})", f"✅ 已完成 ({len(resolved)})"])
+    tab1, tab2, tab3, tab4 = st.tabs([f"⏳ 待處理 ({len(pending)})", f"📞 聯繫中 ({len(contacted)})",
+                                      f"✅ 已完成 ({len(resolved)})", f"📵 未回報 ({len(overdue)})"])
     
     with tab1:
         if pending:
@@ -471,11 +423,17 @@ def render_alerts():
                     col1, col2 = st.columns([4, 1])
                     with col1:
                         level = alert.get("level", "yellow")
+                        escalation = ESCALATION_LABELS.get(alert.get("escalation", 0), "") if DATA_MANAGER_AVAILABLE else ""
+                        waited = alert.get("waited_minutes")
+                        waited_text = f"｜已等待 {waited // 60} 小時 {waited % 60} 分" if waited is not None else ""
+                        count_text = f"｜重複觸發 {alert['count']} 次" if alert.get("count", 1) > 1 else ""
                         st.markdown(f"""
                         <div class="alert-card-{level}">
                             <strong>{alert.get('patient_name', '未知')}</strong> | 評分: {alert.get('score', 0)}
+                            {f'<span style="background:#dc2626;color:white;padding:2px 8px;border-radius:4px;font-size:11px;margin-left:6px;">{escalation}</span>' if escalation else ''}
                             <br>症狀: {', '.join(alert.get('symptoms', []))}
-                            <br><small>📱 {alert.get('phone', '')}</small>
+                            {f"<br><small>觸發原因: {'；'.join(alert['reasons'])}</small>" if alert.get('reasons') else ''}
+                            <br><small>📱 {alert.get('phone', '')}{waited_text}{count_text}</small>
                         </div>
                         """, unsafe_allow_html=True)
                     with col2:
@@ -485,6 +443,15 @@ def render_alerts():
                             st.rerun()
         else:
             st.success("🎉 沒有待處理的警示")
+        
+        if DATA_MANAGER_AVAILABLE:
+            events = get_escalation_scheduler().recent_events()
+            if events:
+                with st.expander(f"📜 升級紀錄（最近 {len(events)} 筆）"):
+                    for event in events:
+                        at = datetime.fromisoformat(event["at"]).strftime("%m/%d %H:%M")
+                        level_text = "🔴" if event["level"] == "red" else "🟡"
+                        st.markdown(f"- {at} {level_text} {event['patient_id']} {event['label']}（已等待 {event['waited_minutes']} 分鐘）")
     
     with tab2:
         if contacted:
@@ -499,6 +466,20 @@ def render_alerts():
                 st.success(f"✅ {alert.get('patient_name')} - 已完成")
         else:
             st.info("目前沒有已完成的警示")
+    
+    with tab4:
+        if overdue:
+            st.caption("超過術後排程的預期回報間隔仍未回報的病人（系統每小時檢查，並自動建立追蹤警示）")
+            df = pd.DataFrame([{
+                "病人": item.get("patient_name", item["patient_id"]),
+                "電話": item.get("phone", ""),
+                "最後回報 / 收案日": item["basis"],
+                "未回報天數": item["days_since"],
+                "預期間隔（天）": item["interval"],
+            } for item in overdue])
+            st.dataframe(df, use_container_width=True, hide_index=True)
+        else:
+            st.success("✅ 沒有逾期未回報的病人")
 
 # ============================================
 # 病人管理
@@ -516,37 +497,140 @@ def render_patients():
             with st.expander(f"⚙️ {patient.get('name', '未知')} ({patient.get('phone', '')})"):
                 st.info("請至「📋 臨床資料」頁面完成設定")
     
-    st.markdown("### 📋 病人列表")
-    search = st.text_input("🔍 搜尋", placeholder="姓名或電話...")
+    tab1, tab2, tab3 = st.tabs(["📋 病人列表", "🔎 族群查詢", "📈 症狀趨勢"])
     
-    filtered = active_patients
-    if search:
-        filtered = [p for p in filtered if search in p.get("name", "") or search in p.get("phone", "")]
-    
-    st.markdown(f"**共 {len(filtered)} 位病人**")
-    
-    for patient in filtered:
-        status = patient.get("status", "normal")
-        icon = "🔴" if status == "alert" else "🟡" if status == "warning" else "✅"
+    with tab1:
+        st.markdown("### 📋 病人列表")
+        search = st.text_input("🔍 搜尋", placeholder="姓名或電話...")
         
-        with st.expander(f"{icon} **{patient.get('name', '未知')}** | D+{patient.get('post_op_day', 0)}"):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown(f"""
-                - 年齡: {patient.get('age', '')} 歲
-                - 性別: {patient.get('gender', '未填')}
-                - 電話: {patient.get('phone', '')}
-                """)
-            with col2:
-                st.markdown(f"""
-                - 手術: {patient.get('surgery', '')}
-                - 術後天數: D+{patient.get('post_op_day', 0)}
-                """)
+        filtered = active_patients
+        if search:
+            filtered = [p for p in filtered if search in p.get("name", "") or search in p.get("phone", "")]
+        
+        st.markdown(f"**共 {len(filtered)} 位病人**")
+        
+        for patient in filtered:
+            status = patient.get("status", "normal")
+            icon = "🔴" if status == "alert" else "🟡" if status == "warning" else "✅"
             
-            if st.button("📋 查看/編輯臨床資料", key=f"clinical_{patient.get('id')}"):
-                st.session_state.selected_patient = patient.get('id')
-                st.session_state.admin_page = "clinical"
-                st.rerun()
+            with st.expander(f"{icon} **{patient.get('name', '未知')}** | D+{patient.get('post_op_day', 0)}"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown(f"""
+                    - 年齡: {patient.get('age', '')} 歲
+                    - 性別: {patient.get('gender', '未填')}
+                    - 電話: {patient.get('phone', '')}
+                    """)
+                with col2:
+                    baseline = baseline_summary(patient.get("baselines")) if DATA_MANAGER_AVAILABLE else None
+                    baseline_text = f"{baseline['ewma']:.1f} 分（平均 {baseline['mean']:.1f} ± {baseline['std']:.1f}，{baseline['n']} 筆）" if baseline else "尚無資料"
+                    st.markdown(f"""
+                    - 手術: {patient.get('surgery', '')}
+                    - 術後天數: D+{patient.get('post_op_day', 0)}
+                    - 近期整體分數: {baseline_text}
+                    """)
+                
+                if st.button("📋 查看/編輯臨床資料", key=f"clinical_{patient.get('id')}"):
+                    st.session_state.selected_patient = patient.get('id')
+                    st.session_state.admin_page = "clinical"
+                    st.rerun()
+    
+    with tab2:
+        render_cohort_query(patients)
+    
+    with tab3:
+        render_symptom_timeline(active_patients)
+
+def render_symptom_timeline(patients):
+    """單一病人完整追蹤期間的症狀分數趨勢"""
+    st.markdown("### 📈 症狀趨勢")
+    if not DATA_MANAGER_AVAILABLE:
+        st.info("Demo 模式：症狀趨勢需要資料管理模組")
+        return
+    if not patients:
+        st.caption("尚無病人")
+        return
+    
+    patient_names = {p.get("id"): f"{p.get('name', '未知')} ({p.get('id')})" for p in patients}
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        patient_id = st.selectbox("病人", list(patient_names.keys()), format_func=patient_names.get, key="timeline_patient")
+    with col2:
+        mode = st.selectbox("顯示方式", list(DOWNSAMPLE_MODES.keys()), format_func=DOWNSAMPLE_MODES.get, key="timeline_mode")
+    
+    index = get_timeline_index()
+    available = index.symptoms(patient_id)
+    if not available:
+        st.info("此病人尚無回報")
+        return
+    
+    symptoms = st.multiselect("症狀", available, default=available[:4], key=f"timeline_symptoms_{patient_id}")
+    timeline = index.timeline(patient_id, symptoms, mode=mode)
+    if timeline.empty:
+        return
+    
+    fig = px.line(timeline, x="timestamp", y="score", color="symptom", markers=len(timeline) <= 100,
+                  labels={"timestamp": "日期", "score": "分數", "symptom": "症狀"})
+    fig.update_layout(height=400, yaxis_range=[0, 10.5], legend_title_text="")
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"共 {index.count(patient_id)} 筆回報，圖上每個症狀最多顯示 {timeline.groupby('symptom').size().max()} 點")
+
+def render_cohort_query(patients):
+    """族群查詢：依臨床分期、術式、分子檢測、術後天數與警示狀態篩選病人"""
+    st.markdown("### 🔎 族群查詢")
+    st.caption("同一欄位內任一條件符合即可，不同欄位需同時符合")
+    
+    query_fields = [
+        ("surgery_type", "手術方式"), ("pathology_type", "病理診斷"),
+        ("egfr", "EGFR"), ("pdl1", "PD-L1"),
+        ("c_t", "cT"), ("p_t", "pT"), ("p_n", "pN"), ("p_m", "pM"),
+        ("adjuvant", "輔助治療"), ("smoking_status", "吸菸狀態"),
+        ("comorbidities", "共病"), ("complications", "術後併發症"),
+    ]
+    
+    filters = {}
+    cols = st.columns(4)
+    for i, (field, label) in enumerate(query_fields):
+        with cols[i % 4]:
+            options = CLINICAL_FIELD_OPTIONS.get(field) or CLINICAL_OPTIONS.get(field, [])
+            filters[field] = st.multiselect(label, options, key=f"cohort_{field}")
+    
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        use_day_range = st.checkbox("限制術後天數", key="cohort_use_days")
+        day_range = st.slider("術後天數 (D+)", 0, 365, (30, 90), key="cohort_days", disabled=not use_day_range)
+    with col2:
+        alert_labels = {"不限": None, "任一待處理警示": "any", "🔴 待處理紅色警示": "red", "🟡 待處理黃色警示": "yellow"}
+        alert_choice = st.selectbox("警示狀態", list(alert_labels.keys()), key="cohort_alert")
+    
+    if not DATA_MANAGER_AVAILABLE:
+        st.info("Demo 模式：族群查詢需要資料管理模組")
+        return
+    
+    patient_ids = query_cohort(
+        {f: v for f, v in filters.items() if v},
+        post_op_day=day_range if use_day_range else (None, None),
+        pending_alert=alert_labels[alert_choice]
+    )
+    
+    st.markdown(f"**符合條件：{len(patient_ids)} 位病人**")
+    if patient_ids:
+        patients_by_id = {p.get("id"): p for p in patients}
+        rows = []
+        for pid in patient_ids[:500]:
+            p = patients_by_id.get(pid, {})
+            clinical = p.get("clinical", {})
+            rows.append({
+                "ID": pid,
+                "姓名": p.get("name", ""),
+                "手術方式": clinical.get("surgery_type", ""),
+                "EGFR": clinical.get("egfr", ""),
+                "pTNM": f"{clinical.get('p_t', '')}{clinical.get('p_n', '')}{clinical.get('p_m', '')}",
+                "狀態": p.get("status", ""),
+            })
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        if len(patient_ids) > 500:
+            st.caption("僅顯示前 500 位")
 
 # ============================================
 # 臨床資料管理（核心功能）
@@ -575,8 +659,12 @@ def render_clinical():
         st.error("找不到病人資料")
         return
     
-    # 取得現有臨床資料
-    clinical = patient.get("clinical", {})
+    # 尚無暫存時，以目前資料作為本次編輯的比對基準（有暫存後固定，儲存時不會覆寫他人的修改）
+    if patient_id not in st.session_state.clinical_drafts:
+        st.session_state.clinical_bases[patient_id] = dict(patient.get("clinical", {}))
+    
+    # 取得現有臨床資料（疊加尚未儲存的暫存內容）
+    clinical = {**patient.get("clinical", {}), **st.session_state.clinical_drafts.get(patient_id, {})}
     
     st.markdown(f"### 📋 {patient.get('name', '')} 的臨床資料")
     
@@ -596,279 +684,364 @@ def render_clinical():
     with tabs[0]:
         st.markdown('<div class="section-header">一、病患基本資料與共病</div>', unsafe_allow_html=True)
         
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            age = st.number_input("年齡", value=clinical.get("age", patient.get("age", 65)), min_value=18, max_value=120)
-            gender = st.selectbox("性別", CLINICAL_OPTIONS["gender"], index=CLINICAL_OPTIONS["gender"].index(clinical.get("gender", "男")) if clinical.get("gender") in CLINICAL_OPTIONS["gender"] else 0)
-            height = st.number_input("身高 (cm)", value=clinical.get("height", 165), min_value=100, max_value=220)
-            weight = st.number_input("體重 (kg)", value=clinical.get("weight", 60.0), min_value=30.0, max_value=200.0, step=0.1)
-        
-        with col2:
-            bmi = weight / ((height/100) ** 2) if height > 0 else 0
-            st.metric("BMI", f"{bmi:.1f}")
-            smoking_status = st.selectbox("吸菸狀態", CLINICAL_OPTIONS["smoking_status"], index=CLINICAL_OPTIONS["smoking_status"].index(clinical.get("smoking_status", "從未吸菸")) if clinical.get("smoking_status") in CLINICAL_OPTIONS["smoking_status"] else 0)
-            pack_year = st.number_input("Pack-year", value=clinical.get("pack_year", 0), min_value=0, max_value=200)
-        
-        with col3:
-            asa_class = st.selectbox("ASA Class", CLINICAL_OPTIONS["asa_class"], index=CLINICAL_OPTIONS["asa_class"].index(clinical.get("asa_class", "II")) if clinical.get("asa_class") in CLINICAL_OPTIONS["asa_class"] else 1)
-            ecog = st.selectbox("ECOG Performance Status", CLINICAL_OPTIONS["ecog"], index=CLINICAL_OPTIONS["ecog"].index(clinical.get("ecog", "0")) if clinical.get("ecog") in CLINICAL_OPTIONS["ecog"] else 0)
-        
-        st.markdown("**肺功能**")
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            fev1 = st.number_input("FEV1 (%)", value=clinical.get("fev1", 80), min_value=0, max_value=150)
-        with col2:
-            dlco = st.number_input("DLCO (%)", value=clinical.get("dlco", 80), min_value=0, max_value=150)
-        with col3:
-            ppo_fev1 = st.number_input("ppoFEV1 (%)", value=clinical.get("ppo_fev1", 0), min_value=0, max_value=150)
-        with col4:
-            ppo_dlco = st.number_input("ppoDLCO (%)", value=clinical.get("ppo_dlco", 0), min_value=0, max_value=150)
-        
-        st.markdown("**共病**")
-        comorbidities = st.multiselect("選擇共病", CLINICAL_OPTIONS["comorbidities"], default=clinical.get("comorbidities", []))
-        
-        prior_thoracic = st.checkbox("既往胸腔手術史", value=clinical.get("prior_thoracic", False))
-        prior_radiation = st.checkbox("既往胸腔放射治療史", value=clinical.get("prior_radiation", False))
+        with st.form(f"clinical_basic_{patient_id}"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                age = st.number_input("年齡", value=clinical.get("age", patient.get("age", 65)), min_value=18, max_value=120)
+                gender = st.selectbox("性別", CLINICAL_OPTIONS["gender"], index=CLINICAL_OPTIONS["gender"].index(clinical.get("gender", "男")) if clinical.get("gender") in CLINICAL_OPTIONS["gender"] else 0)
+                height = st.number_input("身高 (cm)", value=clinical.get("height", 165), min_value=100, max_value=220)
+                weight = st.number_input("體重 (kg)", value=clinical.get("weight", 60.0), min_value=30.0, max_value=200.0, step=0.1)
+            
+            with col2:
+                bmi = weight / ((height/100) ** 2) if height > 0 else 0
+                st.metric("BMI", f"{bmi:.1f}")
+                smoking_status = st.selectbox("吸菸狀態", CLINICAL_OPTIONS["smoking_status"], index=CLINICAL_OPTIONS["smoking_status"].index(clinical.get("smoking_status", "從未吸菸")) if clinical.get("smoking_status") in CLINICAL_OPTIONS["smoking_status"] else 0)
+                pack_year = st.number_input("Pack-year", value=clinical.get("pack_year", 0), min_value=0, max_value=200)
+            
+            with col3:
+                asa_class = st.selectbox("ASA Class", CLINICAL_OPTIONS["asa_class"], index=CLINICAL_OPTIONS["asa_class"].index(clinical.get("asa_class", "II")) if clinical.get("asa_class") in CLINICAL_OPTIONS["asa_class"] else 1)
+                ecog = st.selectbox("ECOG Performance Status", CLINICAL_OPTIONS["ecog"], index=CLINICAL_OPTIONS["ecog"].index(clinical.get("ecog", "0")) if clinical.get("ecog") in CLINICAL_OPTIONS["ecog"] else 0)
+            
+            st.markdown("**肺功能**")
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                fev1 = st.number_input("FEV1 (%)", value=clinical.get("fev1", 80), min_value=0, max_value=150)
+            with col2:
+                dlco = st.number_input("DLCO (%)", value=clinical.get("dlco", 80), min_value=0, max_value=150)
+            with col3:
+                ppo_fev1 = st.number_input("ppoFEV1 (%)", value=clinical.get("ppo_fev1", 0), min_value=0, max_value=150)
+            with col4:
+                ppo_dlco = st.number_input("ppoDLCO (%)", value=clinical.get("ppo_dlco", 0), min_value=0, max_value=150)
+            
+            st.markdown("**共病**")
+            comorbidities = st.multiselect("選擇共病", CLINICAL_OPTIONS["comorbidities"], default=clinical.get("comorbidities", []))
+            
+            prior_thoracic = st.checkbox("既往胸腔手術史", value=clinical.get("prior_thoracic", False))
+            prior_radiation = st.checkbox("既往胸腔放射治療史", value=clinical.get("prior_radiation", False))
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                stash_clinical_draft(patient_id, {
+                    "age": age, "gender": gender, "height": height, "weight": weight,
+                    "smoking_status": smoking_status, "pack_year": pack_year,
+                    "asa_class": asa_class, "ecog": ecog,
+                    "fev1": fev1, "dlco": dlco, "ppo_fev1": ppo_fev1, "ppo_dlco": ppo_dlco,
+                    "comorbidities": comorbidities,
+                    "prior_thoracic": prior_thoracic, "prior_radiation": prior_radiation,
+                })
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 二、腫瘤特徵 ===
     with tabs[1]:
         st.markdown('<div class="section-header">二、影像與腫瘤特徵</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            tumor_size = st.number_input("腫瘤最大徑 (cm)", value=clinical.get("tumor_size", 2.0), min_value=0.1, max_value=20.0, step=0.1)
-            tumor_location = st.selectbox("腫瘤位置", CLINICAL_OPTIONS["tumor_location"], index=CLINICAL_OPTIONS["tumor_location"].index(clinical.get("tumor_location", "周邊型")) if clinical.get("tumor_location") in CLINICAL_OPTIONS["tumor_location"] else 0)
-            lobe = st.selectbox("分葉位置", CLINICAL_OPTIONS["lobe"], index=CLINICAL_OPTIONS["lobe"].index(clinical.get("lobe", "RUL")) if clinical.get("lobe") in CLINICAL_OPTIONS["lobe"] else 0)
-        
-        with col2:
-            ggo_ratio = st.slider("GGO Ratio (%)", 0, 100, clinical.get("ggo_ratio", 50))
-            ctr = st.slider("CTR - Consolidation Tumor Ratio (%)", 0, 100, clinical.get("ctr", 50))
-            suv_max = st.number_input("SUVmax (PET-CT)", value=clinical.get("suv_max", 0.0), min_value=0.0, max_value=50.0, step=0.1)
-        
-        st.markdown("**影像學分期 (cTNM)**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            c_t = st.selectbox("cT", T_STAGE, index=T_STAGE.index(clinical.get("c_t", "T1a")) if clinical.get("c_t") in T_STAGE else 2)
-        with col2:
-            c_n = st.selectbox("cN", N_STAGE, index=N_STAGE.index(clinical.get("c_n", "N0")) if clinical.get("c_n") in N_STAGE else 0)
-        with col3:
-            c_m = st.selectbox("cM", M_STAGE, index=M_STAGE.index(clinical.get("c_m", "M0")) if clinical.get("c_m") in M_STAGE else 0)
-        
-        multiple_lesions = st.checkbox("多發病灶", value=clinical.get("multiple_lesions", False))
-        pleural_invasion_image = st.checkbox("影像學疑似胸膜侵犯", value=clinical.get("pleural_invasion_image", False))
+        with st.form(f"clinical_tumor_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                tumor_size = st.number_input("腫瘤最大徑 (cm)", value=clinical.get("tumor_size", 2.0), min_value=0.1, max_value=20.0, step=0.1)
+                tumor_location = st.selectbox("腫瘤位置", CLINICAL_OPTIONS["tumor_location"], index=CLINICAL_OPTIONS["tumor_location"].index(clinical.get("tumor_location", "周邊型")) if clinical.get("tumor_location") in CLINICAL_OPTIONS["tumor_location"] else 0)
+                lobe = st.selectbox("分葉位置", CLINICAL_OPTIONS["lobe"], index=CLINICAL_OPTIONS["lobe"].index(clinical.get("lobe", "RUL")) if clinical.get("lobe") in CLINICAL_OPTIONS["lobe"] else 0)
+            
+            with col2:
+                ggo_ratio = st.slider("GGO Ratio (%)", 0, 100, clinical.get("ggo_ratio", 50))
+                ctr = st.slider("CTR - Consolidation Tumor Ratio (%)", 0, 100, clinical.get("ctr", 50))
+                suv_max = st.number_input("SUVmax (PET-CT)", value=clinical.get("suv_max", 0.0), min_value=0.0, max_value=50.0, step=0.1)
+            
+            st.markdown("**影像學分期 (cTNM)**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                c_t = st.selectbox("cT", T_STAGE, index=T_STAGE.index(clinical.get("c_t", "T1a")) if clinical.get("c_t") in T_STAGE else 2)
+            with col2:
+                c_n = st.selectbox("cN", N_STAGE, index=N_STAGE.index(clinical.get("c_n", "N0")) if clinical.get("c_n") in N_STAGE else 0)
+            with col3:
+                c_m = st.selectbox("cM", M_STAGE, index=M_STAGE.index(clinical.get("c_m", "M0")) if clinical.get("c_m") in M_STAGE else 0)
+            
+            multiple_lesions = st.checkbox("多發病灶", value=clinical.get("multiple_lesions", False))
+            pleural_invasion_image = st.checkbox("影像學疑似胸膜侵犯", value=clinical.get("pleural_invasion_image", False))
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                stash_clinical_draft(patient_id, {
+                    "tumor_size": tumor_size, "tumor_location": tumor_location, "lobe": lobe,
+                    "ggo_ratio": ggo_ratio, "ctr": ctr, "suv_max": suv_max,
+                    "c_t": c_t, "c_n": c_n, "c_m": c_m,
+                    "multiple_lesions": multiple_lesions, "pleural_invasion_image": pleural_invasion_image,
+                })
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 三、手術資訊 ===
     with tabs[2]:
         st.markdown('<div class="section-header">三、術式與手術特徵</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            surgery_date = st.date_input("手術日期", value=datetime.strptime(clinical.get("surgery_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d").date() if clinical.get("surgery_date") else datetime.now().date())
-            surgery_type = st.selectbox("手術方式", CLINICAL_OPTIONS["surgery_type"], index=CLINICAL_OPTIONS["surgery_type"].index(clinical.get("surgery_type", "Lobectomy")) if clinical.get("surgery_type") in CLINICAL_OPTIONS["surgery_type"] else 2)
-            surgery_approach = st.selectbox("手術途徑", CLINICAL_OPTIONS["surgery_approach"], index=CLINICAL_OPTIONS["surgery_approach"].index(clinical.get("surgery_approach", "VATS (多孔)")) if clinical.get("surgery_approach") in CLINICAL_OPTIONS["surgery_approach"] else 0)
-        
-        with col2:
-            op_time = st.number_input("手術時間 (分鐘)", value=clinical.get("op_time", 180), min_value=0, max_value=1000)
-            ebl = st.number_input("出血量 (ml)", value=clinical.get("ebl", 100), min_value=0, max_value=5000)
-            conversion = st.checkbox("轉換開胸", value=clinical.get("conversion", False))
-        
-        st.markdown("**淋巴結處理**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            ln_dissection = st.selectbox("淋巴結處理", CLINICAL_OPTIONS["ln_dissection"], index=CLINICAL_OPTIONS["ln_dissection"].index(clinical.get("ln_dissection", "系統性淋巴結廓清")) if clinical.get("ln_dissection") in CLINICAL_OPTIONS["ln_dissection"] else 0)
-        with col2:
-            ln_stations = st.number_input("採檢站數", value=clinical.get("ln_stations", 5), min_value=0, max_value=20)
-        with col3:
-            ln_total = st.number_input("採檢顆數", value=clinical.get("ln_total", 15), min_value=0, max_value=100)
-        
-        combined_procedure = st.text_input("合併手術", value=clinical.get("combined_procedure", ""), placeholder="例如：pleurectomy, decortication")
+        with st.form(f"clinical_surgery_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                surgery_date = st.date_input("手術日期", value=datetime.strptime(clinical.get("surgery_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d").date() if clinical.get("surgery_date") else datetime.now().date())
+                surgery_type = st.selectbox("手術方式", CLINICAL_OPTIONS["surgery_type"], index=CLINICAL_OPTIONS["surgery_type"].index(clinical.get("surgery_type", "Lobectomy")) if clinical.get("surgery_type") in CLINICAL_OPTIONS["surgery_type"] else 2)
+                surgery_approach = st.selectbox("手術途徑", CLINICAL_OPTIONS["surgery_approach"], index=CLINICAL_OPTIONS["surgery_approach"].index(clinical.get("surgery_approach", "VATS (多孔)")) if clinical.get("surgery_approach") in CLINICAL_OPTIONS["surgery_approach"] else 0)
+            
+            with col2:
+                op_time = st.number_input("手術時間 (分鐘)", value=clinical.get("op_time", 180), min_value=0, max_value=1000)
+                ebl = st.number_input("出血量 (ml)", value=clinical.get("ebl", 100), min_value=0, max_value=5000)
+                conversion = st.checkbox("轉換開胸", value=clinical.get("conversion", False))
+            
+            st.markdown("**淋巴結處理**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                ln_dissection = st.selectbox("淋巴結處理", CLINICAL_OPTIONS["ln_dissection"], index=CLINICAL_OPTIONS["ln_dissection"].index(clinical.get("ln_dissection", "系統性淋巴結廓清")) if clinical.get("ln_dissection") in CLINICAL_OPTIONS["ln_dissection"] else 0)
+            with col2:
+                ln_stations = st.number_input("採檢站數", value=clinical.get("ln_stations", 5), min_value=0, max_value=20)
+            with col3:
+                ln_total = st.number_input("採檢顆數", value=clinical.get("ln_total", 15), min_value=0, max_value=100)
+            
+            combined_procedure = st.text_input("合併手術", value=clinical.get("combined_procedure", ""), placeholder="例如：pleurectomy, decortication")
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                stash_clinical_draft(patient_id, {
+                    "surgery_date": surgery_date.strftime("%Y-%m-%d"),
+                    "surgery_type": surgery_type, "surgery_approach": surgery_approach,
+                    "op_time": op_time, "ebl": ebl, "conversion": conversion,
+                    "ln_dissection": ln_dissection, "ln_stations": ln_stations, "ln_total": ln_total,
+                    "combined_procedure": combined_procedure,
+                })
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 四、病理結果 ===
     with tabs[3]:
         st.markdown('<div class="section-header">四、病理結果</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            pathology_type = st.selectbox("病理診斷", CLINICAL_OPTIONS["pathology_type"], index=CLINICAL_OPTIONS["pathology_type"].index(clinical.get("pathology_type", "Invasive adenocarcinoma")) if clinical.get("pathology_type") in CLINICAL_OPTIONS["pathology_type"] else 2)
+        with st.form(f"clinical_pathology_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                pathology_type = st.selectbox("病理診斷", CLINICAL_OPTIONS["pathology_type"], index=CLINICAL_OPTIONS["pathology_type"].index(clinical.get("pathology_type", "Invasive adenocarcinoma")) if clinical.get("pathology_type") in CLINICAL_OPTIONS["pathology_type"] else 2)
             
-            if "adenocarcinoma" in pathology_type.lower():
-                adeno_subtype = st.selectbox("腺癌亞型", CLINICAL_OPTIONS["adenocarcinoma_subtype"], index=CLINICAL_OPTIONS["adenocarcinoma_subtype"].index(clinical.get("adeno_subtype", "Acinar")) if clinical.get("adeno_subtype") in CLINICAL_OPTIONS["adenocarcinoma_subtype"] else 1)
+                # 表單內的選擇送出前不會重新執行，亞型一律顯示，病理診斷為腺癌時才儲存
+                adeno_subtype = st.selectbox("腺癌亞型（腺癌時填寫）", CLINICAL_OPTIONS["adenocarcinoma_subtype"], index=CLINICAL_OPTIONS["adenocarcinoma_subtype"].index(clinical.get("adeno_subtype", "Acinar")) if clinical.get("adeno_subtype") in CLINICAL_OPTIONS["adenocarcinoma_subtype"] else 1)
             
-            margin_status = st.selectbox("Margin 狀態", CLINICAL_OPTIONS["margin_status"], index=CLINICAL_OPTIONS["margin_status"].index(clinical.get("margin_status", "R0 (完全切除)")) if clinical.get("margin_status") in CLINICAL_OPTIONS["margin_status"] else 0)
-        
-        with col2:
-            lvi = st.selectbox("Lymphovascular Invasion", CLINICAL_OPTIONS["lvi"], index=CLINICAL_OPTIONS["lvi"].index(clinical.get("lvi", "無")) if clinical.get("lvi") in CLINICAL_OPTIONS["lvi"] else 0)
-            vpi = st.selectbox("Visceral Pleural Invasion", CLINICAL_OPTIONS["vpi"], index=CLINICAL_OPTIONS["vpi"].index(clinical.get("vpi", "PL0")) if clinical.get("vpi") in CLINICAL_OPTIONS["vpi"] else 0)
-            stas = st.selectbox("STAS", CLINICAL_OPTIONS["stas"], index=CLINICAL_OPTIONS["stas"].index(clinical.get("stas", "無")) if clinical.get("stas") in CLINICAL_OPTIONS["stas"] else 0)
-        
-        st.markdown("**病理分期 (pTNM)**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            p_t = st.selectbox("pT", T_STAGE, index=T_STAGE.index(clinical.get("p_t", "T1a")) if clinical.get("p_t") in T_STAGE else 2, key="p_t")
-        with col2:
-            p_n = st.selectbox("pN", N_STAGE, index=N_STAGE.index(clinical.get("p_n", "N0")) if clinical.get("p_n") in N_STAGE else 0, key="p_n")
-        with col3:
-            p_m = st.selectbox("pM", M_STAGE, index=M_STAGE.index(clinical.get("p_m", "M0")) if clinical.get("p_m") in M_STAGE else 0, key="p_m")
-        
-        st.markdown("**分子檢測**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            egfr = st.selectbox("EGFR", CLINICAL_OPTIONS["egfr_status"], index=CLINICAL_OPTIONS["egfr_status"].index(clinical.get("egfr", "未檢測")) if clinical.get("egfr") in CLINICAL_OPTIONS["egfr_status"] else 6)
-        with col2:
-            alk = st.selectbox("ALK", CLINICAL_OPTIONS["alk_status"], index=CLINICAL_OPTIONS["alk_status"].index(clinical.get("alk", "未檢測")) if clinical.get("alk") in CLINICAL_OPTIONS["alk_status"] else 2)
-        with col3:
-            pdl1 = st.selectbox("PD-L1", CLINICAL_OPTIONS["pdl1_status"], index=CLINICAL_OPTIONS["pdl1_status"].index(clinical.get("pdl1", "未檢測")) if clinical.get("pdl1") in CLINICAL_OPTIONS["pdl1_status"] else 3)
+                margin_status = st.selectbox("Margin 狀態", CLINICAL_OPTIONS["margin_status"], index=CLINICAL_OPTIONS["margin_status"].index(clinical.get("margin_status", "R0 (完全切除)")) if clinical.get("margin_status") in CLINICAL_OPTIONS["margin_status"] else 0)
+            
+            with col2:
+                lvi = st.selectbox("Lymphovascular Invasion", CLINICAL_OPTIONS["lvi"], index=CLINICAL_OPTIONS["lvi"].index(clinical.get("lvi", "無")) if clinical.get("lvi") in CLINICAL_OPTIONS["lvi"] else 0)
+                vpi = st.selectbox("Visceral Pleural Invasion", CLINICAL_OPTIONS["vpi"], index=CLINICAL_OPTIONS["vpi"].index(clinical.get("vpi", "PL0")) if clinical.get("vpi") in CLINICAL_OPTIONS["vpi"] else 0)
+                stas = st.selectbox("STAS", CLINICAL_OPTIONS["stas"], index=CLINICAL_OPTIONS["stas"].index(clinical.get("stas", "無")) if clinical.get("stas") in CLINICAL_OPTIONS["stas"] else 0)
+            
+            st.markdown("**病理分期 (pTNM)**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                p_t = st.selectbox("pT", T_STAGE, index=T_STAGE.index(clinical.get("p_t", "T1a")) if clinical.get("p_t") in T_STAGE else 2, key="p_t")
+            with col2:
+                p_n = st.selectbox("pN", N_STAGE, index=N_STAGE.index(clinical.get("p_n", "N0")) if clinical.get("p_n") in N_STAGE else 0, key="p_n")
+            with col3:
+                p_m = st.selectbox("pM", M_STAGE, index=M_STAGE.index(clinical.get("p_m", "M0")) if clinical.get("p_m") in M_STAGE else 0, key="p_m")
+            
+            st.markdown("**分子檢測**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                egfr = st.selectbox("EGFR", CLINICAL_OPTIONS["egfr_status"], index=CLINICAL_OPTIONS["egfr_status"].index(clinical.get("egfr", "未檢測")) if clinical.get("egfr") in CLINICAL_OPTIONS["egfr_status"] else 6)
+            with col2:
+                alk = st.selectbox("ALK", CLINICAL_OPTIONS["alk_status"], index=CLINICAL_OPTIONS["alk_status"].index(clinical.get("alk", "未檢測")) if clinical.get("alk") in CLINICAL_OPTIONS["alk_status"] else 2)
+            with col3:
+                pdl1 = st.selectbox("PD-L1", CLINICAL_OPTIONS["pdl1_status"], index=CLINICAL_OPTIONS["pdl1_status"].index(clinical.get("pdl1", "未檢測")) if clinical.get("pdl1") in CLINICAL_OPTIONS["pdl1_status"] else 3)
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                section = {
+                    "pathology_type": pathology_type, "margin_status": margin_status,
+                    "lvi": lvi, "vpi": vpi, "stas": stas,
+                    "p_t": p_t, "p_n": p_n, "p_m": p_m,
+                    "egfr": egfr, "alk": alk, "pdl1": pdl1,
+                }
+                if "adenocarcinoma" in pathology_type.lower():
+                    section["adeno_subtype"] = adeno_subtype
+                stash_clinical_draft(patient_id, section)
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 五、併發症 ===
     with tabs[4]:
         st.markdown('<div class="section-header">五、圍手術期照護與併發症</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            complications = st.multiselect("術後併發症", CLINICAL_OPTIONS["complications"], default=clinical.get("complications", []))
-            icu_days = st.number_input("ICU 天數", value=clinical.get("icu_days", 0), min_value=0, max_value=100)
-        
-        with col2:
-            chest_tube_count = st.number_input("胸管支數", value=clinical.get("chest_tube_count", 1), min_value=0, max_value=5)
-            chest_tube_days = st.number_input("胸管留置天數", value=clinical.get("chest_tube_days", 3), min_value=0, max_value=60)
-            air_leak_grade = st.selectbox("氣漏程度", ["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"], index=["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"].index(clinical.get("air_leak_grade", "無")) if clinical.get("air_leak_grade") in ["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"] else 0)
-        
-        st.markdown("**住院相關**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            los = st.number_input("住院天數", value=clinical.get("los", 5), min_value=0, max_value=365)
-        with col2:
-            readmit_30 = st.checkbox("30天內再入院", value=clinical.get("readmit_30", False))
-        with col3:
-            readmit_90 = st.checkbox("90天內再入院", value=clinical.get("readmit_90", False))
+        with st.form(f"clinical_complications_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                complications = st.multiselect("術後併發症", CLINICAL_OPTIONS["complications"], default=clinical.get("complications", []))
+                icu_days = st.number_input("ICU 天數", value=clinical.get("icu_days", 0), min_value=0, max_value=100)
+            
+            with col2:
+                chest_tube_count = st.number_input("胸管支數", value=clinical.get("chest_tube_count", 1), min_value=0, max_value=5)
+                chest_tube_days = st.number_input("胸管留置天數", value=clinical.get("chest_tube_days", 3), min_value=0, max_value=60)
+                air_leak_grade = st.selectbox("氣漏程度", ["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"], index=["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"].index(clinical.get("air_leak_grade", "無")) if clinical.get("air_leak_grade") in ["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"] else 0)
+            
+            st.markdown("**住院相關**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                los = st.number_input("住院天數", value=clinical.get("los", 5), min_value=0, max_value=365)
+            with col2:
+                readmit_30 = st.checkbox("30天內再入院", value=clinical.get("readmit_30", False))
+            with col3:
+                readmit_90 = st.checkbox("90天內再入院", value=clinical.get("readmit_90", False))
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                stash_clinical_draft(patient_id, {
+                    "complications": complications, "icu_days": icu_days,
+                    "chest_tube_count": chest_tube_count, "chest_tube_days": chest_tube_days,
+                    "air_leak_grade": air_leak_grade, "los": los,
+                    "readmit_30": readmit_30, "readmit_90": readmit_90,
+                })
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 六、康復追蹤 ===
     with tabs[5]:
         st.markdown('<div class="section-header">六、功能回復與康復</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            preop_rehab = st.checkbox("術前肺復健", value=clinical.get("preop_rehab", False))
-            early_ambulation = st.checkbox("術後早期下床 (POD1)", value=clinical.get("early_ambulation", True))
-            incentive_spirometer = st.selectbox("呼吸訓練依從性", ["優良", "普通", "差", "未執行"], index=["優良", "普通", "差", "未執行"].index(clinical.get("incentive_spirometer", "優良")) if clinical.get("incentive_spirometer") in ["優良", "普通", "差", "未執行"] else 0)
-        
-        with col2:
-            pain_control = st.multiselect("疼痛控制方式", CLINICAL_OPTIONS["pain_control"], default=clinical.get("pain_control", []))
-            adl_recovery = st.selectbox("ADL 回復程度", ["完全獨立", "輕度依賴", "中度依賴", "重度依賴"], index=["完全獨立", "輕度依賴", "中度依賴", "重度依賴"].index(clinical.get("adl_recovery", "完全獨立")) if clinical.get("adl_recovery") in ["完全獨立", "輕度依賴", "中度依賴", "重度依賴"] else 0)
-        
-        follow_up_compliance = st.slider("回診依從性 (%)", 0, 100, clinical.get("follow_up_compliance", 100))
+        with st.form(f"clinical_recovery_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                preop_rehab = st.checkbox("術前肺復健", value=clinical.get("preop_rehab", False))
+                early_ambulation = st.checkbox("術後早期下床 (POD1)", value=clinical.get("early_ambulation", True))
+                incentive_spirometer = st.selectbox("呼吸訓練依從性", ["優良", "普通", "差", "未執行"], index=["優良", "普通", "差", "未執行"].index(clinical.get("incentive_spirometer", "優良")) if clinical.get("incentive_spirometer") in ["優良", "普通", "差", "未執行"] else 0)
+            
+            with col2:
+                pain_control = st.multiselect("疼痛控制方式", CLINICAL_OPTIONS["pain_control"], default=clinical.get("pain_control", []))
+                adl_recovery = st.selectbox("ADL 回復程度", ["完全獨立", "輕度依賴", "中度依賴", "重度依賴"], index=["完全獨立", "輕度依賴", "中度依賴", "重度依賴"].index(clinical.get("adl_recovery", "完全獨立")) if clinical.get("adl_recovery") in ["完全獨立", "輕度依賴", "中度依賴", "重度依賴"] else 0)
+            
+            follow_up_compliance = st.slider("回診依從性 (%)", 0, 100, clinical.get("follow_up_compliance", 100))
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                stash_clinical_draft(patient_id, {
+                    "preop_rehab": preop_rehab, "early_ambulation": early_ambulation,
+                    "incentive_spirometer": incentive_spirometer, "pain_control": pain_control,
+                    "adl_recovery": adl_recovery, "follow_up_compliance": follow_up_compliance,
+                })
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 七、後續治療 ===
     with tabs[6]:
         st.markdown('<div class="section-header">七、腫瘤治療後續追蹤</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            adjuvant = st.selectbox("輔助治療", CLINICAL_OPTIONS["adjuvant_therapy"], index=CLINICAL_OPTIONS["adjuvant_therapy"].index(clinical.get("adjuvant", "無需輔助治療")) if clinical.get("adjuvant") in CLINICAL_OPTIONS["adjuvant_therapy"] else 0)
-            mdt_date = st.date_input("MDT 討論日期", value=datetime.strptime(clinical.get("mdt_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d").date() if clinical.get("mdt_date") else None)
-        
-        with col2:
-            mdt_decision = st.text_area("MDT 決議內容", value=clinical.get("mdt_decision", ""), height=100)
-        
-        st.markdown("**追蹤影像排程**")
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            fu_3m = st.date_input("3個月 CT", value=datetime.strptime(clinical.get("fu_3m", ""), "%Y-%m-%d").date() if clinical.get("fu_3m") else None, key="fu_3m")
-        with col2:
-            fu_6m = st.date_input("6個月 CT", value=datetime.strptime(clinical.get("fu_6m", ""), "%Y-%m-%d").date() if clinical.get("fu_6m") else None, key="fu_6m")
-        with col3:
-            fu_12m = st.date_input("12個月 CT", value=datetime.strptime(clinical.get("fu_12m", ""), "%Y-%m-%d").date() if clinical.get("fu_12m") else None, key="fu_12m")
-        
-        recurrence = st.checkbox("復發", value=clinical.get("recurrence", False))
-        if recurrence:
-            recurrence_type = st.selectbox("復發類型", ["局部復發", "遠端轉移", "局部+遠端"], index=["局部復發", "遠端轉移", "局部+遠端"].index(clinical.get("recurrence_type", "局部復發")) if clinical.get("recurrence_type") in ["局部復發", "遠端轉移", "局部+遠端"] else 0)
-            recurrence_date = st.date_input("復發日期")
+        with st.form(f"clinical_treatment_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                adjuvant = st.selectbox("輔助治療", CLINICAL_OPTIONS["adjuvant_therapy"], index=CLINICAL_OPTIONS["adjuvant_therapy"].index(clinical.get("adjuvant", "無需輔助治療")) if clinical.get("adjuvant") in CLINICAL_OPTIONS["adjuvant_therapy"] else 0)
+                mdt_date = st.date_input("MDT 討論日期", value=datetime.strptime(clinical.get("mdt_date", datetime.now().strftime("%Y-%m-%d")), "%Y-%m-%d").date() if clinical.get("mdt_date") else None)
+            
+            with col2:
+                mdt_decision = st.text_area("MDT 決議內容", value=clinical.get("mdt_decision", ""), height=100)
+            
+            st.markdown("**追蹤影像排程**")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                fu_3m = st.date_input("3個月 CT", value=datetime.strptime(clinical.get("fu_3m", ""), "%Y-%m-%d").date() if clinical.get("fu_3m") else None, key="fu_3m")
+            with col2:
+                fu_6m = st.date_input("6個月 CT", value=datetime.strptime(clinical.get("fu_6m", ""), "%Y-%m-%d").date() if clinical.get("fu_6m") else None, key="fu_6m")
+            with col3:
+                fu_12m = st.date_input("12個月 CT", value=datetime.strptime(clinical.get("fu_12m", ""), "%Y-%m-%d").date() if clinical.get("fu_12m") else None, key="fu_12m")
+            
+            # 表單內勾選送出前不會重新執行，復發類型與日期一律顯示，勾選復發時才儲存
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                recurrence = st.checkbox("復發", value=clinical.get("recurrence", False))
+            with col2:
+                recurrence_type = st.selectbox("復發類型（復發時填寫）", ["局部復發", "遠端轉移", "局部+遠端"], index=["局部復發", "遠端轉移", "局部+遠端"].index(clinical.get("recurrence_type", "局部復發")) if clinical.get("recurrence_type") in ["局部復發", "遠端轉移", "局部+遠端"] else 0)
+            with col3:
+                recurrence_date = st.date_input("復發日期（復發時填寫）", value=datetime.strptime(clinical["recurrence_date"], "%Y-%m-%d").date() if clinical.get("recurrence_date") else None)
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                section = {
+                    "adjuvant": adjuvant, "mdt_decision": mdt_decision,
+                    "mdt_date": mdt_date.strftime("%Y-%m-%d") if mdt_date else "",
+                    "fu_3m": fu_3m.strftime("%Y-%m-%d") if fu_3m else "",
+                    "fu_6m": fu_6m.strftime("%Y-%m-%d") if fu_6m else "",
+                    "fu_12m": fu_12m.strftime("%Y-%m-%d") if fu_12m else "",
+                    "recurrence": recurrence,
+                }
+                if recurrence:
+                    section["recurrence_type"] = recurrence_type
+                    section["recurrence_date"] = recurrence_date.strftime("%Y-%m-%d") if recurrence_date else ""
+                stash_clinical_draft(patient_id, section)
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 八、ePRO/衛教 ===
     with tabs[7]:
         st.markdown('<div class="section-header">八、病人教育與 ePRO 追蹤</div>', unsafe_allow_html=True)
         
-        col1, col2 = st.columns(2)
-        with col1:
-            st.markdown("**術前衛教**")
-            preop_education = st.checkbox("已完成術前衛教", value=clinical.get("preop_education", False))
-            education_comprehension = st.selectbox("衛教理解程度", ["優", "良", "可", "差"], index=["優", "良", "可", "差"].index(clinical.get("education_comprehension", "良")) if clinical.get("education_comprehension") in ["優", "良", "可", "差"] else 1)
-            sdm_completed = st.checkbox("已完成 SDM 共享決策", value=clinical.get("sdm_completed", False))
-        
-        with col2:
-            st.markdown("**ePRO 追蹤狀態**")
-            epro_enrolled = st.checkbox("已加入 ePRO 追蹤", value=clinical.get("epro_enrolled", True))
-            epro_compliance = st.slider("ePRO 填答率 (%)", 0, 100, clinical.get("epro_compliance", 80))
-            chatbot_usage = st.number_input("AI 對話次數", value=clinical.get("chatbot_usage", 0), min_value=0)
-        
-        st.markdown("**最近症狀監測摘要**")
-        symptom_summary = st.text_area("症狀摘要 (由系統自動更新)", value=clinical.get("symptom_summary", ""), height=100, disabled=True)
-        nurse_notes = st.text_area("個管師備註", value=clinical.get("nurse_notes", ""), height=100)
+        with st.form(f"clinical_epro_{patient_id}"):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**術前衛教**")
+                preop_education = st.checkbox("已完成術前衛教", value=clinical.get("preop_education", False))
+                education_comprehension = st.selectbox("衛教理解程度", ["優", "良", "可", "差"], index=["優", "良", "可", "差"].index(clinical.get("education_comprehension", "良")) if clinical.get("education_comprehension") in ["優", "良", "可", "差"] else 1)
+                sdm_completed = st.checkbox("已完成 SDM 共享決策", value=clinical.get("sdm_completed", False))
+            
+            with col2:
+                st.markdown("**ePRO 追蹤狀態**")
+                epro_enrolled = st.checkbox("已加入 ePRO 追蹤", value=clinical.get("epro_enrolled", True))
+                epro_compliance = patient.get("compliance_rate")
+                if epro_compliance is not None:
+                    st.metric("ePRO 填答率（系統計算）", f"{epro_compliance}%",
+                              help=f"應回報 {patient.get('expected_reports', 0)} 次，已回報 {patient.get('fulfilled_reports', 0)} 次")
+                else:
+                    st.caption("ePRO 填答率：尚無手術日期，無法計算")
+                chatbot_usage = st.number_input("AI 對話次數", value=clinical.get("chatbot_usage", 0), min_value=0)
+            
+            st.markdown("**最近症狀監測摘要**")
+            symptom_summary = st.text_area("症狀摘要 (由系統自動更新)", value=clinical.get("symptom_summary", ""), height=100, disabled=True)
+            nurse_notes = st.text_area("個管師備註", value=clinical.get("nurse_notes", ""), height=100)
+            
+            if st.form_submit_button("✔️ 暫存本區", use_container_width=True):
+                section_data = {
+                    "preop_education": preop_education, "education_comprehension": education_comprehension,
+                    "sdm_completed": sdm_completed, "epro_enrolled": epro_enrolled,
+                    "chatbot_usage": chatbot_usage, "nurse_notes": nurse_notes,
+                }
+                if epro_compliance is not None:
+                    section_data["epro_compliance"] = epro_compliance
+                stash_clinical_draft(patient_id, section_data)
+                st.success("已暫存，請記得按下方「儲存所有臨床資料」")
     
     # === 儲存按鈕 ===
     st.markdown("---")
+    draft = st.session_state.clinical_drafts.get(patient_id, {})
+    if draft:
+        st.info(f"📝 已暫存 {len(draft)} 個欄位，尚未寫入資料庫")
+    
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if st.button("💾 儲存所有臨床資料", use_container_width=True, type="primary"):
-            # 收集所有資料
-            new_clinical = {
-                # 基本資料
-                "age": age, "gender": gender, "height": height, "weight": weight,
-                "smoking_status": smoking_status, "pack_year": pack_year,
-                "asa_class": asa_class, "ecog": ecog,
-                "fev1": fev1, "dlco": dlco, "ppo_fev1": ppo_fev1, "ppo_dlco": ppo_dlco,
-                "comorbidities": comorbidities,
-                "prior_thoracic": prior_thoracic, "prior_radiation": prior_radiation,
-                
-                # 腫瘤特徵
-                "tumor_size": tumor_size, "tumor_location": tumor_location, "lobe": lobe,
-                "ggo_ratio": ggo_ratio, "ctr": ctr, "suv_max": suv_max,
-                "c_t": c_t, "c_n": c_n, "c_m": c_m,
-                "multiple_lesions": multiple_lesions, "pleural_invasion_image": pleural_invasion_image,
-                
-                # 手術資訊
-                "surgery_date": surgery_date.strftime("%Y-%m-%d"),
-                "surgery_type": surgery_type, "surgery_approach": surgery_approach,
-                "op_time": op_time, "ebl": ebl, "conversion": conversion,
-                "ln_dissection": ln_dissection, "ln_stations": ln_stations, "ln_total": ln_total,
-                "combined_procedure": combined_procedure,
-                
-                # 病理
-                "pathology_type": pathology_type, "margin_status": margin_status,
-                "lvi": lvi, "vpi": vpi, "stas": stas,
-                "p_t": p_t, "p_n": p_n, "p_m": p_m,
-                "egfr": egfr, "alk": alk, "pdl1": pdl1,
-                
-                # 併發症
-                "complications": complications, "icu_days": icu_days,
-                "chest_tube_count": chest_tube_count, "chest_tube_days": chest_tube_days,
-                "air_leak_grade": air_leak_grade, "los": los,
-                "readmit_30": readmit_30, "readmit_90": readmit_90,
-                
-                # 康復
-                "preop_rehab": preop_rehab, "early_ambulation": early_ambulation,
-                "incentive_spirometer": incentive_spirometer, "pain_control": pain_control,
-                "adl_recovery": adl_recovery, "follow_up_compliance": follow_up_compliance,
-                
-                # 後續治療
-                "adjuvant": adjuvant, "mdt_decision": mdt_decision,
-                "fu_3m": fu_3m.strftime("%Y-%m-%d") if fu_3m else "",
-                "fu_6m": fu_6m.strftime("%Y-%m-%d") if fu_6m else "",
-                "fu_12m": fu_12m.strftime("%Y-%m-%d") if fu_12m else "",
-                "recurrence": recurrence,
-                
-                # ePRO
-                "preop_education": preop_education, "education_comprehension": education_comprehension,
-                "sdm_completed": sdm_completed, "epro_enrolled": epro_enrolled,
-                "epro_compliance": epro_compliance, "chatbot_usage": chatbot_usage,
-                "nurse_notes": nurse_notes,
-            }
+        if st.button("💾 儲存所有臨床資料", use_container_width=True, type="primary", disabled=not draft):
+            # 載入時尚無值的欄位以 None 作為基準，他人在編輯期間填入時才會列為衝突
+            base_clinical = {**{field: None for field in draft},
+                             **st.session_state.clinical_bases.get(patient_id, patient.get("clinical", {}))}
+            new_clinical = {**base_clinical, **draft}
             
-            if save_patient_clinical_data(patient_id, new_clinical):
-                st.success("✅ 臨床資料已儲存！")
+            result = save_patient_clinical_data(patient_id, base_clinical, new_clinical,
+                                                legacy=patient.get("clinical", {}))
+            if result is not None:
+                st.session_state.clinical_drafts.pop(patient_id, None)
+                st.session_state.clinical_bases.pop(patient_id, None)
+                st.success(f"✅ 臨床資料已儲存！（{len(result['changes'])} 個欄位異動）")
+                if result["conflicts"]:
+                    st.warning(f"⚠️ 以下欄位在您編輯期間已被他人修改，已以您的內容覆寫：{', '.join(result['conflicts'])}")
                 st.balloons()
             else:
                 st.warning("⚠️ Demo 模式：資料已暫存（重整頁面後會消失）")
+        if draft and st.button("↩️ 捨棄暫存", use_container_width=True):
+            st.session_state.clinical_drafts.pop(patient_id, None)
+            st.session_state.clinical_bases.pop(patient_id, None)
+            st.rerun()
+    
+    # === 異動紀錄 ===
+    if DATA_MANAGER_AVAILABLE:
+        with st.expander("📜 臨床資料異動紀錄"):
+            history = get_change_history(patient_id=patient_id, limit=50)
+            if history:
+                st.dataframe(pd.DataFrame([
+                    {
+                        "時間": h["timestamp"][:16].replace("T", " "),
+                        "欄位": h["field"],
+                        "舊值": str(h["old"]),
+                        "新值": str(h["new"]),
+                        "修改者": h["user"],
+                    }
+                    for h in history
+                ]), use_container_width=True, hide_index=True)
+            else:
+                st.info("尚無異動紀錄")
 
 # ============================================
 # 介入紀錄
@@ -878,11 +1051,18 @@ def render_interventions():
     
     tab1, tab2 = st.tabs(["📋 紀錄列表", "➕ 新增紀錄"])
     
+    patients = get_patients_data()
+    patient_labels = {p.get("id"): f"{p.get('name', '未知')} ({p.get('id', '')})" for p in patients}
+    
     with tab1:
         interventions = []
+        filter_patient = st.selectbox("病人", [None] + list(patient_labels.keys()),
+                                      format_func=lambda pid: "全部病人" if pid is None else patient_labels[pid],
+                                      key="intervention_filter")
         if DATA_MANAGER_AVAILABLE:
             try:
-                interventions = get_interventions()
+                interventions = get_interventions(filter_patient)
+                st.caption(f"共 {count_interventions(filter_patient)} 筆，顯示最近 {len(interventions)} 筆")
             except:
                 pass
         
@@ -890,9 +1070,9 @@ def render_interventions():
             for record in interventions:
                 st.markdown(f"""
                 <div class="intervention-card">
-                    <strong>{record.get('patient_name', record.get('patient_id', ''))}</strong>
+                    <strong>{record.get('patient_name') or record.get('patient_id', '')}</strong>
                     <span style="background:#dbeafe;color:#1e40af;padding:2px 8px;border-radius:4px;font-size:11px;margin-left:6px;">{record.get('type', '')}</span>
-                    <br><small>{record.get('time', '')}</small>
+                    <br><small>{record.get('date', '')} {record.get('time', '')}・{record.get('nurse', '')}</small>
                     <p style="margin: 8px 0 0 0;">{record.get('content', '')}</p>
                 </div>
                 """, unsafe_allow_html=True)
@@ -900,18 +1080,24 @@ def render_interventions():
             st.info("目前沒有介入紀錄")
     
     with tab2:
-        with st.form("new_intervention"):
-            patients = get_patients_data()
-            patient_names = ["選擇病人..."] + [f"{p.get('name', '未知')} ({p.get('id', '')})" for p in patients]
-            
-            patient = st.selectbox("病人", patient_names)
+        with st.form("new_intervention", clear_on_submit=True):
+            patient = st.selectbox("病人", [None] + list(patient_labels.keys()),
+                                   format_func=lambda pid: "選擇病人..." if pid is None else patient_labels[pid])
             method = st.selectbox("聯繫方式", ["電話", "LINE", "簡訊", "門診", "視訊"])
             duration = st.text_input("通話時間", placeholder="例如：5分鐘")
             content = st.text_area("紀錄內容", height=150)
             referral = st.selectbox("轉介", ["無", "緩和醫療", "營養諮詢", "復健科", "心理諮商", "社工"])
             
             if st.form_submit_button("💾 儲存紀錄", use_container_width=True, type="primary"):
-                if patient != "選擇病人..." and content:
+                if patient and content:
+                    if DATA_MANAGER_AVAILABLE:
+                        save_intervention(patient, {
+                            "type": method,
+                            "content": content,
+                            "duration": duration,
+                            "referral": None if referral == "無" else referral,
+                            "nurse": st.session_state.username
+                        })
                     st.success("✅ 紀錄已儲存！")
                 else:
                     st.error("請選擇病人並填寫紀錄內容")
@@ -923,7 +1109,8 @@ def render_interventions():
 try:
     from education_system import (
         EDUCATION_MATERIALS, AUTO_PUSH_RULES, education_manager,
-        get_materials_by_category, get_material_by_id
+        get_materials_by_category, get_material_by_id,
+        search_materials, update_material, sync_material_edits
     )
     EDUCATION_AVAILABLE = True
 except:
@@ -936,8 +1123,11 @@ def render_education():
     
     if not EDUCATION_AVAILABLE:
         st.warning("衛教系統模組載入中...")
+    else:
+        # 套用其他工作程序或重新啟動前的單張編輯
+        sync_material_edits()
     
-    tabs = st.tabs(["📤 手動推送", "⚙️ 自動規則", "📋 推送紀錄", "📖 衛教單張庫"])
+    tabs = st.tabs(["📤 手動推送", "👥 批次推送", "⚙️ 自動規則", "📋 推送紀錄", "📖 衛教單張庫"])
     
     # === 手動推送 ===
     with tabs[0]:
@@ -1033,7 +1223,7 @@ def render_education():
         
         if selected_patient_name != "-- 請選擇 --":
             patient = patient_options[selected_patient_name]
-            post_op_day = patient.get("post_op_day", 0)
+            post_op_day = patient.get("post_op_day") or 0
             
             recommendations = []
             
@@ -1086,8 +1276,59 @@ def render_education():
                             if record:
                                 st.success(f"✅ 已推送！")
     
-    # === 自動規則 ===
+    # === 批次推送 ===
     with tabs[1]:
+        st.markdown("### 👥 依臨床條件批次推送")
+        st.caption("同一欄位內任一條件符合即可，不同欄位需同時符合")
+        
+        cohort_fields = [
+            ("smoking_status", "吸菸狀態"),
+            ("adjuvant", "輔助治療"),
+            ("surgery_type", "手術方式"),
+            ("egfr", "EGFR"),
+        ]
+        cohort_filters = {}
+        cols = st.columns(len(cohort_fields))
+        for i, (field, label) in enumerate(cohort_fields):
+            with cols[i]:
+                cohort_filters[field] = st.multiselect(
+                    label, CLINICAL_FIELD_OPTIONS[field], key=f"bulk_{field}"
+                )
+        
+        patients_by_id = {p.get("id"): p for p in get_patients_data()}
+        if not any(cohort_filters.values()):
+            cohort = []
+        elif DATA_MANAGER_AVAILABLE:
+            cohort_ids = query_cohort({f: v for f, v in cohort_filters.items() if v})
+            cohort = [patients_by_id[pid] for pid in cohort_ids if pid in patients_by_id]
+        else:
+            cohort = [
+                p for p in patients_by_id.values()
+                if all(not v or p.get("clinical", {}).get(f) in v for f, v in cohort_filters.items())
+            ]
+        
+        st.markdown(f"**符合條件：{len(cohort)} 位病人**")
+        if cohort:
+            st.caption("、".join(p.get("name", p.get("id", "")) for p in cohort[:30]) + (" ..." if len(cohort) > 30 else ""))
+        
+        material_labels = {f"{m.get('icon', '📄')} {m.get('title', k)}": k for k, m in EDUCATION_MATERIALS.items()}
+        bulk_material_name = st.selectbox("衛教單張", list(material_labels.keys()) or ["無資料"], key="bulk_material")
+        skip_pushed = st.checkbox("略過已收過此單張的病人", value=True, key="bulk_skip")
+        
+        if st.button("📤 批次推送", use_container_width=True, type="primary", disabled=not cohort):
+            if not EDUCATION_AVAILABLE:
+                st.warning("衛教系統載入中，請稍後再試")
+            else:
+                records, skipped = education_manager.push_material_bulk(
+                    cohort,
+                    material_labels.get(bulk_material_name, ""),
+                    pushed_by=st.session_state.username,
+                    skip_already_pushed=skip_pushed
+                )
+                st.success(f"✅ 已推送給 {len(records)} 位病人" + (f"（略過 {len(skipped)} 位已推送）" if skipped else ""))
+    
+    # === 自動規則 ===
+    with tabs[2]:
         st.markdown("### ⚙️ 自動推送規則")
         st.caption("系統會依據以下規則自動推送衛教單張給病人")
         
@@ -1153,7 +1394,7 @@ def render_education():
                 enabled = st.checkbox("啟用", value=rule.get("enabled", True), key=f"rule_{rule['id']}")
     
     # === 推送紀錄 ===
-    with tabs[2]:
+    with tabs[3]:
         st.markdown("### 📋 推送紀錄")
         
         # 篩選
@@ -1170,6 +1411,8 @@ def render_education():
         # 取得紀錄
         if EDUCATION_AVAILABLE:
             history = education_manager.get_all_history()
+            if DATA_MANAGER_AVAILABLE:
+                history = attach_patient_info([dict(r) for r in history])
         else:
             # 模擬資料
             history = [
@@ -1208,7 +1451,7 @@ def render_education():
         # 顯示紀錄
         if history:
             for record in history[:20]:
-                push_type_badge = "🤖 自動" if record.get("push_type") == "auto" else "👤 手動"
+                push_type_badge = {"auto": "🤖 自動", "bulk": "👥 批次"}.get(record.get("push_type"), "👤 手動")
                 status_badge = "✅ 已讀" if record.get("status") == "read" else "📤 已送出"
                 
                 # 格式化時間
@@ -1242,26 +1485,70 @@ def render_education():
         st.markdown("---")
         st.markdown("### 📊 推送統計")
         
+        if EDUCATION_AVAILABLE:
+            push_stats = education_manager.get_statistics()
+        else:
+            today_str = datetime.now().strftime("%Y-%m-%d")
+            week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
+            push_stats = {
+                "today": len([r for r in history if r.get("pushed_at", "")[:10] == today_str]),
+                "this_week": len([r for r in history if week_start <= r.get("pushed_at", "")[:10] <= today_str]),
+                "read_rate": len([r for r in history if r.get("status") == "read"]) / max(len(history), 1),
+                "auto": len([r for r in history if r.get("push_type") == "auto"]),
+            }
+        
         col1, col2, col3, col4 = st.columns(4)
-        col1.metric("今日推送", len([r for r in history if r.get("pushed_at", "")[:10] == datetime.now().strftime("%Y-%m-%d")]))
-        col2.metric("本週推送", len(history))
-        col3.metric("已讀率", f"{len([r for r in history if r.get('status') == 'read']) / max(len(history), 1) * 100:.0f}%")
-        col4.metric("自動推送", len([r for r in history if r.get("push_type") == "auto"]))
+        col1.metric("今日推送", push_stats["today"])
+        col2.metric("本週推送", push_stats["this_week"])
+        col3.metric("已讀率", f"{push_stats['read_rate'] * 100:.0f}%")
+        col4.metric("自動推送", push_stats["auto"])
     
     # === 衛教單張庫 ===
-    with tabs[3]:
+    with tabs[4]:
         st.markdown("### 📖 衛教單張庫")
         
-        # 類別篩選
-        all_categories = list(set(m.get("category", "其他") for m in EDUCATION_MATERIALS.values()))
-        selected_cat = st.selectbox("篩選類別", ["全部"] + all_categories, key="lib_category")
+        # 全文搜尋 + 類別篩選
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            search_query = st.text_input("🔍 搜尋衛教單張", placeholder="例如：呼吸訓練、傷口、化療副作用...", key="lib_search")
+        with col2:
+            all_categories = list(set(m.get("category", "其他") for m in EDUCATION_MATERIALS.values()))
+            selected_cat = st.selectbox("篩選類別", ["全部"] + all_categories, key="lib_category")
+        
+        if search_query and EDUCATION_AVAILABLE:
+            material_keys = [m["key"] for m in search_materials(search_query, limit=len(EDUCATION_MATERIALS))]
+            st.caption(f"找到 {len(material_keys)} 份相關單張")
+        else:
+            material_keys = list(EDUCATION_MATERIALS.keys())
         
         # 顯示單張
-        for key, material in EDUCATION_MATERIALS.items():
+        for key in material_keys:
+            material = EDUCATION_MATERIALS.get(key, {})
             if selected_cat != "全部" and material.get("category") != selected_cat:
                 continue
             
             with st.expander(f"{material.get('icon', '📄')} {material.get('title', key)}"):
+                if st.session_state.get("editing_material") == key:
+                    with st.form(f"edit_form_{key}"):
+                        new_title = st.text_input("標題", value=material.get("title", ""))
+                        new_description = st.text_input("說明", value=material.get("description", ""))
+                        new_content = st.text_area("內容", value=material.get("content", ""), height=300)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            save_clicked = st.form_submit_button("💾 儲存", use_container_width=True, type="primary")
+                        with col2:
+                            cancel_clicked = st.form_submit_button("取消", use_container_width=True)
+                    
+                    if save_clicked:
+                        update_material(key, updated_by=st.session_state.username,
+                                        title=new_title, description=new_description, content=new_content)
+                        st.session_state.editing_material = None
+                        st.rerun()
+                    elif cancel_clicked:
+                        st.session_state.editing_material = None
+                        st.rerun()
+                    continue
+                
                 st.markdown(f"**類別：** {material.get('category', '')}")
                 st.markdown(f"**說明：** {material.get('description', '')}")
                 st.markdown("---")
@@ -1269,7 +1556,9 @@ def render_education():
                 
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.button("✏️ 編輯", key=f"edit_{key}", use_container_width=True)
+                    if st.button("✏️ 編輯", key=f"edit_{key}", use_container_width=True, disabled=not EDUCATION_AVAILABLE):
+                        st.session_state.editing_material = key
+                        st.rerun()
                 with col2:
                     st.button("📤 快速推送", key=f"push_{key}", use_container_width=True)
 
@@ -1282,36 +1571,149 @@ def render_reports():
     tab1, tab2 = st.tabs(["📊 總覽", "💾 匯出"])
     
     with tab1:
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("### 收案狀態")
-            fig = px.pie(
-                values=[35, 5, 2],
-                names=["正常追蹤", "黃色警示", "紅色警示"],
-                color_discrete_sequence=["#22c55e", "#f59e0b", "#ef4444"]
-            )
-            fig.update_layout(height=300)
-            st.plotly_chart(fig, use_container_width=True)
-        
-        with col2:
-            st.markdown("### 症狀分布")
-            fig = px.bar(
-                x=[45, 38, 25, 22, 18],
-                y=["疲勞", "疼痛", "呼吸困難", "咳嗽", "睡眠問題"],
-                orientation='h',
-                color_discrete_sequence=["#3b82f6"]
-            )
-            fig.update_layout(height=300)
+        if not DATA_MANAGER_AVAILABLE:
+            st.info("Demo 模式：報表需要資料管理模組")
+        else:
+            analytics = get_analytics()
+            summary = analytics.summary()
+            
+            # 回報依從：目前仍在預期回報間隔內的病人比例
+            patients = get_patients_data()
+            tracked = [p for p in patients if p.get("epro_interval")]
+            on_schedule = len([p for p in tracked if not p.get("report_due")])
+            compliance = pd.Series([p.get("compliance_rate") for p in patients], dtype="float64").dropna()
+            
+            col1, col2, col3, col4, col5 = st.columns(5)
+            col1.metric("總收案", summary["total_patients"])
+            col2.metric("累計回報", summary["total_reports"])
+            col3.metric("今日回報", summary["today_reports"])
+            col4.metric("回報依從率", f"{on_schedule / len(tracked) * 100:.0f}%" if tracked else "-")
+            col5.metric("平均 ePRO 填答率", f"{compliance.mean():.0f}%" if len(compliance) else "-")
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.markdown("### 收案狀態")
+                status = analytics.status_distribution()
+                fig = px.pie(
+                    values=status.values,
+                    names=status.index,
+                    color=status.index,
+                    color_discrete_map={"正常追蹤": "#22c55e", "黃色警示": "#f59e0b", "紅色警示": "#ef4444", "尚未回報": "#94a3b8"}
+                )
+                fig.update_layout(height=300)
+                st.plotly_chart(fig, use_container_width=True)
+            
+            with col2:
+                st.markdown("### 症狀分布")
+                symptom_days = st.selectbox("期間", [7, 30, 90, None], format_func=lambda d: f"近 {d} 天" if d else "全部", key="symptom_days")
+                symptoms = analytics.symptom_frequency(days=symptom_days)
+                if len(symptoms):
+                    fig = px.bar(
+                        x=symptoms.values[::-1],
+                        y=symptoms.index[::-1],
+                        orientation='h',
+                        color_discrete_sequence=["#3b82f6"]
+                    )
+                    fig.update_layout(height=300, xaxis_title="次數", yaxis_title="")
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("此期間沒有症狀回報")
+            
+            st.markdown("### 警示趨勢（近 30 天）")
+            trend = analytics.alert_trend(days=30)
+            fig = go.Figure()
+            fig.add_bar(x=trend.index, y=trend["red"], name="紅色警示", marker_color="#ef4444")
+            fig.add_bar(x=trend.index, y=trend["yellow"], name="黃色警示", marker_color="#f59e0b")
+            daily = analytics.daily_reports(days=30)
+            fig.add_scatter(x=daily.index, y=daily.values, name="每日回報", mode="lines", line=dict(color="#3b82f6"))
+            fig.update_layout(barmode="stack", height=320)
             st.plotly_chart(fig, use_container_width=True)
+            
+            if len(compliance):
+                st.markdown("### ePRO 填答率分布")
+                fig = px.histogram(x=compliance, nbins=10, range_x=[0, 100], color_discrete_sequence=["#8b5cf6"])
+                fig.update_layout(height=280, xaxis_title="填答率 (%)", yaxis_title="病人數", bargap=0.05)
+                st.plotly_chart(fig, use_container_width=True)
     
     with tab2:
         st.markdown("### 數據匯出")
-        format_option = st.selectbox("匯出格式", ["Excel (.xlsx)", "CSV (.csv)", "JSON"])
-        st.checkbox("去識別化處理", value=True)
+        if not DATA_MANAGER_AVAILABLE:
+            st.info("Demo 模式：匯出需要資料管理模組")
+            return
+        
+        format_option = st.selectbox("匯出格式", list(EXPORT_FORMATS.keys()), format_func=EXPORT_FORMATS.get)
+        export_tables = st.multiselect("匯出資料", list(EXPORT_TABLES.keys()), default=list(EXPORT_TABLES.keys()), format_func=EXPORT_TABLES.get)
+        deidentify = st.checkbox("去識別化處理", value=True, help="移除姓名、電話與對話內容，病人 ID 雜湊，日期依病人隨機位移")
+        
+        if st.button("📥 產生匯出檔案", use_container_width=True, type="primary", disabled=not export_tables):
+            job = submit_export(format_option, export_tables, deidentify=deidentify,
+                                requested_by=st.session_state.username)
+            if job["status"] == "done":
+                st.success("✅ 已有相同條件的匯出檔案，可直接下載")
+            else:
+                st.success("✅ 已排入背景匯出，可離開此頁，稍後回來下載")
+        
+        st.markdown("---")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.markdown("#### 我的匯出工作")
+        with col2:
+            if has_active_jobs(st.session_state.username):
+                if st.button("🔄 更新進度", use_container_width=True):
+                    st.rerun()
         
-        if st.button("📥 產生匯出檔案", use_container_width=True, type="primary"):
-            st.info("💡 匯出功能開發中...")
+        jobs = list_jobs(requested_by=st.session_state.username, limit=10)
+        if not jobs:
+            st.caption("尚無匯出工作")
+        
+        status_labels = {"queued": "⏳ 排隊中", "running": "🔄 匯出中", "done": "✅ 完成", "failed": "❌ 失敗",
+                         "expired": "⌛ 已過期（檔案已刪除）"}
+        for job in jobs:
+            created = datetime.fromisoformat(job["created_at"]).strftime("%m/%d %H:%M")
+            tables_text = "、".join(EXPORT_TABLES.get(t, t) for t in job["tables"])
+            deid_text = "去識別化" if job["deidentify"] else "含識別資料"
+            with st.container():
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.markdown(f"**{status_labels.get(job['status'], job['status'])}** {created}｜{EXPORT_FORMATS.get(job['format'], job['format'])}｜{tables_text}｜{deid_text}")
+                    if job["status"] == "running":
+                        total = job.get("total") or 0
+                        st.progress(job["done"] / total if total else 0.0, text=f"{job['done']}/{total}")
+                    elif job["status"] == "failed":
+                        st.caption(f"錯誤：{job.get('error', '')}")
+                with col2:
+                    if job["status"] == "done" and os.path.exists(job["output"]):
+                        with open(job["output"], "rb") as f:
+                            st.download_button(
+                                "💾 下載", f,
+                                file_name=f"aicare_export_{datetime.fromisoformat(job['created_at']).strftime('%Y%m%d_%H%M')}{os.path.splitext(job['output'])[1]}",
+                                key=f"download_{job['id']}",
+                                use_container_width=True
+                            )
+        
+        st.markdown("---")
+        st.markdown("#### 📦 研究分析快照（Parquet）")
+        if not PARQUET_AVAILABLE:
+            st.info("需要安裝 pyarrow 才能建立分析快照")
+        else:
+            manifest = load_manifest()
+            if manifest.get("created_at"):
+                created = datetime.fromisoformat(manifest["created_at"]).strftime("%Y/%m/%d %H:%M")
+                st.caption(f"最近更新：{created}｜位置：data/snapshot/")
+                st.dataframe(
+                    pd.DataFrame([
+                        {"資料表": name, "筆數": info["rows"], "分區數": len(info["partitions"])}
+                        for name, info in manifest["tables"].items()
+                    ]),
+                    hide_index=True, use_container_width=True
+                )
+            else:
+                st.caption("尚未建立快照")
+            if st.button("🔄 立即更新快照", use_container_width=True):
+                with st.spinner("寫入快照中..."):
+                    write_snapshot()
+                st.rerun()
 
 # ============================================
 # 主程式
@@ -1322,6 +1724,9 @@ def main():
     else:
         render_sidebar()
         
+        if STATE_SERVICE_ERROR:
+            st.error(f"⚠️ 無法連線共用狀態服務 {STATE_SERVICE_ERROR}，資料寫入與衛教推送暫時無法使用")
+        
         if st.session_state.admin_page == "dashboard":
             render_dashboard()
         elif st.session_state.admin_page == "alerts":
@@ -0,0 +1,166 @@
+"""
+AI-CARE Lung Pro - 臨床資料選項
+================================
+
+臨床資料欄位的選項定義（管理後台表單與臨床資料登錄共用）
+"""
+
+# ============================================
+# 臨床資料選項定義
+# ============================================
+CLINICAL_OPTIONS = {
+    # 基本資料
+    "gender": ["男", "女"],
+    "smoking_status": ["從未吸菸", "已戒菸", "目前吸菸"],
+    "asa_class": ["I", "II", "III", "IV"],
+    "ecog": ["0", "1", "2", "3", "4"],
+    
+    # 共病
+    "comorbidities": [
+        "COPD", "ILD", "高血壓", "冠心病", "心房顫動", "心衰竭",
+        "糖尿病", "慢性腎臟病", "肝硬化", "腦中風", "其他惡性腫瘤"
+    ],
+    
+    # 腫瘤位置
+    "tumor_location": ["周邊型", "中央型"],
+    "lobe": ["RUL", "RML", "RLL", "LUL", "LLL", "Lingula"],
+    
+    # 手術方式
+    "surgery_type": [
+        "Wedge resection",
+        "Segmentectomy", 
+        "Lobectomy",
+        "Bilobectomy",
+        "Pneumonectomy",
+        "Sleeve resection"
+    ],
+    "surgery_approach": [
+        "VATS (多孔)",
+        "Uniportal VATS",
+        "RATS",
+        "開胸手術",
+        "轉換開胸"
+    ],
+    "ln_dissection": ["系統性淋巴結廓清", "淋巴結取樣", "未執行"],
+    
+    # 病理
+    "pathology_type": [
+        "AIS (原位腺癌)",
+        "MIA (微浸潤腺癌)",
+        "Invasive adenocarcinoma",
+        "Squamous cell carcinoma",
+        "Large cell carcinoma",
+        "Small cell carcinoma",
+        "Carcinoid",
+        "其他"
+    ],
+    "adenocarcinoma_subtype": [
+        "Lepidic", "Acinar", "Papillary", "Micropapillary", "Solid",
+        "Invasive mucinous", "Colloid", "Fetal", "Enteric"
+    ],
+    "margin_status": ["R0 (完全切除)", "R1 (顯微殘留)", "R2 (肉眼殘留)"],
+    "lvi": ["無", "有"],
+    "vpi": ["PL0", "PL1", "PL2", "PL3"],
+    "stas": ["無", "有", "未檢測"],
+    
+    # 分子檢測
+    "egfr_status": ["Wild type", "Exon 19 del", "L858R", "T790M", "Exon 20 ins", "其他突變", "未檢測"],
+    "alk_status": ["陰性", "陽性", "未檢測"],
+    "pdl1_status": ["<1%", "1-49%", "≥50%", "未檢測"],
+    
+    # 術後併發症
+    "complications": [
+        "延遲性氣漏 (>5天)",
+        "肺炎",
+        "心房顫動",
+        "ARDS",
+        "乳糜胸",
+        "術後出血",
+        "再手術",
+        "呼吸衰竭插管",
+        "其他"
+    ],
+    
+    # 術後輔助治療
+    "adjuvant_therapy": [
+        "無需輔助治療",
+        "輔助化療",
+        "輔助標靶治療 (TKI)",
+        "輔助免疫治療",
+        "輔助放射治療",
+        "化療 + 免疫",
+        "待 MDT 討論"
+    ],
+    
+    # 疼痛控制
+    "pain_control": [
+        "PCA",
+        "Intercostal nerve block",
+        "ESP block",
+        "Paravertebral block",
+        "口服止痛藥",
+        "其他"
+    ]
+}
+
+# T 分期
+T_STAGE = ["Tis", "T1mi", "T1a", "T1b", "T1c", "T2a", "T2b", "T3", "T4"]
+N_STAGE = ["N0", "N1", "N2", "N3"]
+M_STAGE = ["M0", "M1a", "M1b", "M1c"]
+
+# ============================================
+# 臨床資料欄位 → 選項
+# ============================================
+# 單選類別欄位（欄位名稱與 render_clinical 儲存的鍵值一致）
+CLINICAL_FIELD_OPTIONS = {
+    "gender": CLINICAL_OPTIONS["gender"],
+    "smoking_status": CLINICAL_OPTIONS["smoking_status"],
+    "asa_class": CLINICAL_OPTIONS["asa_class"],
+    "ecog": CLINICAL_OPTIONS["ecog"],
+    "tumor_location": CLINICAL_OPTIONS["tumor_location"],
+    "lobe": CLINICAL_OPTIONS["lobe"],
+    "c_t": T_STAGE, "c_n": N_STAGE, "c_m": M_STAGE,
+    "surgery_type": CLINICAL_OPTIONS["surgery_type"],
+    "surgery_approach": CLINICAL_OPTIONS["surgery_approach"],
+    "ln_dissection": CLINICAL_OPTIONS["ln_dissection"],
+    "pathology_type": CLINICAL_OPTIONS["pathology_type"],
+    "margin_status": CLINICAL_OPTIONS["margin_status"],
+    "lvi": CLINICAL_OPTIONS["lvi"],
+    "vpi": CLINICAL_OPTIONS["vpi"],
+    "stas": CLINICAL_OPTIONS["stas"],
+    "p_t": T_STAGE, "p_n": N_STAGE, "p_m": M_STAGE,
+    "egfr": CLINICAL_OPTIONS["egfr_status"],
+    "alk": CLINICAL_OPTIONS["alk_status"],
+    "pdl1": CLINICAL_OPTIONS["pdl1_status"],
+    "air_leak_grade": ["無", "Grade 1", "Grade 2", "Grade 3", "Grade 4"],
+    "incentive_spirometer": ["優良", "普通", "差", "未執行"],
+    "adl_recovery": ["完全獨立", "輕度依賴", "中度依賴", "重度依賴"],
+    "adjuvant": CLINICAL_OPTIONS["adjuvant_therapy"],
+    "education_comprehension": ["優", "良", "可", "差"],
+}
+
+# 多選欄位
+CLINICAL_MULTI_FIELDS = {
+    "comorbidities": CLINICAL_OPTIONS["comorbidities"],
+    "complications": CLINICAL_OPTIONS["complications"],
+    "pain_control": CLINICAL_OPTIONS["pain_control"],
+}
+
+# 數值欄位
+CLINICAL_NUMERIC_FIELDS = [
+    "age", "height", "weight", "pack_year", "fev1", "dlco", "ppo_fev1", "ppo_dlco",
+    "tumor_size", "ggo_ratio", "ctr", "suv_max",
+    "op_time", "ebl", "ln_stations", "ln_total",
+    "icu_days", "chest_tube_count", "chest_tube_days", "los",
+    "follow_up_compliance", "epro_compliance", "chatbot_usage",
+]
+
+# 是 / 否欄位
+CLINICAL_BOOL_FIELDS = [
+    "prior_thoracic", "prior_radiation", "multiple_lesions", "pleural_invasion_image",
+    "conversion", "readmit_30", "readmit_90", "preop_rehab", "early_ambulation",
+    "recurrence", "preop_education", "sdm_completed", "epro_enrolled",
+]
+
+# 日期欄位
+CLINICAL_DATE_FIELDS = ["surgery_date", "fu_3m", "fu_6m", "fu_12m"]
@@ -0,0 +1,224 @@
+"""
+AI-CARE Lung Pro - 臨床資料欄式登錄庫
+======================================
+
+將各病人的臨床資料以欄式（columnar）儲存，供全登錄庫的族群統計使用：
+- 類別欄位以整數代碼儲存（依 CLINICAL_OPTIONS 編碼），輸出為 pandas Categorical
+- 數值、是否、日期欄位各自以 NumPy 陣列儲存
+- 多選欄位（共病、併發症、疼痛控制）另存為展開表（patient_id, value）
+- 臨床資料儲存時透過 clinical_store 的異動監聽逐欄更新，不需重建
+"""
+
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import clinical_store
+import data_manager
+from clinical_options import (
+    CLINICAL_FIELD_OPTIONS, CLINICAL_MULTI_FIELDS, CLINICAL_NUMERIC_FIELDS,
+    CLINICAL_BOOL_FIELDS, CLINICAL_DATE_FIELDS
+)
+
+_INITIAL_CAPACITY = 256
+
+
+class ClinicalRegistry:
+    """臨床資料欄式儲存"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.patient_ids: List[str] = []        # row -> patient_id
+        self.row_of: Dict[str, int] = {}         # patient_id -> row
+        self._capacity = _INITIAL_CAPACITY
+
+        self.categories = {f: list(opts) for f, opts in CLINICAL_FIELD_OPTIONS.items()}
+        self._codes = {f: {v: i for i, v in enumerate(opts)} for f, opts in self.categories.items()}
+        self.categorical = {f: np.full(self._capacity, -1, dtype=np.int16) for f in self.categories}
+        self.numeric = {f: np.full(self._capacity, np.nan) for f in CLINICAL_NUMERIC_FIELDS}
+        self.boolean = {f: np.full(self._capacity, -1, dtype=np.int8) for f in CLINICAL_BOOL_FIELDS}
+        self.dates = {f: np.full(self._capacity, np.datetime64("NaT"), dtype="datetime64[D]") for f in CLINICAL_DATE_FIELDS}
+
+        self.multi_categories = {f: list(opts) for f, opts in CLINICAL_MULTI_FIELDS.items()}
+        self._multi_codes = {f: {v: i for i, v in enumerate(opts)} for f, opts in self.multi_categories.items()}
+        self.multi = {f: {} for f in CLINICAL_MULTI_FIELDS}  # 欄位 -> {row: [代碼, ...]}
+
+        self.version = 0
+        self._frame_cache = (None, None)      # (version, DataFrame)
+        self._exploded_cache = {}             # 欄位 -> (version, DataFrame)
+
+    # ------------------------------------------
+    # 寫入
+    # ------------------------------------------
+    def _grow(self):
+        new_capacity = self._capacity * 2
+        for columns, fill in ((self.categorical, -1), (self.numeric, np.nan), (self.boolean, -1),
+                              (self.dates, np.datetime64("NaT"))):
+            for field, arr in columns.items():
+                grown = np.full(new_capacity, fill, dtype=arr.dtype)
+                grown[:self._capacity] = arr
+                columns[field] = grown
+        self._capacity = new_capacity
+
+    def _row(self, patient_id: str) -> int:
+        row = self.row_of.get(patient_id)
+        if row is None:
+            row = len(self.patient_ids)
+            if row >= self._capacity:
+                self._grow()
+            self.patient_ids.append(patient_id)
+            self.row_of[patient_id] = row
+        return row
+
+    def _category_code(self, field: str, value, codes: Dict, categories: List) -> int:
+        code = codes.get(value)
+        if code is None:
+            # 不在選項內的舊資料：擴充類別而不丟棄
+            code = len(categories)
+            categories.append(value)
+            codes[value] = code
+        return code
+
+    def set_value(self, patient_id: str, field: str, value):
+        """更新單一病人的單一欄位"""
+        with self._lock:
+            row = self._row(patient_id)
+            empty = value is None or value == ""
+            if field in self.categorical:
+                self.categorical[field][row] = -1 if empty else self._category_code(
+                    field, value, self._codes[field], self.categories[field])
+            elif field in self.numeric:
+                try:
+                    self.numeric[field][row] = np.nan if empty else float(value)
+                except (TypeError, ValueError):
+                    self.numeric[field][row] = np.nan
+            elif field in self.boolean:
+                self.boolean[field][row] = -1 if empty else int(bool(value))
+            elif field in self.dates:
+                try:
+                    self.dates[field][row] = np.datetime64("NaT") if empty else np.datetime64(str(value)[:10], "D")
+                except ValueError:
+                    self.dates[field][row] = np.datetime64("NaT")
+            elif field in self.multi:
+                values = value if isinstance(value, list) else []
+                self.multi[field][row] = [
+                    self._category_code(field, v, self._multi_codes[field], self.multi_categories[field])
+                    for v in values
+                ]
+            else:
+                return
+            self.version += 1
+
+    def load_patient(self, patient_id: str, clinical: Dict):
+        """載入病人的完整臨床資料"""
+        with self._lock:
+            self._row(patient_id)
+            for field, value in clinical.items():
+                self.set_value(patient_id, field, value)
+            self.version += 1
+
+    def _on_change(self, change: Dict):
+        self.set_value(change["patient_id"], change["field"], change["new"])
+
+    # ------------------------------------------
+    # 讀取
+    # ------------------------------------------
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def frame(self) -> pd.DataFrame:
+        """整個登錄庫的 DataFrame（index 為 patient_id），未異動時重複使用"""
+        with self._lock:
+            version, cached = self._frame_cache
+            if cached is not None and version == self.version:
+                return cached
+
+            n = len(self.patient_ids)
+            columns = {}
+            for field, codes in self.categorical.items():
+                columns[field] = pd.Categorical.from_codes(codes[:n], categories=list(self.categories[field]))
+            for field, arr in self.numeric.items():
+                columns[field] = arr[:n].copy()
+            for field, arr in self.boolean.items():
+                values = arr[:n]
+                columns[field] = pd.arrays.BooleanArray(values == 1, values == -1)
+            for field, arr in self.dates.items():
+                columns[field] = pd.to_datetime(arr[:n])
+
+            df = pd.DataFrame(columns, index=pd.Index(list(self.patient_ids), name="patient_id"))
+            self._frame_cache = (self.version, df)
+            return df
+
+    def exploded(self, field: str) -> pd.DataFrame:
+        """多選欄位的展開表：每個 (patient_id, value) 一列"""
+        with self._lock:
+            version, cached = self._exploded_cache.get(field, (None, None))
+            if cached is not None and version == self.version:
+                return cached
+
+            rows, codes = [], []
+            for row, row_codes in self.multi.get(field, {}).items():
+                rows.extend([row] * len(row_codes))
+                codes.extend(row_codes)
+            patient_ids = np.array(self.patient_ids, dtype=object)[np.array(rows, dtype=np.int64)]
+            df = pd.DataFrame({
+                "patient_id": patient_ids,
+                "value": pd.Categorical.from_codes(
+                    np.array(codes, dtype=np.int16), categories=list(self.multi_categories[field])),
+            })
+            self._exploded_cache[field] = (self.version, df)
+            return df
+
+    # ------------------------------------------
+    # 統計
+    # ------------------------------------------
+    def value_counts(self, field: str, patient_ids: Optional[List[str]] = None) -> pd.Series:
+        """類別欄位或多選欄位的次數分布（包含 0 次的選項）"""
+        if field in self.multi:
+            values = self.exploded(field)
+            if patient_ids is not None:
+                values = values[values["patient_id"].isin(patient_ids)]
+            return values["value"].value_counts(sort=False)
+        column = self.frame()[field]
+        if patient_ids is not None:
+            column = column[column.index.isin(patient_ids)]
+        return column.value_counts(sort=False)
+
+    def crosstab(self, row_field: str, col_field: str) -> pd.DataFrame:
+        """兩個類別欄位的交叉表"""
+        df = self.frame()
+        return pd.crosstab(df[row_field], df[col_field], dropna=False)
+
+    def describe(self, field: str, by: Optional[str] = None) -> pd.DataFrame:
+        """數值欄位的摘要統計，可依類別欄位分組"""
+        df = self.frame()
+        if by is None:
+            return df[field].describe().to_frame()
+        return df.groupby(by, observed=False)[field].describe()
+
+
+_registry: Optional[ClinicalRegistry] = None
+_registry_lock = threading.Lock()
+_synced_version = {"data": None}
+
+
+def get_registry() -> ClinicalRegistry:
+    """取得全域登錄庫；首次呼叫時建立，之後只補入新病人與新異動"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClinicalRegistry()
+            clinical_store.add_change_listener(_registry._on_change)
+
+        data_version = data_manager.data_version()
+        if data_version != _synced_version["data"]:
+            data = data_manager.load_data()
+            for patient_id, patient in data["patients"].items():
+                if patient_id not in _registry.row_of:
+                    _registry.load_patient(patient_id, clinical_store.get_clinical(patient_id, patient.get("clinical")))
+            _synced_version["data"] = data_version
+
+        clinical_store.refresh()
+        return _registry
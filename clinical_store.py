@@ -0,0 +1,186 @@
+"""
+AI-CARE Lung Pro - 臨床資料異動紀錄
+====================================
+
+臨床資料以「欄位層級異動」寫入只可附加（append-only）的紀錄檔：
+- 每筆異動記錄 病人、欄位、舊值、新值、修改者、時間
+- 儲存時只寫入實際變更的欄位，兩位個管師同時修改不同欄位時會合併而非覆蓋
+- 目前臨床資料由異動紀錄即時彙整（materialized view），並依病人 / 欄位 / 修改者建立索引
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from id_generator import new_id
+
+CLINICAL_LOG_FILE = "data/clinical_changes.jsonl"
+
+_lock = threading.Lock()
+_state = {
+    "offset": 0,        # 已讀取到的檔案位置
+    "view": {},         # patient_id -> {欄位: 目前值}
+    "updated": {},      # patient_id -> 最後一筆異動
+    "changes": [],      # 所有異動（依寫入順序）
+    "by_patient": {},   # patient_id -> [異動在 changes 中的位置]
+    "by_field": {},     # 欄位 -> [位置]
+    "by_user": {},      # 修改者 -> [位置]
+}
+_listeners = []
+
+
+def add_change_listener(callback):
+    """註冊異動監聽函式 callback(change)，每套用一筆異動（含其他程序寫入者）即呼叫"""
+    _listeners.append(callback)
+
+
+def _apply(change: Dict):
+    """將一筆異動套用到彙整檢視與索引"""
+    pos = len(_state["changes"])
+    _state["changes"].append(change)
+    patient_id = change["patient_id"]
+    _state["view"].setdefault(patient_id, {})[change["field"]] = change["new"]
+    _state["updated"][patient_id] = change
+    _state["by_patient"].setdefault(patient_id, []).append(pos)
+    _state["by_field"].setdefault(change["field"], []).append(pos)
+    _state["by_user"].setdefault(change.get("user") or "", []).append(pos)
+    for callback in _listeners:
+        callback(change)
+
+
+def _refresh():
+    """讀取紀錄檔新增的部分（包含其他程序寫入的異動）"""
+    try:
+        size = os.path.getsize(CLINICAL_LOG_FILE)
+    except OSError:
+        return
+    if size < _state["offset"]:
+        # 紀錄檔被重建：全部重新載入
+        for key in ("view", "updated", "by_patient", "by_field", "by_user"):
+            _state[key] = {}
+        _state["changes"] = []
+        _state["offset"] = 0
+    if size == _state["offset"]:
+        return
+
+    with open(CLINICAL_LOG_FILE, "rb") as f:
+        f.seek(_state["offset"])
+        chunk = f.read()
+    # 只處理完整的行，未寫完的行留待下次
+    end = chunk.rfind(b"\n") + 1
+    for line in chunk[:end].splitlines():
+        if line.strip():
+            try:
+                _apply(json.loads(line))
+            except ValueError:
+                continue
+    _state["offset"] += end
+
+
+def refresh():
+    """同步紀錄檔中新增的異動"""
+    with _lock:
+        _refresh()
+
+
+def log_version() -> int:
+    """紀錄檔版本（檔案大小），用於判斷快取是否失效"""
+    try:
+        return os.path.getsize(CLINICAL_LOG_FILE)
+    except OSError:
+        return 0
+
+
+def get_clinical(patient_id: str, legacy: Optional[Dict] = None) -> Dict:
+    """取得病人目前的臨床資料（舊版整包資料 + 異動紀錄）"""
+    with _lock:
+        _refresh()
+        return {**(legacy or {}), **_state["view"].get(patient_id, {})}
+
+
+def get_last_update(patient_id: str) -> Optional[Dict]:
+    """取得病人最後一筆臨床資料異動"""
+    with _lock:
+        _refresh()
+        return _state["updated"].get(patient_id)
+
+
+def save_clinical_changes(patient_id: str, base: Dict, updated: Dict, user: str = "",
+                          legacy: Optional[Dict] = None) -> Dict:
+    """儲存臨床資料異動
+
+    base: 編輯者開始編輯時看到的資料；updated: 編輯後的資料。
+    只有 updated 與 base 不同的欄位會寫入。若同一欄位在編輯期間已被他人修改，
+    仍以本次寫入為準，並列於回傳的 conflicts 供畫面提示。
+
+    回傳 {"changes": [已寫入的異動], "conflicts": [欄位名稱]}
+    """
+    os.makedirs(os.path.dirname(CLINICAL_LOG_FILE) or ".", exist_ok=True)
+    timestamp = datetime.now().isoformat()
+
+    with _lock:
+        _refresh()
+        current = {**(legacy or {}), **_state["view"].get(patient_id, {})}
+        changes = []
+        conflicts = []
+        for field, value in updated.items():
+            if field in base and base[field] == value:
+                continue
+            if current.get(field) == value:
+                continue
+            if field in base and current.get(field) != base[field]:
+                conflicts.append(field)
+            changes.append({
+                "id": new_id(),
+                "patient_id": patient_id,
+                "field": field,
+                "old": current.get(field),
+                "new": value,
+                "user": user,
+                "timestamp": timestamp,
+            })
+
+        if changes:
+            payload = "".join(json.dumps(c, ensure_ascii=False, default=str) + "\n" for c in changes)
+            with open(CLINICAL_LOG_FILE, "a", encoding="utf-8") as f:
+                f.write(payload)
+            _refresh()
+
+    return {"changes": changes, "conflicts": conflicts}
+
+
+def get_change_history(patient_id: str = None, field: str = None, user: str = None,
+                       limit: int = 50) -> List[Dict]:
+    """查詢異動紀錄（新到舊），可依病人、欄位、修改者篩選"""
+    with _lock:
+        _refresh()
+        candidates = []
+        if patient_id is not None:
+            candidates.append(_state["by_patient"].get(patient_id, []))
+        if field is not None:
+            candidates.append(_state["by_field"].get(field, []))
+        if user is not None:
+            candidates.append(_state["by_user"].get(user, []))
+
+        if not candidates:
+            positions = range(len(_state["changes"]) - 1, -1, -1)
+        else:
+            # 以最小的索引清單為主，其餘條件逐筆檢查
+            smallest = min(candidates, key=len)
+            positions = reversed(smallest)
+
+        result = []
+        for pos in positions:
+            change = _state["changes"][pos]
+            if patient_id is not None and change["patient_id"] != patient_id:
+                continue
+            if field is not None and change["field"] != field:
+                continue
+            if user is not None and (change.get("user") or "") != user:
+                continue
+            result.append(change)
+            if len(result) >= limit:
+                break
+        return result
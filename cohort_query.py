@@ -0,0 +1,204 @@
+"""
+AI-CARE Lung Pro - 族群查詢
+============================
+
+以點陣圖索引（bitmap index）查詢符合臨床條件的病人族群，例如：
+「Lobectomy + EGFR L858R + 術後 30-90 天 + 有待處理黃色警示」
+
+- 每個類別值 / 多選值對應一個點陣圖（以 Python 整數儲存，第 i 位元代表登錄庫第 i 列）
+- 條件之間以位元 AND / OR 組合，萬人規模仍可即時回應
+- 點陣圖於第一次使用該欄位時建立，登錄庫或資料檔異動後重建
+"""
+
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import data_manager
+from clinical_registry import get_registry
+
+
+def _to_bitmap(mask: np.ndarray) -> int:
+    """布林陣列 → 點陣圖"""
+    if not mask.any():
+        return 0
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def _to_rows(bitmap: int, n: int) -> np.ndarray:
+    """點陣圖 → 列號陣列"""
+    if not bitmap:
+        return np.empty(0, dtype=np.int64)
+    raw = bitmap.to_bytes((n + 7) // 8, "little")
+    bits = np.unpackbits(np.frombuffer(raw, dtype=np.uint8), bitorder="little")[:n]
+    return np.flatnonzero(bits)
+
+
+class CohortIndex:
+    """登錄庫某一版本的點陣圖索引"""
+
+    def __init__(self, registry, data: Dict, today: date):
+        self.registry = registry
+        self.patient_ids = list(registry.patient_ids)
+        self.n = len(self.patient_ids)
+        self.all = (1 << self.n) - 1
+        self._lock = threading.Lock()
+        self._categorical = {}  # 欄位 -> {值: 點陣圖}
+
+        # 待處理警示
+        alert_masks = {"red": np.zeros(self.n, dtype=bool), "yellow": np.zeros(self.n, dtype=bool)}
+        for alert in data.get("alerts", []):
+            if alert.get("status") != "pending":
+                continue
+            row = registry.row_of.get(alert.get("patient_id"))
+            if row is not None and row < self.n and alert.get("level") in alert_masks:
+                alert_masks[alert["level"]][row] = True
+        self.alerts = {level: _to_bitmap(mask) for level, mask in alert_masks.items()}
+        self.alerts["any"] = self.alerts["red"] | self.alerts["yellow"]
+
+        # 術後天數：臨床資料的手術日期優先，其次為病人基本資料
+        surgery_dates = registry.dates["surgery_date"][:self.n].copy()
+        missing = np.isnat(surgery_dates)
+        if missing.any():
+            patients = data.get("patients", {})
+            for row in np.flatnonzero(missing):
+                fallback = patients.get(self.patient_ids[row], {}).get("surgery_date")
+                if fallback:
+                    try:
+                        surgery_dates[row] = np.datetime64(str(fallback)[:10], "D")
+                    except ValueError:
+                        pass
+        days = (np.datetime64(today, "D") - surgery_dates).astype("timedelta64[D]")
+        self.post_op_day = np.where(np.isnat(days), np.nan, days.astype(np.float64))
+
+    def field_bitmaps(self, field: str) -> Dict[str, int]:
+        """欄位各值的點陣圖（第一次使用時建立）"""
+        with self._lock:
+            bitmaps = self._categorical.get(field)
+            if bitmaps is not None:
+                return bitmaps
+
+            registry = self.registry
+            bitmaps = {}
+            if field in registry.categorical:
+                codes = registry.categorical[field][:self.n]
+                for code, value in enumerate(registry.categories[field]):
+                    bitmaps[value] = _to_bitmap(codes == code)
+            elif field in registry.multi:
+                masks = {}
+                for row, row_codes in registry.multi[field].items():
+                    if row >= self.n:
+                        continue
+                    for code in row_codes:
+                        mask = masks.get(code)
+                        if mask is None:
+                            mask = masks[code] = np.zeros(self.n, dtype=bool)
+                        mask[row] = True
+                for code, mask in masks.items():
+                    bitmaps[registry.multi_categories[field][code]] = _to_bitmap(mask)
+            else:
+                raise KeyError(f"不支援的查詢欄位：{field}")
+
+            self._categorical[field] = bitmaps
+            return bitmaps
+
+    def post_op_day_bitmap(self, lo: Optional[int] = None, hi: Optional[int] = None) -> int:
+        mask = ~np.isnan(self.post_op_day)
+        if lo is not None:
+            mask &= self.post_op_day >= lo
+        if hi is not None:
+            mask &= self.post_op_day <= hi
+        return _to_bitmap(mask)
+
+    def patient_ids_of(self, bitmap: int) -> List[str]:
+        return [self.patient_ids[row] for row in _to_rows(bitmap, self.n)]
+
+
+_index_cache = {"key": None, "index": None}
+_index_lock = threading.Lock()
+
+
+def get_cohort_index() -> CohortIndex:
+    """取得目前資料版本的點陣圖索引"""
+    registry = get_registry()
+    key = (registry.version, len(registry), data_manager.data_version(), date.today())
+    with _index_lock:
+        if _index_cache["key"] != key:
+            _index_cache["index"] = CohortIndex(registry, data_manager.load_data(), date.today())
+            _index_cache["key"] = key
+        return _index_cache["index"]
+
+
+class CohortQuery:
+    """族群查詢條件
+
+    用法：
+        CohortQuery().where("surgery_type", "Lobectomy").where("egfr", "L858R") \\
+            .post_op_day(30, 90).pending_alert("yellow").run()
+
+    同一次 where 的多個值為 OR，不同條件之間為 AND。
+    """
+
+    def __init__(self):
+        self.conditions: List[Tuple] = []
+
+    def where(self, field: str, *values) -> "CohortQuery":
+        if values:
+            self.conditions.append(("field", field, values))
+        return self
+
+    def post_op_day(self, lo: Optional[int] = None, hi: Optional[int] = None) -> "CohortQuery":
+        if lo is not None or hi is not None:
+            self.conditions.append(("post_op_day", lo, hi))
+        return self
+
+    def pending_alert(self, level: str = "any") -> "CohortQuery":
+        """有待處理警示（level：red / yellow / any）"""
+        self.conditions.append(("alert", level))
+        return self
+
+    def bitmap(self, index: Optional[CohortIndex] = None) -> int:
+        index = index or get_cohort_index()
+        result = index.all
+        for condition in self.conditions:
+            kind = condition[0]
+            if kind == "field":
+                _, field, values = condition
+                bitmaps = index.field_bitmaps(field)
+                matched = 0
+                for value in values:
+                    matched |= bitmaps.get(value, 0)
+            elif kind == "post_op_day":
+                matched = index.post_op_day_bitmap(condition[1], condition[2])
+            else:
+                matched = index.alerts.get(condition[1], 0)
+            result &= matched
+            if not result:
+                break
+        return result
+
+    def run(self) -> List[str]:
+        """回傳符合條件的病人 ID"""
+        index = get_cohort_index()
+        return index.patient_ids_of(self.bitmap(index))
+
+    def count(self) -> int:
+        return bin(self.bitmap()).count("1")
+
+
+def query_cohort(filters: Dict[str, List] = None, post_op_day: Tuple = (None, None),
+                 pending_alert: Optional[str] = None) -> List[str]:
+    """依條件查詢病人 ID
+
+    filters: {欄位: [值, ...]}；post_op_day: (最小天數, 最大天數)；
+    pending_alert: None / "red" / "yellow" / "any"
+    """
+    query = CohortQuery()
+    for field, values in (filters or {}).items():
+        query.where(field, *values)
+    query.post_op_day(*post_op_day)
+    if pending_alert:
+        query.pending_alert(pending_alert)
+    return query.run()
@@ -32,5 +32,54 @@ DEPARTMENT_NAME = "數位醫學中心"
 ALERT_THRESHOLD_RED = 7      # 紅色警示（≥7分）
 ALERT_THRESHOLD_YELLOW = 4   # 黃色警示（≥4分）
 
+# 個別症狀警示閾值（只判斷列出的症狀，其餘症狀只計入整體分數）
+SYMPTOM_ALERT_THRESHOLDS = {
+    "呼吸困難": {"red": 6, "yellow": 3},
+    "發燒": {"red": 6, "yellow": 3},
+    "咳血": {"red": 3, "yellow": 1},
+}
+
+# 症狀惡化：分數較病人近期回報平均上升達此分數即為黃色警示
+ALERT_TREND_DELTA = 3
+ALERT_TREND_WINDOW = 7       # 近期回報筆數
+BASELINE_EWMA_ALPHA = 0.3    # 病人症狀基準值（指數加權平均）的新回報權重
+
+# 術後各階段可接受的症狀上限，超過即為黃色警示：(術後起始天數, 術後結束天數, {症狀: 上限})
+POST_OP_SYMPTOM_LIMITS = [
+    (0, 7, {"疼痛": 6}),
+    (8, 30, {"疼痛": 4, "咳嗽": 5}),
+    (31, None, {"疼痛": 3, "咳嗽": 4, "疲勞": 4}),
+]
+
 # 資料檔案路徑
 DATA_FILE = "data/patient_records.json"
+
+# ePRO 回報排程：(術後起始天數, 術後結束天數, 預期回報間隔天數)
+# 結束天數為 None 表示之後皆適用
+EPRO_SCHEDULE = [
+    (0, 30, 1),     # 術後一個月內：每日回報
+    (31, 90, 7),    # 術後 1-3 個月：每週回報
+    (91, None, 30), # 術後 3 個月後：每月回報
+]
+
+# 研究分析快照（Parquet）：輸出目錄與自動更新間隔（分鐘）
+SNAPSHOT_DIR = "data/snapshot"
+SNAPSHOT_INTERVAL_MINUTES = 60
+
+# 匯出檔保留時數：超過即刪除（含識別資料的匯出不長期留存）
+EXPORT_RETENTION_HOURS = 24
+
+# 警示升級：待處理超過指定分鐘數即升級（依序為 第 1 級「逾時」、第 2 級「嚴重逾時」）
+ALERT_ESCALATION_MINUTES = {
+    "red": [30, 120],
+    "yellow": [240, 1440],
+}
+
+# 逾期未回報偵測：超過預期回報間隔再 N 天仍未回報即產生追蹤警示；背景檢查間隔（分鐘）
+MISSED_REPORT_GRACE_DAYS = 2
+MISSED_REPORT_SWEEP_MINUTES = 60
+
+# 多工作程序部署：共用狀態服務位址（例如 ("127.0.0.1", 50055)），None 表示單一程序（本機模式）
+# 亦可用環境變數 AICARE_STATE_SERVICE=host:port 指定；服務以 python state_service.py 啟動
+STATE_SERVICE_ADDRESS = None
+STATE_SERVICE_AUTHKEY = "aicare-state-service"
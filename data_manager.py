@@ -5,13 +5,23 @@ AI-CARE Lung Pro - 資料管理模組
 處理病人回報資料的讀取與儲存
 """
 
+import bisect
 import json
 import os
+import threading
 from datetime import datetime
 from typing import Dict, List, Optional
-import uuid
+
+from id_generator import new_id
+from clinical_store import get_clinical, save_clinical_changes
+from derived_attributes import attach_derived, attach_compliance, update_compliance, effective_surgery_date
+from alert_scoring import get_scoring_engine, report_scores
+from symptom_baseline import build_baselines, update_baselines
+from symptom_vocabulary import normalize_symptoms
+from state_service import cached, data_lock
 
 DATA_FILE = "data/patient_records.json"
+MATERIAL_EDITS_FILE = "data/material_edits.json"
 
 def ensure_data_file():
     """確保資料檔案存在"""
@@ -36,13 +46,23 @@ def load_data() -> Dict:
         return {"patients": {}, "reports": [], "alerts": [], "interventions": []}
 
 def save_data(data: Dict):
-    """儲存資料"""
+    """儲存資料（先寫暫存檔再取代，其他程序不會讀到寫到一半的檔案）
+
+    讀取 → 修改 → 寫回的操作需在 data_lock() 內進行，多工作程序部署時才不會互相覆蓋。
+    """
     ensure_data_file()
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
+    tmp_path = f"{DATA_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, DATA_FILE)
+    _rebuild_patient_lookup(data.get("patients", {}), data_version())
 
 def get_or_create_patient(patient_id: str, patient_info: Dict = None) -> Dict:
     """取得或建立病人資料"""
+    with data_lock():
+        return _get_or_create_patient(patient_id, patient_info)
+
+def _get_or_create_patient(patient_id: str, patient_info: Dict = None) -> Dict:
     data = load_data()
     
     if patient_id not in data["patients"]:
@@ -66,23 +86,45 @@ def get_or_create_patient(patient_id: str, patient_info: Dict = None) -> Dict:
 
 def save_report(patient_id: str, report: Dict):
     """儲存症狀回報"""
+    with data_lock():
+        return _save_report(patient_id, report)
+
+def _save_report(patient_id: str, report: Dict):
     data = load_data()
+    _sync_open_alerts(data)
+    engine = get_scoring_engine()
+    engine.sync(data["reports"], data_version())
     
     # 建立回報記錄
     report_record = {
-        "id": str(uuid.uuid4())[:8],
+        "id": new_id(),
         "patient_id": patient_id,
         "timestamp": datetime.now().isoformat(),
         "date": datetime.now().strftime("%Y-%m-%d"),
         "time": datetime.now().strftime("%H:%M"),
         "symptoms": report.get("symptoms", []),
+        "symptom_codes": normalize_symptoms(report.get("symptoms", [])),
         "scores": report.get("scores", {}),
         "overall_score": report.get("overall_score", 0),
         "conversation": report.get("conversation", []),
         "status": "completed"
     }
     
+    # 警示評分（需在本次回報加入近期視窗與基準值前）
+    patient = data["patients"].get(patient_id)
+    if patient is not None and "baselines" not in patient:
+        # 舊資料：由既有回報補建一次症狀基準值
+        patient["baselines"] = build_baselines(r for r in data["reports"] if r["patient_id"] == patient_id)
+    level, reasons = engine.evaluate(patient_id, report_record, _post_op_day(patient),
+                                     patient.get("baselines") if patient else None)
+    
     data["reports"].append(report_record)
+    engine.observe(report_record)
+    if patient is not None:
+        update_baselines(patient["baselines"], report_scores(report_record))
+        compliance_rate = update_compliance(patient_id, data["reports"])
+        if compliance_rate is not None:
+            patient["compliance_rate"] = compliance_rate
     
     # 更新病人資料
     if patient_id in data["patients"]:
@@ -90,37 +132,133 @@ def save_report(patient_id: str, report: Dict):
         data["patients"][patient_id]["total_reports"] = len([r for r in data["reports"] if r["patient_id"] == patient_id])
     
     # 檢查是否需要產生警示
-    overall_score = report.get("overall_score", 0)
-    if overall_score >= 7:
-        alert = create_alert(patient_id, "red", report)
-        data["alerts"].append(alert)
-    elif overall_score >= 4:
-        alert = create_alert(patient_id, "yellow", report)
-        data["alerts"].append(alert)
+    if level:
+        open_pos = _open_alerts["by_patient"].get(patient_id)
+        if open_pos is not None:
+            # 病人已有待處理警示：併入既有警示，不另開新警示
+            coalesce_alert(data["alerts"][open_pos], level, report_record, reasons)
+        else:
+            data["alerts"].append(create_alert(patient_id, level, report_record, reasons, patient or {}))
+            _open_alerts["by_patient"][patient_id] = len(data["alerts"]) - 1
+    _open_alerts["n_seen"] = len(data["alerts"])
     
     save_data(data)
+    _open_alerts["version"] = engine.version = data_version()
     return report_record
 
-def create_alert(patient_id: str, level: str, report: Dict) -> Dict:
-    """建立警示"""
-    data = load_data()
-    patient = data["patients"].get(patient_id, {})
+def _post_op_day(patient: Optional[Dict]) -> Optional[int]:
+    """病人目前的術後天數（無手術日期時為 None）"""
+    if not patient:
+        return None
+    surgery_date = effective_surgery_date({**patient, "clinical": get_clinical(patient.get("id"), patient.get("clinical"))})
+    if not surgery_date:
+        return None
+    try:
+        return (datetime.now().date() - datetime.strptime(str(surgery_date)[:10], "%Y-%m-%d").date()).days
+    except ValueError:
+        return None
+
+def create_alert(patient_id: str, level: str, report: Dict, reasons: List[str] = None,
+                 patient: Dict = None) -> Dict:
+    """建立警示（未傳入病人資料時由資料檔讀取）"""
+    if patient is None:
+        patient = load_data()["patients"].get(patient_id, {})
     
     return {
-        "id": str(uuid.uuid4())[:8],
+        "id": new_id(),
         "patient_id": patient_id,
         "patient_name": patient.get("name", "未知"),
         "level": level,
         "score": report.get("overall_score", 0),
         "symptoms": report.get("symptoms", []),
+        "symptom_codes": report.get("symptom_codes", []),
         "timestamp": datetime.now().isoformat(),
         "time_display": datetime.now().strftime("%H:%M"),
         "status": "pending",  # pending, contacted, resolved
         "handled_by": None,
         "handled_at": None,
-        "notes": ""
+        "notes": "",
+        "count": 1,  # 併入此警示的觸發次數
+        "reasons": reasons or []
     }
 
+def coalesce_alert(alert: Dict, level: str, report: Dict, reasons: List[str] = None) -> Dict:
+    """將重複觸發併入待處理警示：更新分數、症狀聯集與次數，黃燈可升為紅燈（記錄 upgraded_at）"""
+    score = report.get("overall_score", 0)
+    alert["count"] = alert.get("count", 1) + 1
+    alert["score"] = max(alert.get("score", 0), score)
+    alert["last_score"] = score
+    alert["symptoms"] = list(dict.fromkeys((alert.get("symptoms") or []) + (report.get("symptoms") or [])))
+    alert["symptom_codes"] = sorted(set(alert.get("symptom_codes") or []) | set(report.get("symptom_codes") or []))
+    alert["reasons"] = list(dict.fromkeys((alert.get("reasons") or []) + (reasons or [])))
+    now = datetime.now().isoformat()
+    if level == "red" and alert.get("level") != "red":
+        # 升級後的處理時限由升級時間起算（見 alert_escalation）
+        alert["level"] = "red"
+        alert["upgraded_at"] = now
+    alert["last_triggered_at"] = now
+    return alert
+
+# ============================================
+# 待處理警示索引
+# ============================================
+# 每位病人目前的待處理警示位置，供 save_report 合併重複觸發（在 data_lock() 內存取）
+# 逾期未回報警示另外索引：症狀觸發不併入，以免沿用其類型與建立時間
+_open_alerts = {
+    "version": None,    # 已同步的資料檔版本
+    "n_seen": 0,        # 已檢查過的警示數
+    "by_patient": {},   # patient_id -> 待處理症狀警示在 alerts 中的位置
+    "missed": {},       # patient_id -> 待處理逾期未回報警示在 alerts 中的位置
+}
+
+def _open_index(alert: Dict) -> Dict:
+    return _open_alerts["missed"] if alert.get("type") == "missed_report" else _open_alerts["by_patient"]
+
+def _sync_open_alerts(data: Dict):
+    """資料檔異動後同步：只檢查索引中的警示是否仍待處理，以及新增的警示"""
+    version = data_version()
+    if version == _open_alerts["version"]:
+        return
+    alerts = data["alerts"]
+    if len(alerts) < _open_alerts["n_seen"]:
+        _open_alerts.update(n_seen=0, by_patient={}, missed={})
+    for index in (_open_alerts["by_patient"], _open_alerts["missed"]):
+        for patient_id, pos in list(index.items()):
+            if pos >= len(alerts) or alerts[pos].get("status") != "pending" or alerts[pos].get("patient_id") != patient_id:
+                del index[patient_id]
+    for pos in range(_open_alerts["n_seen"], len(alerts)):
+        if alerts[pos].get("status") == "pending":
+            _open_index(alerts[pos])[alerts[pos]["patient_id"]] = pos
+    _open_alerts["n_seen"] = len(alerts)
+    _open_alerts["version"] = version
+
+def create_missed_report_alerts(overdue: List[Dict]) -> List[Dict]:
+    """為逾期未回報的病人建立黃燈警示（已有待處理警示者略過），回傳新建立的警示
+
+    overdue 項目需含 patient_id、basis（最後回報或收案日期）、days_since、interval。
+    """
+    with data_lock():
+        data = load_data()
+        _sync_open_alerts(data)
+        created = []
+        for item in overdue:
+            patient_id = item["patient_id"]
+            patient = data["patients"].get(patient_id)
+            if patient is None or patient_id in _open_alerts["by_patient"] or patient_id in _open_alerts["missed"]:
+                continue
+            reason = f"已 {item['days_since']} 天未回報（目前預期每 {item['interval']} 天回報）"
+            alert = create_alert(patient_id, "yellow", {"overall_score": 0, "symptoms": []}, [reason], patient)
+            alert["type"] = "missed_report"
+            alert["missed_since"] = item["basis"]
+            data["alerts"].append(alert)
+            _open_alerts["missed"][patient_id] = len(data["alerts"]) - 1
+            created.append(alert)
+        if created:
+            _open_alerts["n_seen"] = len(data["alerts"])
+            save_data(data)
+            _open_alerts["version"] = data_version()
+        return created
+
 def get_patient_reports(patient_id: str, limit: int = 10) -> List[Dict]:
     """取得病人的回報記錄"""
     data = load_data()
@@ -135,6 +273,8 @@ def get_all_patients() -> List[Dict]:
     
     # 計算每個病人的狀態
     for patient in patients:
+        patient["clinical"] = get_clinical(patient["id"], patient.get("clinical"))
+        
         patient_reports = [r for r in data["reports"] if r["patient_id"] == patient["id"]]
         if patient_reports:
             latest = max(patient_reports, key=lambda x: x["timestamp"])
@@ -153,6 +293,9 @@ def get_all_patients() -> List[Dict]:
             patient["status"] = "no_report"
             patient["last_score"] = None
     
+    # 術後天數等衍生欄位（每日計算一次）、ePRO 填答率
+    attach_derived(patients)
+    attach_compliance(patients, data["reports"])
     return patients
 
 def get_pending_alerts() -> List[Dict]:
@@ -160,69 +303,144 @@ def get_pending_alerts() -> List[Dict]:
     data = load_data()
     alerts = [a for a in data["alerts"] if a["status"] == "pending"]
     alerts.sort(key=lambda x: (x["level"] == "red", x["timestamp"]), reverse=True)
-    return alerts
+    return attach_patient_info(alerts)
 
 def get_all_alerts(limit: int = 50) -> List[Dict]:
     """取得所有警示"""
     data = load_data()
     alerts = data["alerts"]
     alerts.sort(key=lambda x: x["timestamp"], reverse=True)
-    return alerts[:limit]
+    return attach_patient_info(alerts[:limit])
 
 def update_alert_status(alert_id: str, status: str, handled_by: str = None, notes: str = ""):
     """更新警示狀態"""
-    data = load_data()
-    for alert in data["alerts"]:
-        if alert["id"] == alert_id:
-            alert["status"] = status
-            alert["handled_by"] = handled_by
-            alert["handled_at"] = datetime.now().isoformat()
-            alert["notes"] = notes
-            break
-    save_data(data)
+    with data_lock():
+        data = load_data()
+        for alert in data["alerts"]:
+            if alert["id"] == alert_id:
+                alert["status"] = status
+                alert["handled_by"] = handled_by
+                alert["handled_at"] = datetime.now().isoformat()
+                alert["notes"] = notes
+                break
+        save_data(data)
 
 def save_intervention(patient_id: str, intervention: Dict):
     """儲存介入紀錄"""
-    data = load_data()
-    
-    record = {
-        "id": str(uuid.uuid4())[:8],
-        "patient_id": patient_id,
-        "timestamp": datetime.now().isoformat(),
-        "date": datetime.now().strftime("%Y-%m-%d"),
-        "time": datetime.now().strftime("%H:%M"),
-        "type": intervention.get("type", "電話"),
-        "content": intervention.get("content", ""),
-        "duration": intervention.get("duration", ""),
-        "referral": intervention.get("referral"),
-        "nurse": intervention.get("nurse", "")
-    }
-    
-    data["interventions"].append(record)
-    save_data(data)
+    with _intervention_lock, data_lock():
+        data = load_data()
+        
+        record = {
+            "id": new_id(),
+            "patient_id": patient_id,
+            "timestamp": datetime.now().isoformat(),
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "time": datetime.now().strftime("%H:%M"),
+            "type": intervention.get("type", "電話"),
+            "content": intervention.get("content", ""),
+            "duration": intervention.get("duration", ""),
+            "referral": intervention.get("referral"),
+            "nurse": intervention.get("nurse", "")
+        }
+        
+        data["interventions"].append(record)
+        save_data(data)
+        _index_interventions(data["interventions"], data_version())
     return record
 
 def get_interventions(patient_id: str = None, limit: int = 20) -> List[Dict]:
-    """取得介入紀錄"""
-    data = load_data()
-    
-    if patient_id:
-        interventions = [i for i in data["interventions"] if i["patient_id"] == patient_id]
-    else:
-        interventions = data["interventions"]
-    
-    interventions.sort(key=lambda x: x["timestamp"], reverse=True)
-    return interventions[:limit]
+    """取得介入紀錄（新到舊），由索引直接取前 limit 筆"""
+    with _intervention_lock:
+        _sync_intervention_index()
+        if patient_id:
+            keys = _intervention_index["by_patient"].get(patient_id, [])
+        else:
+            keys = _intervention_index["recent"]
+        records = _intervention_index["records"]
+        result = [dict(records[pos]) for _, pos in reversed(keys[-limit:])] if limit > 0 else []
+    return attach_patient_info(result)
+
+def count_interventions(patient_id: str = None) -> int:
+    with _intervention_lock:
+        _sync_intervention_index()
+        if patient_id:
+            return len(_intervention_index["by_patient"].get(patient_id, []))
+        return len(_intervention_index["records"])
+
+# ============================================
+# 介入紀錄索引
+# ============================================
+# 介入紀錄只新增不修改：資料檔異動時只索引新增的紀錄
+_intervention_lock = threading.RLock()
+_intervention_index = {
+    "version": None,    # 已同步的資料檔版本
+    "records": [],      # 依寫入順序的介入紀錄
+    "recent": [],       # [(timestamp, 位置)]，依時間排序
+    "by_patient": {},   # patient_id -> [(timestamp, 位置)]
+}
+
+def _index_interventions(interventions: List[Dict], version):
+    if len(interventions) < len(_intervention_index["records"]):
+        # 紀錄被刪除：整批重建
+        _intervention_index.update(records=[], recent=[], by_patient={})
+    records = _intervention_index["records"]
+    for record in interventions[len(records):]:
+        key = (record.get("timestamp") or "", len(records))
+        records.append(record)
+        bisect.insort(_intervention_index["recent"], key)
+        bisect.insort(_intervention_index["by_patient"].setdefault(record.get("patient_id"), []), key)
+    _intervention_index["version"] = version
+
+def _sync_intervention_index():
+    version = data_version()
+    if version != _intervention_index["version"]:
+        _index_interventions(load_data().get("interventions", []), version)
+
+# ============================================
+# 病人顯示資料快取
+# ============================================
+# 警示、介入紀錄、衛教推送紀錄只存 patient_id，顯示時由快取併入目前的姓名與電話
+PATIENT_DISPLAY_FIELDS = {"name": "patient_name", "phone": "phone"}  # 病人欄位 -> 併入紀錄的欄位
+_patient_lookup = {"version": None, "patients": {}}
+
+def _rebuild_patient_lookup(patients: Dict, version):
+    _patient_lookup["patients"] = {
+        pid: {field: patient.get(field) for field in PATIENT_DISPLAY_FIELDS}
+        for pid, patient in patients.items()
+    }
+    _patient_lookup["version"] = version
+
+def get_patient_lookup() -> Dict[str, Dict]:
+    """patient_id -> 顯示欄位（姓名、電話）；資料檔異動後重建，本程序的 save_data 會直接更新"""
+    version = data_version()
+    if version != _patient_lookup["version"]:
+        _rebuild_patient_lookup(load_data().get("patients", {}), version)
+    return _patient_lookup["patients"]
+
+def attach_patient_info(records: List[Dict]) -> List[Dict]:
+    """將病人目前的姓名、電話併入紀錄（找不到病人時保留紀錄原有的值）"""
+    lookup = get_patient_lookup()
+    for record in records:
+        info = lookup.get(record.get("patient_id"))
+        if not info:
+            continue
+        for field, target in PATIENT_DISPLAY_FIELDS.items():
+            if info.get(field):
+                record[target] = info[field]
+    return records
 
 def get_statistics() -> Dict:
-    """取得統計資料"""
+    """取得統計資料（各工作程序共用快取，資料檔異動或跨日時重新計算）"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    return cached("statistics", (data_version(), today), lambda: _compute_statistics(today))
+
+def _compute_statistics(today: str) -> Dict:
     data = load_data()
     
     total_patients = len(data["patients"])
     total_reports = len(data["reports"])
     
     # 今日統計
-    today = datetime.now().strftime("%Y-%m-%d")
     today_reports = [r for r in data["reports"] if r["date"] == today]
     today_alerts = [a for a in data["alerts"] if a["timestamp"].startswith(today)]
     
@@ -240,3 +458,52 @@ def get_statistics() -> Dict:
         "red_alerts": red_alerts,
         "yellow_alerts": yellow_alerts
     }
+
+def data_version():
+    """資料檔版本（修改時間 + 大小），用於判斷快取是否失效"""
+    try:
+        stat = os.stat(DATA_FILE)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def save_clinical_data(patient_id: str, base: Dict, updated: Dict, user: str = "",
+                       legacy: Optional[Dict] = None) -> Dict:
+    """儲存臨床資料（僅寫入有變更的欄位，見 clinical_store.save_clinical_changes）"""
+    with data_lock():
+        return save_clinical_changes(patient_id, base, updated, user=user, legacy=legacy)
+
+# ============================================
+# 衛教單張編輯
+# ============================================
+# 後台對內建衛教單張的編輯另存一檔（material_id -> 編輯後的欄位），
+# 重新啟動後與其他工作程序由此套用（見 education_system.sync_material_edits）
+def load_material_edits() -> Dict[str, Dict]:
+    try:
+        with open(MATERIAL_EDITS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def material_edits_version():
+    """單張編輯檔版本（修改時間 + 大小）；尚未編輯過時為 None"""
+    try:
+        stat = os.stat(MATERIAL_EDITS_FILE)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def save_material_edit(material_id: str, fields: Dict, user: str = "") -> Dict:
+    """儲存衛教單張編輯（與既有編輯合併），回傳此單張目前的編輯欄位"""
+    with data_lock():
+        edits = load_material_edits()
+        entry = edits.setdefault(material_id, {})
+        entry.update(fields)
+        entry["updated_at"] = datetime.now().isoformat()
+        entry["updated_by"] = user
+        os.makedirs(os.path.dirname(MATERIAL_EDITS_FILE) or ".", exist_ok=True)
+        tmp_path = f"{MATERIAL_EDITS_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(edits, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, MATERIAL_EDITS_FILE)
+        return entry
@@ -0,0 +1,256 @@
+"""
+AI-CARE Lung Pro - 病人衍生欄位
+================================
+
+由手術日期、最後回報時間推算的欄位，每日（或手術日期 / 回報異動時）計算一次並快取：
+- post_op_day：術後天數
+- days_since_last_report：距最後一次回報天數
+- epro_interval：目前追蹤階段的預期回報間隔（天）
+- report_due：是否已超過預期回報間隔
+- compliance_rate：ePRO 填答率（依實際回報日期與預期回報時段計算）
+"""
+
+import threading
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from config import EPRO_SCHEDULE
+except ImportError:
+    EPRO_SCHEDULE = [(0, 30, 1), (31, 90, 7), (91, None, 30)]
+
+_lock = threading.Lock()
+_cache = {
+    "day": None,         # 計算基準日
+    "signature": {},     # patient_id -> (手術日期, 最後回報時間)
+    "values": {},        # patient_id -> 衍生欄位
+}
+
+
+def effective_surgery_date(patient: Dict) -> Optional[str]:
+    """手術日期：臨床資料優先，其次為病人基本資料"""
+    clinical = patient.get("clinical") or {}
+    return clinical.get("surgery_date") or patient.get("surgery_date")
+
+
+def _to_days(values: List[Optional[str]]) -> np.ndarray:
+    """日期字串 → datetime64[D] 陣列（無法解析者為 NaT）"""
+    out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+    for i, value in enumerate(values):
+        if value:
+            try:
+                out[i] = np.datetime64(str(value)[:10], "D")
+            except ValueError:
+                pass
+    return out
+
+
+def epro_interval_for(post_op_day: np.ndarray) -> np.ndarray:
+    """依術後天數取得預期回報間隔（向量化），未知者為 NaN"""
+    interval = np.full(post_op_day.shape, np.nan)
+    for start, end, every in EPRO_SCHEDULE:
+        mask = post_op_day >= start
+        if end is not None:
+            mask &= post_op_day <= end
+        interval[mask] = every
+    return interval
+
+
+def compute_derived(patient_ids: List[str], surgery_dates: List[Optional[str]],
+                    last_reports: List[Optional[str]], today: date) -> List[Dict]:
+    """一次計算多位病人的衍生欄位"""
+    today64 = np.datetime64(today, "D")
+    post_op = (today64 - _to_days(surgery_dates)).astype("timedelta64[D]")
+    since = (today64 - _to_days(last_reports)).astype("timedelta64[D]")
+
+    post_op_day = np.where(np.isnat(post_op), np.nan, post_op.astype(np.float64))
+    days_since = np.where(np.isnat(since), np.nan, since.astype(np.float64))
+    interval = epro_interval_for(post_op_day)
+    # 從未回報者以術後天數作為距上次回報天數
+    overdue_days = np.where(np.isnan(days_since), post_op_day, days_since)
+    due = overdue_days > interval
+
+    results = []
+    for i in range(len(patient_ids)):
+        results.append({
+            "post_op_day": None if np.isnan(post_op_day[i]) else int(post_op_day[i]),
+            "days_since_last_report": None if np.isnan(days_since[i]) else int(days_since[i]),
+            "epro_interval": None if np.isnan(interval[i]) else int(interval[i]),
+            "report_due": bool(due[i]),
+        })
+    return results
+
+
+def attach_derived(patients: List[Dict], today: Optional[date] = None) -> List[Dict]:
+    """將衍生欄位寫入病人資料；只重新計算基準日改變或手術日期 / 回報異動的病人"""
+    today = today or date.today()
+    with _lock:
+        if _cache["day"] != today:
+            _cache["day"] = today
+            _cache["signature"] = {}
+            _cache["values"] = {}
+
+        stale_ids, stale_surgery, stale_report = [], [], []
+        for patient in patients:
+            signature = (effective_surgery_date(patient), patient.get("last_report"))
+            if _cache["signature"].get(patient["id"]) != signature:
+                stale_ids.append(patient["id"])
+                stale_surgery.append(signature[0])
+                stale_report.append(signature[1])
+                _cache["signature"][patient["id"]] = signature
+
+        if stale_ids:
+            for patient_id, values in zip(stale_ids, compute_derived(stale_ids, stale_surgery, stale_report, today)):
+                _cache["values"][patient_id] = values
+
+        for patient in patients:
+            patient.update(_cache["values"].get(patient["id"], {}))
+    return patients
+
+
+# ============================================
+# ePRO 填答率
+# ============================================
+# 依 EPRO_SCHEDULE 將術後天數切成回報時段（例如術後一個月內每天一段、之後每週一段），
+# 填答率 = 有回報的時段數 / 應回報的時段數。
+# 應回報時段從收案日（建檔日與手術日較晚者）起算：已結束的時段，加上今天所在且已回報的時段。
+_SLOT_BITS = 20     # 時段編號位元數
+_PHASE_BITS = 4     # 階段編號位元數
+
+
+def _schedule_arrays():
+    schedule = sorted(EPRO_SCHEDULE)
+    starts = np.array([s for s, _, _ in schedule], dtype=np.float64)
+    ends = np.array([np.inf if e is None else e for _, e, _ in schedule], dtype=np.float64)
+    every = np.array([n for _, _, n in schedule], dtype=np.float64)
+    return starts, ends, every
+
+
+def _slots_ended_by(day: np.ndarray) -> np.ndarray:
+    """術後第 day 天（含）以前已結束的回報時段數（向量化）"""
+    starts, ends, every = _schedule_arrays()
+    total = np.zeros(day.shape)
+    for start, end, n in zip(starts, ends, every):
+        full = np.floor((np.minimum(day, end) - start + 1) / n)
+        if np.isfinite(end):
+            # 階段結束後，最後一段不足 n 天的時段也算結束
+            full = np.where(day >= end, np.ceil((end - start + 1) / n), full)
+        total += np.where(day >= start, np.maximum(full, 0), 0)
+    return np.nan_to_num(total)
+
+
+def _slot_keys(rows: np.ndarray, post_op_day: np.ndarray) -> np.ndarray:
+    """(病人列, 術後天數) → 回報時段鍵（無效者為 -1）"""
+    starts, ends, every = _schedule_arrays()
+    valid = (rows >= 0) & ~np.isnan(post_op_day) & (post_op_day >= 0)
+    day = np.where(valid, post_op_day, 0)
+    phase = np.clip(np.searchsorted(starts, day, side="right") - 1, 0, len(starts) - 1)
+    valid &= day <= ends[phase]
+    slot = np.floor((day - starts[phase]) / every[phase]).astype(np.int64)
+    keys = (rows.astype(np.int64) << (_PHASE_BITS + _SLOT_BITS)) | (phase.astype(np.int64) << _SLOT_BITS) | slot
+    return np.where(valid, keys, -1)
+
+
+class ComplianceIndex:
+    """各病人已回報的時段；回報只新增，新回報逐批加入，手術 / 收案日期異動時整批重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.signature = {}                 # patient_id -> (手術日期, 建檔時間)
+        self.rows = {}                      # patient_id -> 列
+        self.patient_ids = []
+        self.surgery = np.empty(0, dtype="datetime64[D]")
+        self.enroll_day = np.empty(0)       # 收案時的術後天數
+        self.keys = set()
+        self.fulfilled = np.empty(0, dtype=np.int64)
+        self.n_seen = 0
+
+    def set_patients(self, patients: List[Dict]):
+        signature = {p["id"]: (effective_surgery_date(p), p.get("created_at")) for p in patients}
+        if signature == self.signature:
+            return
+        self.signature = signature
+        self.patient_ids = list(signature)
+        self.rows = {pid: i for i, pid in enumerate(self.patient_ids)}
+        self.surgery = _to_days([s for s, _ in signature.values()])
+        created = _to_days([c for _, c in signature.values()])
+        enroll = (created - self.surgery).astype("timedelta64[D]")
+        self.enroll_day = np.where(np.isnat(enroll), 0, np.maximum(enroll.astype(np.float64), 0))
+        self.keys = set()
+        self.fulfilled = np.zeros(len(self.patient_ids), dtype=np.int64)
+        self.n_seen = 0
+
+    def sync_reports(self, reports: List[Dict]):
+        """加入尚未處理的回報（一次向量化計算其時段）"""
+        if len(reports) < self.n_seen:
+            self.keys = set()
+            self.fulfilled[:] = 0
+            self.n_seen = 0
+        new = reports[self.n_seen:]
+        if new and self.patient_ids:
+            rows = np.array([self.rows.get(r.get("patient_id"), -1) for r in new], dtype=np.int64)
+            report_days = _to_days([r.get("date") or r.get("timestamp") for r in new])
+            post_op = (report_days - self.surgery[np.maximum(rows, 0)]).astype("timedelta64[D]")
+            post_op_day = np.where(np.isnat(post_op), np.nan, post_op.astype(np.float64))
+            keys = np.unique(_slot_keys(rows, post_op_day))
+            keys = keys[keys >= 0]
+            if not self.keys:
+                self.keys = set(keys.tolist())
+                self.fulfilled += np.bincount(keys >> (_PHASE_BITS + _SLOT_BITS), minlength=len(self.fulfilled))
+            else:
+                for key in keys.tolist():
+                    if key not in self.keys:
+                        self.keys.add(key)
+                        self.fulfilled[key >> (_PHASE_BITS + _SLOT_BITS)] += 1
+        self.n_seen = len(reports)
+
+    def rates(self, today: date, rows: Optional[np.ndarray] = None) -> Dict[str, Dict]:
+        """patient_id -> {compliance_rate, expected_reports, fulfilled_reports}（可限定病人列）"""
+        rows = np.arange(len(self.patient_ids)) if rows is None else rows
+        today_day = (np.datetime64(today, "D") - self.surgery[rows]).astype("timedelta64[D]")
+        today_day = np.where(np.isnat(today_day), np.nan, today_day.astype(np.float64))
+        expected = _slots_ended_by(today_day - 1) - _slots_ended_by(self.enroll_day[rows] - 1)
+        current = _slot_keys(rows, today_day)
+        expected += np.array([k >= 0 and k in self.keys for k in current.tolist()], dtype=bool)
+        fulfilled = self.fulfilled[rows]
+
+        results = {}
+        for i, row in enumerate(rows.tolist()):
+            if np.isnan(today_day[i]) or expected[i] <= 0:
+                rate = None
+            else:
+                rate = round(min(fulfilled[i] / expected[i], 1.0) * 100)
+            results[self.patient_ids[row]] = {
+                "compliance_rate": rate,
+                "expected_reports": int(expected[i]),
+                "fulfilled_reports": int(fulfilled[i]),
+            }
+        return results
+
+
+_compliance = ComplianceIndex()
+
+
+def attach_compliance(patients: List[Dict], reports: List[Dict], today: Optional[date] = None) -> List[Dict]:
+    """計算並寫入各病人的 ePRO 填答率（compliance_rate，0-100；無法計算時為 None）"""
+    today = today or date.today()
+    with _lock:
+        _compliance.set_patients(patients)
+        _compliance.sync_reports(reports)
+        rates = _compliance.rates(today)
+    for patient in patients:
+        patient.update(rates.get(patient["id"], {}))
+    return patients
+
+
+def update_compliance(patient_id: str, reports: List[Dict], today: Optional[date] = None) -> Optional[int]:
+    """新增回報後更新填答率；尚未建立索引（或病人不在索引中）時回傳 None"""
+    today = today or date.today()
+    with _lock:
+        if patient_id not in _compliance.rows:
+            return None
+        _compliance.sync_reports(reports)
+        row = _compliance.rows[patient_id]
+        return _compliance.rates(today, np.array([row]))[patient_id]["compliance_rate"]
@@ -7,10 +7,18 @@ AI-CARE Lung - 衛教推送系統
 2. 自動推送規則
 3. 手動推送介面
 4. 推送紀錄追蹤
+5. 衛教單張全文檢索
 """
 
 from datetime import datetime, timedelta
 import json
+import math
+import re
+
+import data_manager
+from id_generator import new_id
+from state_service import SharedRef, register_shared
+from symptom_vocabulary import normalize_symptoms, text_codes
 
 # ============================================
 # 衛教單張庫
@@ -752,36 +760,176 @@ AUTO_PUSH_RULES = [
     }
 ]
 
+# ============================================
+# 推送統計（隨推送 / 讀取即時累計）
+# ============================================
+class PushStatistics:
+    """依推送日期分桶的累計統計，查詢今日、本週數據不需掃描推送紀錄"""
+    
+    # 保留的每日分桶天數
+    RETENTION_DAYS = 90
+    
+    def __init__(self):
+        self.daily = {}  # "YYYY-MM-DD" -> 當日分桶
+        self.totals = self._new_bucket()
+    
+    @staticmethod
+    def _new_bucket():
+        return {"sent": 0, "read": 0, "by_type": {}, "by_category": {}, "read_by_category": {}}
+    
+    def _bucket(self, day):
+        bucket = self.daily.get(day)
+        if bucket is None:
+            bucket = self.daily[day] = self._new_bucket()
+            self._prune(day)
+        return bucket
+    
+    def _prune(self, newest_day):
+        if len(self.daily) <= self.RETENTION_DAYS:
+            return
+        cutoff = (datetime.strptime(newest_day, "%Y-%m-%d") - timedelta(days=self.RETENTION_DAYS)).strftime("%Y-%m-%d")
+        for day in [d for d in self.daily if d < cutoff]:
+            del self.daily[day]
+    
+    def record_push(self, record):
+        """記錄一筆推送"""
+        day = record["pushed_at"][:10]
+        for bucket in (self.totals, self._bucket(day)):
+            bucket["sent"] += 1
+            bucket["by_type"][record["push_type"]] = bucket["by_type"].get(record["push_type"], 0) + 1
+            bucket["by_category"][record["category"]] = bucket["by_category"].get(record["category"], 0) + 1
+        if record["status"] == "read":
+            self.record_read(record)
+    
+    def record_read(self, record):
+        """記錄一筆已讀（計入推送當日的分桶）"""
+        buckets = [self.totals]
+        day_bucket = self.daily.get(record["pushed_at"][:10])
+        if day_bucket is not None:
+            buckets.append(day_bucket)
+        for bucket in buckets:
+            bucket["read"] += 1
+            bucket["read_by_category"][record["category"]] = bucket["read_by_category"].get(record["category"], 0) + 1
+    
+    def window(self, start, end):
+        """合併 [start, end] 期間（date）的分桶，最多走訪期間內的天數"""
+        merged = self._new_bucket()
+        day = start
+        while day <= end:
+            bucket = self.daily.get(day.strftime("%Y-%m-%d"))
+            if bucket:
+                merged["sent"] += bucket["sent"]
+                merged["read"] += bucket["read"]
+                for field in ("by_type", "by_category", "read_by_category"):
+                    for k, v in bucket[field].items():
+                        merged[field][k] = merged[field].get(k, 0) + v
+            day += timedelta(days=1)
+        return merged
+    
+    def summary(self, today=None):
+        """推送統計摘要：今日、本週（週一起算）、累計已讀率與自動推送數"""
+        today = today or datetime.now().date()
+        week_start = today - timedelta(days=today.weekday())
+        today_bucket = self.daily.get(today.strftime("%Y-%m-%d"), self._new_bucket())
+        week = self.window(week_start, today)
+        return {
+            "today": today_bucket["sent"],
+            "this_week": week["sent"],
+            "week_by_type": week["by_type"],
+            "week_by_category": week["by_category"],
+            "week_read_rate": week["read"] / week["sent"] if week["sent"] else 0.0,
+            "total": self.totals["sent"],
+            "read_rate": self.totals["read"] / self.totals["sent"] if self.totals["sent"] else 0.0,
+            "auto": self.totals["by_type"].get("auto", 0),
+        }
+
 # ============================================
 # 推送紀錄管理
 # ============================================
 class EducationPushManager:
     def __init__(self):
         self.push_history = []
+        self._by_id = {}      # push_id -> 推送紀錄
+        self._delivered = {}  # (patient_id, material_id) -> 已推送過的 push_type 集合
+        self.stats = PushStatistics()
     
-    def push_material(self, patient_id, patient_name, material_id, push_type="manual", pushed_by="system"):
-        """推送衛教單張"""
-        material = EDUCATION_MATERIALS.get(material_id)
-        if not material:
-            return None
-        
-        record = {
-            "id": f"PUSH{datetime.now().strftime('%Y%m%d%H%M%S')}",
+    def _build_record(self, patient_id, patient_name, material_id, material, push_type, pushed_by, pushed_at):
+        return {
+            "id": new_id("PUSH"),
             "patient_id": patient_id,
             "patient_name": patient_name,
             "material_id": material_id,
             "material_title": material["title"],
             "category": material["category"],
-            "push_type": push_type,  # manual, auto
+            "push_type": push_type,  # manual, auto, bulk
             "pushed_by": pushed_by,
-            "pushed_at": datetime.now().isoformat(),
+            "pushed_at": pushed_at,
             "read_at": None,
             "status": "sent"  # sent, read
         }
+    
+    def _append_records(self, records):
+        """寫入推送紀錄並更新去重索引"""
+        self.push_history.extend(records)
+        for record in records:
+            self._by_id[record["id"]] = record
+            self.stats.record_push(record)
+            key = (record["patient_id"], record["material_id"])
+            self._delivered.setdefault(key, set()).add(record["push_type"])
+    
+    def has_pushed(self, patient_id, material_id, push_type=None):
+        """是否已推送過（可指定推送類型）"""
+        types = self._delivered.get((patient_id, material_id))
+        if not types:
+            return False
+        return push_type is None or push_type in types
+    
+    def push_material(self, patient_id, patient_name, material_id, push_type="manual", pushed_by="system"):
+        """推送衛教單張"""
+        material = EDUCATION_MATERIALS.get(material_id)
+        if not material:
+            return None
         
-        self.push_history.append(record)
+        record = self._build_record(
+            patient_id, patient_name, material_id, material,
+            push_type, pushed_by, datetime.now().isoformat()
+        )
+        self._append_records([record])
         return record
     
+    def push_material_bulk(self, patients, material_id, pushed_by="system", skip_already_pushed=True):
+        """批次推送衛教單張給一群病人
+        
+        patients: [{"id": ..., "name": ...}, ...]
+        同一批次內重複的病人只推送一次；skip_already_pushed 時略過已收過此單張的病人。
+        回傳 (已推送紀錄列表, 略過的病人 ID 列表)
+        """
+        material = EDUCATION_MATERIALS.get(material_id)
+        if not material:
+            return [], []
+        
+        pushed_at = datetime.now().isoformat()
+        seen = set()
+        records = []
+        skipped = []
+        for patient in patients:
+            patient_id = patient.get("id")
+            if not patient_id or patient_id in seen:
+                continue
+            seen.add(patient_id)
+            
+            if skip_already_pushed and self.has_pushed(patient_id, material_id):
+                skipped.append(patient_id)
+                continue
+            
+            records.append(self._build_record(
+                patient_id, patient.get("name", ""), material_id, material,
+                "bulk", pushed_by, pushed_at
+            ))
+        
+        self._append_records(records)
+        return records, skipped
+    
     def get_patient_history(self, patient_id):
         """取得病人的推送紀錄"""
         return [r for r in self.push_history if r["patient_id"] == patient_id]
@@ -790,18 +938,70 @@ class EducationPushManager:
         """取得所有推送紀錄"""
         return sorted(self.push_history, key=lambda x: x["pushed_at"], reverse=True)
     
-    def mark_as_read(self, push_id):
-        """標記為已讀"""
-        for record in self.push_history:
-            if record["id"] == push_id:
-                record["read_at"] = datetime.now().isoformat()
-                record["status"] = "read"
-                return True
-        return False
-    
-    def check_auto_push(self, patient_id, patient_name, post_op_day, symptoms=None, treatment=None):
-        """檢查並執行自動推送"""
+    def history_snapshot(self):
+        """推送紀錄複本（依推送順序）；共用狀態服務的代理只能呼叫方法，不能直接讀取 push_history"""
+        return [dict(r) for r in self.push_history]
+    
+    def history_version(self):
+        """推送紀錄版本：(推送筆數, 已讀筆數)，紀錄新增或標記已讀時即改變"""
+        return (len(self.push_history), self.stats.totals["read"])
+    
+    def mark_as_read(self, push_id, read_at=None):
+        """標記為已讀（重複標記不會改變原本的讀取時間）"""
+        record = self._by_id.get(push_id)
+        if record is None:
+            return False
+        if record["status"] != "read":
+            record["read_at"] = read_at or datetime.now().isoformat()
+            record["status"] = "read"
+            self.stats.record_read(record)
+        return True
+    
+    def ingest_read_receipts(self, receipts):
+        """批次處理病人端回傳的已讀回條
+        
+        receipts: [push_id, ...] 或 [{"push_id": ..., "read_at": ...}, ...]
+        可重複送出同一批回條（冪等）。
+        回傳 {"marked": 新標記數, "already_read": 已讀過數, "unknown": [找不到的 push_id]}
+        """
+        now = datetime.now().isoformat()
+        result = {"marked": 0, "already_read": 0, "unknown": []}
+        for receipt in receipts:
+            if isinstance(receipt, dict):
+                push_id = receipt.get("push_id") or receipt.get("id")
+                read_at = receipt.get("read_at") or now
+            else:
+                push_id, read_at = receipt, now
+            
+            record = self._by_id.get(push_id)
+            if record is None:
+                result["unknown"].append(push_id)
+            elif record["status"] == "read":
+                result["already_read"] += 1
+            else:
+                self.mark_as_read(push_id, read_at)
+                result["marked"] += 1
+        return result
+    
+    def get_read_rate(self):
+        """已讀率（0-1），由累計統計直接計算"""
+        return self.stats.summary()["read_rate"]
+    
+    def get_statistics(self, today=None):
+        """推送統計摘要（見 PushStatistics.summary）"""
+        return self.stats.summary(today)
+    
+    def check_auto_push(self, patient_id, patient_name, post_op_day, symptoms=None, treatment=None,
+                        symptom_codes=None):
+        """檢查並執行自動推送
+
+        症狀規則以標準症狀代碼比對（symptom_codes，未提供時由 symptoms 文字換算）；
+        規則關鍵字不在標準詞彙中時，改以文字包含比對。
+        """
         pushed = []
+        if symptom_codes is None and symptoms:
+            symptom_codes = normalize_symptoms(symptoms)
+        symptom_codes = set(symptom_codes or [])
         
         for rule in AUTO_PUSH_RULES:
             if not rule["enabled"]:
@@ -815,11 +1015,12 @@ class EducationPushManager:
                     should_push = True
             
             # 症狀觸發
-            elif rule["trigger_type"] == "symptom" and symptoms:
-                for symptom in symptoms:
-                    if rule["trigger_value"] in symptom:
-                        should_push = True
-                        break
+            elif rule["trigger_type"] == "symptom" and (symptom_codes or symptoms):
+                rule_codes = text_codes(rule["trigger_value"])
+                if rule_codes:
+                    should_push = not symptom_codes.isdisjoint(rule_codes)
+                else:
+                    should_push = any(rule["trigger_value"] in symptom for symptom in symptoms or [])
             
             # 治療觸發
             elif rule["trigger_type"] == "treatment" and treatment:
@@ -829,14 +1030,7 @@ class EducationPushManager:
             if should_push:
                 for material_id in rule["materials"]:
                     # 檢查是否已推送過
-                    already_pushed = any(
-                        r["patient_id"] == patient_id and 
-                        r["material_id"] == material_id and
-                        r["push_type"] == "auto"
-                        for r in self.push_history
-                    )
-                    
-                    if not already_pushed:
+                    if not self.has_pushed(patient_id, material_id, push_type="auto"):
                         record = self.push_material(
                             patient_id, patient_name, material_id,
                             push_type="auto", pushed_by="system"
@@ -846,14 +1040,20 @@ class EducationPushManager:
         
         return pushed
 
-# 全域實例
-education_manager = EducationPushManager()
+# 全域實例（多工作程序部署時為共用狀態服務中推送紀錄的代理，第一次使用時才連線，見 state_service）
+register_shared("education_manager", EducationPushManager)
+education_manager = SharedRef("education_manager")
+
+def ingest_read_receipts(receipts):
+    """已讀回條寫入入口（供病人端 App 批次回報）"""
+    return education_manager.ingest_read_receipts(receipts)
 
 # ============================================
 # 輔助函數
 # ============================================
 def get_materials_by_category():
     """依類別分組衛教單張"""
+    sync_material_edits()
     categories = {}
     for key, material in EDUCATION_MATERIALS.items():
         cat = material["category"]
@@ -864,4 +1064,167 @@ def get_materials_by_category():
 
 def get_material_by_id(material_id):
     """根據 ID 取得衛教單張"""
+    sync_material_edits()
     return EDUCATION_MATERIALS.get(material_id)
+
+# ============================================
+# 全文檢索索引
+# ============================================
+# 標題、說明的命中權重高於內文
+SEARCH_FIELD_WEIGHTS = {"title": 3.0, "description": 2.0, "content": 1.0}
+
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD_RUN = re.compile(r"[a-z0-9][a-z0-9\-\+\.]*")
+
+
+def tokenize(text):
+    """斷詞：中文以雙字（bigram）切分（單獨一字保留單字），英數字以單字切分"""
+    if not text:
+        return []
+    text = text.lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for word in _WORD_RUN.findall(text):
+        tokens.append(word.rstrip(".-+") or word)
+    return tokens
+
+
+class EducationSearchIndex:
+    """衛教單張倒排索引（BM25 排序）"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, materials=None):
+        self.postings = {}     # token -> {material_key: 加權詞頻}
+        self.doc_tokens = {}   # material_key -> {token: 加權詞頻}
+        self.doc_length = {}   # material_key -> 加權文件長度
+        self.chars = {}        # 中文單字 -> 含此字的雙字 token（單字查詢時展開）
+        self.total_length = 0.0
+        if materials:
+            self.build(materials)
+
+    def build(self, materials):
+        """重建整個索引"""
+        self.postings.clear()
+        self.doc_tokens.clear()
+        self.doc_length.clear()
+        self.chars.clear()
+        self.total_length = 0.0
+        for key, material in materials.items():
+            self.add(key, material)
+
+    def add(self, key, material):
+        """加入或更新單一衛教單張"""
+        if key in self.doc_tokens:
+            self.remove(key)
+
+        freqs = {}
+        length = 0.0
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            for token in tokenize(material.get(field, "")):
+                freqs[token] = freqs.get(token, 0.0) + weight
+                length += weight
+
+        for token, tf in freqs.items():
+            self.postings.setdefault(token, {})[key] = tf
+            if len(token) == 2 and _CJK_RUN.fullmatch(token):
+                for ch in token:
+                    self.chars.setdefault(ch, set()).add(token)
+        self.doc_tokens[key] = freqs
+        self.doc_length[key] = length
+        self.total_length += length
+
+    def remove(self, key):
+        """自索引移除衛教單張"""
+        freqs = self.doc_tokens.pop(key, None)
+        if freqs is None:
+            return
+        for token in freqs:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self.postings[token]
+                    for ch in token if len(token) == 2 else ():
+                        bigrams = self.chars.get(ch)
+                        if bigrams is not None:
+                            bigrams.discard(token)
+                            if not bigrams:
+                                del self.chars[ch]
+        self.total_length -= self.doc_length.pop(key, 0.0)
+
+    def search(self, query, limit=20):
+        """搜尋，回傳 [(material_key, score), ...]（分數高者在前）"""
+        query_tokens = set()
+        for token in tokenize(query):
+            query_tokens.add(token)
+            if len(token) == 1 and _CJK_RUN.fullmatch(token):
+                # 單字查詢（如「痛」「咳」）：展開為含此字的雙字
+                query_tokens.update(self.chars.get(token, ()))
+        n_docs = len(self.doc_tokens)
+        if not query_tokens or not n_docs:
+            return []
+
+        avg_length = self.total_length / n_docs or 1.0
+        scores = {}
+        for token in query_tokens:
+            docs = self.postings.get(token)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = self.K1 * (1 - self.B + self.B * self.doc_length[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return ranked[:limit]
+
+
+# 全域索引（匯入時建立一次，編輯單張時增量更新）
+education_search_index = EducationSearchIndex(EDUCATION_MATERIALS)
+
+# 可於後台編輯的欄位；已套用的編輯（資料檔版本、material_id -> 欄位）
+EDITABLE_MATERIAL_FIELDS = ("title", "description", "content")
+_material_edits = {"version": None, "applied": {}}
+
+
+def search_materials(query, limit=20):
+    """全文搜尋衛教單張，回傳依相關性排序的單張列表"""
+    sync_material_edits()
+    results = []
+    for key, score in education_search_index.search(query, limit=limit):
+        material = EDUCATION_MATERIALS.get(key)
+        if material:
+            results.append({"key": key, "score": score, **material})
+    return results
+
+
+def sync_material_edits():
+    """套用資料檔中的單張編輯（重新啟動前或其他工作程序的編輯），只重新索引有變動的單張"""
+    version = data_manager.material_edits_version()
+    if version == _material_edits["version"]:
+        return
+    for material_id, entry in data_manager.load_material_edits().items():
+        material = EDUCATION_MATERIALS.get(material_id)
+        fields = {k: v for k, v in entry.items() if k in EDITABLE_MATERIAL_FIELDS}
+        if material is None or _material_edits["applied"].get(material_id) == fields:
+            continue
+        material.update(fields)
+        education_search_index.add(material_id, material)
+        _material_edits["applied"][material_id] = fields
+    _material_edits["version"] = version
+
+
+def update_material(material_id, updated_by="", **fields):
+    """編輯衛教單張：經 data_manager 寫入資料檔後套用並更新檢索索引"""
+    if material_id not in EDUCATION_MATERIALS:
+        return None
+    fields = {k: v for k, v in fields.items() if k in EDITABLE_MATERIAL_FIELDS}
+    data_manager.save_material_edit(material_id, fields, user=updated_by)
+    sync_material_edits()
+    return EDUCATION_MATERIALS[material_id]
@@ -0,0 +1,302 @@
+"""
+AI-CARE Lung Pro - 背景匯出工作
+================================
+
+在背景執行緒執行資料匯出，不阻塞 Streamlit 頁面：
+- 工作表（job table）保存於 data/export_jobs.json，頁面重新執行或程式重啟後仍可查詢
+- 多位個管師可同時排入匯出，由固定大小的執行緒池依序處理
+- 完成的檔案以「匯出參數 + 資料版本」為鍵快取，相同請求直接回傳既有檔案；
+  他人進行中的相同工作不重複執行，新增一筆跟隨該工作的紀錄
+- 多工作程序部署時，工作表在 data_lock() 內合併寫回，各程序只覆寫自己負責的工作
+- 程式中斷時未完成的工作，下次啟動時重新排入（仍在執行的其他程序負責的工作除外）
+- 匯出檔保留 config.EXPORT_RETENTION_HOURS 小時後刪除，工作紀錄移出工作表時一併刪除其檔案
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import clinical_store
+import data_manager
+from export_pipeline import EXPORT_TABLES, export_file_suffix, run_export
+from id_generator import new_id
+from state_service import data_lock
+
+try:
+    from config import EXPORT_RETENTION_HOURS
+except ImportError:
+    EXPORT_RETENTION_HOURS = 24
+
+JOBS_FILE = "data/export_jobs.json"
+EXPORT_DIR = "data/exports"
+MAX_WORKERS = 2
+MAX_JOBS_KEPT = 200
+RETENTION_SWEEP_SECONDS = 600
+
+_lock = threading.RLock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="export")
+_jobs: Dict[str, Dict] = {}
+_owned = set()      # 由本程序建立或執行的工作 ID（寫回工作表時以本程序的內容為準）
+_loaded = {"done": False, "mtime": None, "swept": 0.0}
+
+
+# ============================================
+# 工作表
+# ============================================
+def _read_jobs_file() -> List[Dict]:
+    try:
+        with open(JOBS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _merge_jobs_file():
+    """讀入其他程序寫入的工作（本程序負責的工作以記憶體中的內容為準）"""
+    try:
+        mtime = os.stat(JOBS_FILE).st_mtime_ns
+    except OSError:
+        return
+    if mtime == _loaded["mtime"]:
+        return
+    for job in _read_jobs_file():
+        if job["id"] not in _owned:
+            _jobs[job["id"]] = job
+    _loaded["mtime"] = mtime
+
+
+def _save_jobs():
+    """寫入工作表：在 data_lock() 內與檔案中其他程序的工作合併，先寫暫存檔再取代"""
+    os.makedirs(os.path.dirname(JOBS_FILE) or ".", exist_ok=True)
+    with data_lock():
+        _loaded["mtime"] = None
+        _merge_jobs_file()
+        jobs = _evict_jobs()
+        tmp_path = f"{JOBS_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, JOBS_FILE)
+        _loaded["mtime"] = os.stat(JOBS_FILE).st_mtime_ns
+
+
+def _remove_file(path: Optional[str]):
+    try:
+        if path:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def _evict_jobs() -> List[Dict]:
+    """保留最新 MAX_JOBS_KEPT 筆（進行中的工作一律保留），移出的工作刪除其他紀錄未使用的匯出檔"""
+    jobs = sorted(_jobs.values(), key=lambda j: j["id"])
+    evicted = [j for j in jobs[:-MAX_JOBS_KEPT] if j["status"] not in ("queued", "running")]
+    if not evicted:
+        return jobs
+    evicted_ids = {j["id"] for j in evicted}
+    kept = [j for j in jobs if j["id"] not in evicted_ids]
+    in_use = {j.get("output") for j in kept}
+    for job in evicted:
+        del _jobs[job["id"]]
+        _owned.discard(job["id"])
+        if job.get("output") not in in_use:
+            _remove_file(job.get("output"))
+    return kept
+
+
+def sweep_exports(now: Optional[float] = None) -> int:
+    """刪除超過保留時數的匯出檔（含中斷遺留的 .part 暫存檔），回傳刪除的檔案數"""
+    now = time.time() if now is None else now
+    cutoff = now - EXPORT_RETENTION_HOURS * 3600
+    removed = 0
+    with data_lock():
+        try:
+            entries = list(os.scandir(EXPORT_DIR))
+        except OSError:
+            return 0
+        for entry in entries:
+            try:
+                expired = entry.is_file() and entry.stat().st_mtime < cutoff
+            except OSError:
+                continue
+            if expired:
+                _remove_file(entry.path)
+                removed += 1
+    _loaded["swept"] = now
+    return removed
+
+
+def _worker_alive(pid) -> bool:
+    """工作所屬程序是否仍在執行（同一主機）"""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except (OSError, ValueError, TypeError):
+        return False
+    return True
+
+
+def _load_jobs():
+    """讀入工作表並定期刪除過期匯出檔；首次使用時重新排入上次未完成、且負責程序已結束的工作"""
+    if time.time() - _loaded["swept"] >= RETENTION_SWEEP_SECONDS:
+        sweep_exports()
+    _merge_jobs_file()
+    if _loaded["done"]:
+        return
+    _loaded["done"] = True
+    resumed = []
+    for job in _jobs.values():
+        if job["status"] in ("queued", "running") and not _worker_alive(job.get("worker")):
+            job.update(status="queued", done=0, worker=os.getpid())
+            job.pop("source_job", None)
+            _owned.add(job["id"])
+            resumed.append(job["id"])
+    if resumed:
+        _save_jobs()
+    for job_id in resumed:
+        _executor.submit(_run_job, job_id)
+
+
+def _cache_key(fmt: str, tables: List[str], deidentify: bool) -> str:
+    """匯出參數 + 資料版本的雜湊；資料有異動時鍵即不同（資料檔尚未建立時版本為 None）"""
+    params = {
+        "format": fmt,
+        "tables": sorted(tables),
+        "deidentify": bool(deidentify),
+        "data": data_manager.data_version(),
+        "clinical": clinical_store.log_version(),
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _cached_job(cache_key: str) -> Optional[Dict]:
+    """相同參數的工作：進行中（任何人，不含跟隨他人的紀錄）或已完成且檔案仍在"""
+    for job in _jobs.values():
+        if job["cache_key"] != cache_key:
+            continue
+        if job["status"] in ("queued", "running") and not job.get("source_job"):
+            return job
+        if job["status"] == "done" and job.get("output") and os.path.exists(job["output"]):
+            return job
+    return None
+
+
+def _resolve(job: Dict) -> Dict:
+    """跟隨他人工作的紀錄：進行中時帶入來源工作的狀態與進度"""
+    job = dict(job)
+    source = _jobs.get(job.get("source_job"))
+    if source is not None and job["status"] in ("queued", "running"):
+        for field in ("status", "done", "total", "output", "error", "finished_at"):
+            if field in source:
+                job[field] = source[field]
+    if job["status"] == "done" and not (job.get("output") and os.path.exists(job["output"])):
+        # 匯出檔已超過保留時數而刪除
+        job["status"] = "expired"
+    return job
+
+
+# ============================================
+# 執行
+# ============================================
+def _run_job(job_id: str):
+    with _lock:
+        job = _jobs[job_id]
+        job.update(status="running", started_at=datetime.now().isoformat())
+        _save_jobs()
+
+    def progress(done, total):
+        # 進度只更新記憶體，避免每批都寫檔
+        job["done"] = done
+        job["total"] = total
+
+    output = os.path.join(EXPORT_DIR, f"{job['cache_key']}{export_file_suffix(job['format'])}")
+    partial = f"{output}.{job_id}.part"
+    try:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        run_export(job["format"], job["tables"], deidentify=job["deidentify"],
+                   output_path=partial, progress=progress)
+        os.replace(partial, output)
+        result = {"status": "done", "output": output}
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        result = {"status": "failed", "error": str(e)}
+
+    with _lock, data_lock():
+        finished_at = datetime.now().isoformat()
+        job.update(result, finished_at=finished_at)
+        # 先讀入其他程序新增、跟隨此工作的紀錄
+        _loaded["mtime"] = None
+        _merge_jobs_file()
+        for follower in _jobs.values():
+            if follower.get("source_job") == job_id:
+                follower.update(result, done=job["done"], total=job["total"], finished_at=finished_at)
+                _owned.add(follower["id"])
+        _save_jobs()
+
+
+def submit_export(fmt: str, tables: Iterable[str], deidentify: bool = True, requested_by: str = "") -> Dict:
+    """排入匯出工作；相同參數且資料未異動時沿用既有（進行中或已完成）的工作"""
+    tables = [t for t in EXPORT_TABLES if t in set(tables)]
+    with _lock:
+        _load_jobs()
+        cache_key = _cache_key(fmt, tables, deidentify)
+        cached = _cached_job(cache_key)
+        if cached is not None and cached.get("requested_by") == requested_by:
+            return _resolve(cached)
+
+        job = {
+            "id": new_id("JOB"),
+            "format": fmt,
+            "tables": tables,
+            "deidentify": bool(deidentify),
+            "cache_key": cache_key,
+            "requested_by": requested_by,
+            "created_at": datetime.now().isoformat(),
+            "status": "queued",
+            "done": 0,
+            "total": 0,
+            "worker": os.getpid(),
+        }
+        if cached is not None and cached["status"] == "done":
+            # 他人已匯出過相同內容：直接沿用檔案，新增一筆自己的工作紀錄
+            job.update(status="done", done=cached["done"], total=cached["total"],
+                       output=cached["output"], finished_at=job["created_at"])
+        elif cached is not None:
+            # 他人進行中的相同工作：不重複執行，完成時一併更新此紀錄
+            job.update(source_job=cached["id"], worker=cached.get("worker"))
+        _jobs[job["id"]] = job
+        if not job.get("source_job"):
+            # 跟隨紀錄由執行來源工作的程序更新，本程序只讀取
+            _owned.add(job["id"])
+        _save_jobs()
+    if job["status"] == "queued" and not job.get("source_job"):
+        _executor.submit(_run_job, job["id"])
+    return _resolve(job)
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    with _lock:
+        _load_jobs()
+        job = _jobs.get(job_id)
+        return _resolve(job) if job else None
+
+
+def list_jobs(requested_by: str = None, limit: int = 20) -> List[Dict]:
+    """匯出工作（新到舊），可依申請人篩選"""
+    with _lock:
+        _load_jobs()
+        jobs = [_resolve(j) for j in _jobs.values()
+                if requested_by is None or j.get("requested_by") == requested_by]
+    jobs.sort(key=lambda j: j["id"], reverse=True)
+    return jobs[:limit]
+
+
+def has_active_jobs(requested_by: str = None) -> bool:
+    return any(j["status"] in ("queued", "running") for j in list_jobs(requested_by, limit=MAX_JOBS_KEPT))
@@ -0,0 +1,285 @@
+"""
+AI-CARE Lung Pro - 資料匯出
+============================
+
+以「來源 → 去識別化 → 寫出」的串流管線匯出回報、警示、介入紀錄與臨床資料：
+- 來源逐批（chunk）產生扁平化的資料列
+- 去識別化為管線中的一個階段：移除姓名 / 電話 / 對話內容、病人 ID 雜湊、日期位移
+- 寫出端逐批寫入暫存檔（Excel 使用 write-only 模式；CSV 每張表一個檔案並壓縮成 zip）
+"""
+
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import secrets
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import clinical_store
+import data_manager
+from clinical_options import (
+    CLINICAL_FIELD_OPTIONS, CLINICAL_MULTI_FIELDS, CLINICAL_NUMERIC_FIELDS,
+    CLINICAL_BOOL_FIELDS, CLINICAL_DATE_FIELDS
+)
+
+EXPORT_FORMATS = {"xlsx": "Excel (.xlsx)", "csv": "CSV (.csv)", "json": "JSON"}
+EXPORT_TABLES = {"reports": "症狀回報", "alerts": "警示", "interventions": "介入紀錄", "clinical": "臨床資料"}
+
+CHUNK_SIZE = 1000
+
+# 各資料表輸出欄位
+TABLE_COLUMNS = {
+    "reports": ["id", "patient_id", "timestamp", "date", "time", "symptoms", "symptom_codes", "scores",
+                "overall_score", "status"],
+    "alerts": ["id", "patient_id", "patient_name", "level", "score", "symptoms", "timestamp",
+               "status", "handled_by", "handled_at", "notes"],
+    "interventions": ["id", "patient_id", "timestamp", "date", "time", "type", "content",
+                      "duration", "referral", "nurse"],
+    "clinical": (["patient_id", "name", "phone", "age"]
+                 + list(CLINICAL_FIELD_OPTIONS) + list(CLINICAL_MULTI_FIELDS)
+                 + [f for f in CLINICAL_NUMERIC_FIELDS if f != "age"]
+                 + CLINICAL_BOOL_FIELDS + CLINICAL_DATE_FIELDS),
+}
+
+# 去識別化時移除的欄位（直接識別欄位，以及常含姓名、電話的自由文字）、
+# 以 HMAC 雜湊的人員欄位，與需位移的日期欄位
+IDENTIFYING_COLUMNS = {"name", "phone", "patient_name", "conversation", "content", "notes"}
+STAFF_COLUMNS = {"nurse", "handled_by"}
+DATE_COLUMNS = {"timestamp", "date", "handled_at"} | set(CLINICAL_DATE_FIELDS)
+MAX_DATE_SHIFT_DAYS = 30
+
+
+# ============================================
+# 來源
+# ============================================
+def _flatten(record: Dict, columns: List[str]) -> Dict:
+    row = {}
+    for column in columns:
+        value = record.get(column)
+        if isinstance(value, list):
+            value = "、".join(str(v) for v in value)
+        elif isinstance(value, dict):
+            value = json.dumps(value, ensure_ascii=False)
+        row[column] = value
+    return row
+
+
+def _clinical_record(patient_id: str, patient: Dict) -> Dict:
+    """病人目前的臨床資料（含異動紀錄）；臨床資料沒有年齡時使用病人基本資料的年齡"""
+    clinical = clinical_store.get_clinical(patient_id, patient.get("clinical"))
+    return {**clinical, "patient_id": patient_id, "name": patient.get("name"), "phone": patient.get("phone"),
+            "age": clinical.get("age", patient.get("age"))}
+
+
+def iter_table(data: Dict, table: str, chunk_size: int = CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """逐批產生資料表的扁平資料列"""
+    columns = TABLE_COLUMNS[table]
+    if table == "clinical":
+        source = (_clinical_record(pid, patient) for pid, patient in data.get("patients", {}).items())
+    else:
+        source = iter(data.get(table, []))
+
+    chunk = []
+    for record in source:
+        chunk.append(_flatten(record, columns))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def count_rows(data: Dict, tables: Iterable[str]) -> int:
+    return sum(len(data.get("patients" if t == "clinical" else t, [])) for t in tables)
+
+
+# ============================================
+# 去識別化
+# ============================================
+class Deidentifier:
+    """去識別化：移除直接識別欄位與自由文字、以 HMAC 雜湊病人 ID 與人員帳號、每位病人固定的日期位移"""
+
+    def __init__(self, secret: Optional[bytes] = None, max_shift_days: int = MAX_DATE_SHIFT_DAYS):
+        # 每次匯出使用新的金鑰，不同批次的匯出無法互相串連
+        self.secret = secret or secrets.token_bytes(32)
+        self.max_shift_days = max_shift_days
+        self._cache = {}
+
+    def _patient_key(self, patient_id: str):
+        cached = self._cache.get(patient_id)
+        if cached is None:
+            digest = hmac.new(self.secret, str(patient_id).encode("utf-8"), hashlib.sha256).digest()
+            shift = int.from_bytes(digest[-4:], "big") % (2 * self.max_shift_days + 1) - self.max_shift_days
+            cached = self._cache[patient_id] = ("S" + digest[:6].hex(), timedelta(days=shift))
+        return cached
+
+    def _hash(self, value) -> str:
+        return hmac.new(self.secret, str(value).encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+    @staticmethod
+    def _shift(value, delta: timedelta):
+        if not value or not isinstance(value, str):
+            return value
+        try:
+            if len(value) == 10:
+                return (datetime.strptime(value, "%Y-%m-%d") + delta).strftime("%Y-%m-%d")
+            return (datetime.fromisoformat(value) + delta).isoformat()
+        except ValueError:
+            return value
+
+    def __call__(self, rows: List[Dict]) -> List[Dict]:
+        out = []
+        for row in rows:
+            hashed_id, delta = self._patient_key(row.get("patient_id"))
+            clean = {}
+            for column, value in row.items():
+                if column in IDENTIFYING_COLUMNS:
+                    continue
+                if column == "patient_id":
+                    value = hashed_id
+                elif column == "id":
+                    value = self._hash(value)
+                elif column in STAFF_COLUMNS:
+                    value = "U" + self._hash(value) if value else value
+                elif column in DATE_COLUMNS:
+                    value = self._shift(value, delta)
+                clean[column] = value
+            out.append(clean)
+        return out
+
+
+def output_columns(table: str, deidentify: bool) -> List[str]:
+    columns = TABLE_COLUMNS[table]
+    if deidentify:
+        columns = [c for c in columns if c not in IDENTIFYING_COLUMNS]
+    return columns
+
+
+# ============================================
+# 寫出
+# ============================================
+class _JsonWriter:
+    """輸出 {"表名": [資料列, ...], ...}，逐列寫入"""
+
+    suffix = ".json"
+
+    def __init__(self, path: str):
+        self.f = open(path, "w", encoding="utf-8")
+        self.f.write("{")
+        self.tables = 0
+
+    def begin_table(self, table: str, columns: List[str]):
+        self.f.write("," if self.tables else "")
+        self.f.write(f"\n{json.dumps(table)}: [")
+        self.tables += 1
+        self.rows = 0
+
+    def write_rows(self, rows: List[Dict]):
+        for row in rows:
+            self.f.write(",\n  " if self.rows else "\n  ")
+            self.f.write(json.dumps(row, ensure_ascii=False, default=str))
+            self.rows += 1
+
+    def end_table(self):
+        self.f.write("\n]")
+
+    def close(self):
+        self.f.write("\n}\n")
+        self.f.close()
+
+
+class _CsvZipWriter:
+    """每張表一個 CSV（UTF-8 BOM，Excel 可直接開啟），壓縮成 zip"""
+
+    suffix = ".zip"
+
+    def __init__(self, path: str):
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def begin_table(self, table: str, columns: List[str]):
+        self.raw = self.zip.open(f"{table}.csv", "w", force_zip64=True)
+        self.text = io.TextIOWrapper(self.raw, encoding="utf-8-sig", newline="")
+        self.writer = csv.DictWriter(self.text, fieldnames=columns, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write_rows(self, rows: List[Dict]):
+        self.writer.writerows(rows)
+
+    def end_table(self):
+        self.text.close()
+
+    def close(self):
+        self.zip.close()
+
+
+class _ExcelWriter:
+    """每張表一個工作表，openpyxl write-only 模式逐列寫入"""
+
+    suffix = ".xlsx"
+
+    def __init__(self, path: str):
+        from openpyxl import Workbook
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+
+    def begin_table(self, table: str, columns: List[str]):
+        self.sheet = self.workbook.create_sheet(EXPORT_TABLES.get(table, table))
+        self.columns = columns
+        self.sheet.append(columns)
+
+    def write_rows(self, rows: List[Dict]):
+        for row in rows:
+            self.sheet.append([row.get(c) for c in self.columns])
+
+    def end_table(self):
+        pass
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+WRITERS = {"json": _JsonWriter, "csv": _CsvZipWriter, "xlsx": _ExcelWriter}
+
+
+def export_file_suffix(fmt: str) -> str:
+    return WRITERS[fmt].suffix
+
+
+def run_export(fmt: str, tables: Iterable[str] = tuple(EXPORT_TABLES), deidentify: bool = True,
+               output_path: Optional[str] = None, chunk_size: int = CHUNK_SIZE,
+               progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """執行匯出，回傳輸出檔路徑
+
+    progress(已處理筆數, 總筆數) 於每批寫出後呼叫。
+    """
+    tables = [t for t in tables if t in TABLE_COLUMNS]
+    writer_cls = WRITERS[fmt]
+    if output_path is None:
+        fd, output_path = tempfile.mkstemp(prefix="aicare_export_", suffix=writer_cls.suffix)
+        os.close(fd)
+
+    data = data_manager.load_data()
+    total = count_rows(data, tables)
+    done = 0
+    stage = Deidentifier() if deidentify else None
+
+    writer = writer_cls(output_path)
+    try:
+        for table in tables:
+            writer.begin_table(table, output_columns(table, deidentify))
+            for chunk in iter_table(data, table, chunk_size):
+                if stage is not None:
+                    chunk = stage(chunk)
+                writer.write_rows(chunk)
+                done += len(chunk)
+                if progress:
+                    progress(done, total)
+            writer.end_table()
+    finally:
+        writer.close()
+    return output_path
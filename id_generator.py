@@ -0,0 +1,60 @@
+"""
+AI-CARE Lung - 識別碼產生器
+============================
+
+產生 ULID 格式的唯一識別碼：
+- 前 48 bits 為毫秒時間戳，字串排序即為時間排序
+- 後 80 bits 為亂數；同一毫秒內遞增，保證單調遞增且不重複
+- 以 Crockford Base32 編碼為 26 個字元
+"""
+
+import os
+import threading
+import time
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        chars.append(_CROCKFORD[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_id(prefix: str = "") -> str:
+    """產生單調遞增、可依時間排序的識別碼（可加前綴）"""
+    global _last_ms, _last_random
+
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms <= _last_ms:
+            # 同一毫秒（或時鐘回撥）：沿用上一個時間戳並遞增亂數部分
+            now_ms = _last_ms
+            _last_random += 1
+            if _last_random > _RANDOM_MAX:
+                now_ms += 1
+                _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # 保留最高位元，避免遞增時溢位
+            _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_ms = now_ms
+        value = (now_ms << _RANDOM_BITS) | _last_random
+
+    return prefix + _encode(value, 26)
+
+
+def id_timestamp(id_value: str, prefix: str = "") -> float:
+    """自識別碼取回建立時間（Unix 秒）"""
+    body = id_value[len(prefix):] if prefix and id_value.startswith(prefix) else id_value
+    value = 0
+    for ch in body[:10].upper():
+        value = (value << 5) | _CROCKFORD.index(ch)
+    return value / 1000
@@ -0,0 +1,221 @@
+"""
+AI-CARE Lung Pro - 逾期未回報偵測
+==================================
+
+依術後回報排程找出停止回報的病人，並產生追蹤警示：
+- 每位病人以「最後回報日（從未回報者為收案日）」推算最晚應回報日，
+  再加上寬限天數（config.MISSED_REPORT_GRACE_DAYS）即為逾期日，依逾期日放入最小堆積
+- 定期檢查時只取出已到逾期日的病人，成本與逾期人數成正比，不需掃描整份名單
+- 資料檔異動時只讀入新增的回報與病人；病人再次回報後，堆積中的舊項目留待取出時略過
+- 每次逾期只建立一筆警示（以最後回報日識別），已有待處理警示的病人不另開警示
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import clinical_store
+import data_manager
+from derived_attributes import effective_surgery_date, epro_interval_for
+
+try:
+    from config import MISSED_REPORT_GRACE_DAYS, MISSED_REPORT_SWEEP_MINUTES
+except ImportError:
+    MISSED_REPORT_GRACE_DAYS = 2
+    MISSED_REPORT_SWEEP_MINUTES = 60
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_day(value) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+
+def _interval(post_op_day: int) -> Optional[int]:
+    interval = epro_interval_for(np.array([float(post_op_day)]))[0]
+    return None if np.isnan(interval) else int(interval)
+
+
+def next_due_day(surgery: date, basis: date) -> Optional[date]:
+    """最晚應回報日：依 basis 當時階段的間隔推算；若落入下一階段，改用該階段的間隔"""
+    interval = _interval((basis - surgery).days)
+    if interval is None:
+        return None
+    next_interval = _interval((basis - surgery).days + interval)
+    return date.fromordinal(basis.toordinal() + max(interval, next_interval or interval))
+
+
+class MissedReportIndex:
+    """最後回報日索引與逾期堆積"""
+
+    def __init__(self, grace_days: int = MISSED_REPORT_GRACE_DAYS):
+        self._lock = threading.RLock()
+        self.grace_days = grace_days
+        self.version = None
+        self.clinical_version = None
+        self.n_reports = 0
+        self.n_alerts = 0
+        self.known = set()                      # 已讀入的病人（含無手術日期者）
+        self.surgery: Dict[str, date] = {}      # patient_id -> 手術日期
+        self.basis: Dict[str, date] = {}        # patient_id -> 最後回報日（從未回報者為收案日）
+        self._heap = []                         # (逾期日序數, patient_id, basis 序數)
+        self.overdue: Dict[str, Dict] = {}      # patient_id -> 逾期資訊
+        self.alerted = set()                    # 已建立警示的 (patient_id, basis)
+
+    # ------------------------------------------
+    # 索引
+    # ------------------------------------------
+    def _push(self, patient_id: str):
+        surgery, basis = self.surgery.get(patient_id), self.basis.get(patient_id)
+        if surgery is None or basis is None:
+            return
+        due = next_due_day(surgery, basis)
+        if due is not None:
+            heapq.heappush(self._heap, (due.toordinal() + self.grace_days + 1, patient_id, basis.toordinal()))
+
+    def _add_patient(self, patient: Dict):
+        patient_id = patient["id"]
+        self.known.add(patient_id)
+        clinical = clinical_store.get_clinical(patient_id, patient.get("clinical"))
+        surgery = _parse_day(effective_surgery_date({**patient, "clinical": clinical}))
+        if surgery is None:
+            return
+        self.surgery[patient_id] = surgery
+        created = _parse_day(patient.get("created_at"))
+        enrolled = max(surgery, created) if created else surgery
+        self.basis[patient_id] = max(self.basis.get(patient_id, enrolled), enrolled)
+
+    def _observe_report(self, report: Dict) -> Optional[str]:
+        patient_id = report.get("patient_id")
+        day = _parse_day(report.get("date") or report.get("timestamp"))
+        if patient_id not in self.basis or day is None or day <= self.basis[patient_id]:
+            return None
+        self.basis[patient_id] = day
+        self.overdue.pop(patient_id, None)
+        return patient_id
+
+    def sync(self):
+        """同步資料檔：新增的病人與回報；臨床資料（手術日期）異動時整批重建"""
+        with self._lock:
+            version = data_manager.data_version()
+            clinical_version = clinical_store.log_version()
+            if version == self.version and clinical_version == self.clinical_version:
+                return
+            data = data_manager.load_data()
+            patients, reports, alerts = data.get("patients", {}), data.get("reports", []), data.get("alerts", [])
+            if clinical_version != self.clinical_version or len(reports) < self.n_reports:
+                self.known, self.surgery, self.basis, self._heap, self.overdue = set(), {}, {}, [], {}
+                self.n_reports = 0
+            if len(alerts) < self.n_alerts:
+                self.alerted, self.n_alerts = set(), 0
+
+            changed = set()
+            for patient_id in patients.keys() - self.known:
+                self._add_patient(patients[patient_id])
+                changed.add(patient_id)
+            for report in reports[self.n_reports:]:
+                patient_id = self._observe_report(report)
+                if patient_id is not None:
+                    changed.add(patient_id)
+            for patient_id in changed:
+                self._push(patient_id)
+
+            for alert in alerts[self.n_alerts:]:
+                if alert.get("type") == "missed_report":
+                    self.alerted.add((alert.get("patient_id"), alert.get("missed_since")))
+            self.n_reports, self.n_alerts = len(reports), len(alerts)
+            self.version, self.clinical_version = version, clinical_version
+
+    # ------------------------------------------
+    # 檢查
+    # ------------------------------------------
+    def sweep(self, today: Optional[date] = None) -> List[Dict]:
+        """取出已到逾期日的病人，回傳本次新發現的逾期項目"""
+        today = today or date.today()
+        found = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= today.toordinal():
+                due, patient_id, basis = heapq.heappop(self._heap)
+                current = self.basis.get(patient_id)
+                if current is None or current.toordinal() != basis:
+                    continue
+                item = {
+                    "patient_id": patient_id,
+                    "basis": current.isoformat(),
+                    "overdue_since": date.fromordinal(due).isoformat(),
+                    "interval": _interval((today - self.surgery[patient_id]).days),
+                }
+                self.overdue[patient_id] = item
+                found.append(item)
+        return found
+
+    def overdue_patients(self, today: Optional[date] = None) -> List[Dict]:
+        """目前逾期未回報的病人（依未回報天數由多到少），附 days_since 欄位"""
+        today = today or date.today()
+        with self._lock:
+            items = [dict(item) for item in self.overdue.values()]
+        for item in items:
+            item["days_since"] = (today - date.fromisoformat(item["basis"])).days
+        items.sort(key=lambda item: -item["days_since"])
+        return items
+
+    def raise_alerts(self, today: Optional[date] = None) -> List[Dict]:
+        """為尚未建立過警示的逾期病人建立追蹤警示"""
+        with self._lock:
+            pending = [item for item in self.overdue_patients(today)
+                       if (item["patient_id"], item["basis"]) not in self.alerted]
+            if not pending:
+                return []
+            created = data_manager.create_missed_report_alerts(pending)
+            # 已有待處理警示而略過者也視為已通知，避免每次檢查重試
+            self.alerted.update((item["patient_id"], item["basis"]) for item in pending)
+            return created
+
+
+_index = MissedReportIndex()
+_scheduler = {"thread": None, "last_run": None}
+_scheduler_lock = threading.Lock()
+
+
+def run_sweep(create_alerts: bool = True) -> List[Dict]:
+    """同步索引並檢查逾期病人，回傳本次新建立的警示（create_alerts=False 時不建立）"""
+    _index.sync()
+    _index.sweep()
+    _scheduler["last_run"] = datetime.now().isoformat()
+    return _index.raise_alerts() if create_alerts else []
+
+
+def _sweep_loop(interval_seconds: float):
+    while True:
+        try:
+            created = run_sweep()
+            if created:
+                logger.info("逾期未回報：新增 %d 筆追蹤警示", len(created))
+        except Exception:
+            logger.exception("逾期未回報檢查錯誤")
+        time.sleep(interval_seconds)
+
+
+def start_missed_report_sweep(interval_minutes: float = MISSED_REPORT_SWEEP_MINUTES):
+    """啟動背景定期檢查（同一程序只啟動一次）"""
+    with _scheduler_lock:
+        if _scheduler["thread"] is None:
+            thread = threading.Thread(target=_sweep_loop, args=(interval_minutes * 60,),
+                                      name="missed-report-sweep", daemon=True)
+            thread.start()
+            _scheduler["thread"] = thread
+
+
+def get_overdue_patients() -> List[Dict]:
+    """目前逾期未回報的病人（附病人姓名、電話）"""
+    _index.sync()
+    _index.sweep()
+    return data_manager.attach_patient_info(_index.overdue_patients())
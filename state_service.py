@@ -0,0 +1,208 @@
+"""
+AI-CARE Lung Pro - 共用狀態服務
+================================
+
+多個 Streamlit 工作程序同時服務時，需跨程序一致的狀態集中由一個本機服務程序保存：
+- data_lock：資料檔「讀取 → 修改 → 寫回」的寫入鎖，避免不同程序互相覆蓋
+- education_manager：衛教推送紀錄（EducationPushManager）只在服務程序中保存一份
+- shared_cache：與使用者工作階段無關的計算結果，依資料版本失效
+
+部署方式：
+1. 啟動服務：python state_service.py（位址見 config.STATE_SERVICE_ADDRESS，
+   或以環境變數 AICARE_STATE_SERVICE=host:port 指定）
+2. 各 Streamlit 工作程序設定相同的位址後啟動，共用物件即改為服務程序中物件的代理
+   （第一次使用時才連線；連線失敗可由 connection_error() 取得訊息）
+
+未設定服務位址時（Streamlit Cloud 單一程序部署、測試）使用同程序內的本機替代實作，行為相同。
+serve(background=True) 可在目前程序的背景執行緒啟動服務，供測試代理連線。
+"""
+
+import logging
+import os
+import threading
+from functools import partial
+from multiprocessing.managers import AcquirerProxy, BaseManager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from config import STATE_SERVICE_ADDRESS, STATE_SERVICE_AUTHKEY
+except ImportError:
+    STATE_SERVICE_ADDRESS = None
+    STATE_SERVICE_AUTHKEY = "aicare-state-service"
+
+ADDRESS_ENV = "AICARE_STATE_SERVICE"
+CACHE_MAX_ENTRIES = 256
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# 共用物件
+# ============================================
+class SharedCache:
+    """依版本失效的鍵值快取（值需可 pickle）"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Any, Any]] = {}  # key -> (版本, 值)
+        self.max_entries = max_entries
+
+    def get(self, key: str, version) -> Tuple[bool, Any]:
+        """回傳 (是否命中, 值)；版本不同視為未命中"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return False, None
+        return True, entry[1]
+
+    def set(self, key: str, version, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, value)
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class StateManager(BaseManager):
+    """共用狀態服務的連線管理（服務端與工作程序使用同一份登記）"""
+
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_objects: Dict[str, Any] = {}
+_objects_lock = threading.Lock()
+_client = {"manager": None, "proxies": {}, "serving": False}
+_client_lock = threading.Lock()
+
+
+def _local_object(name: str):
+    """目前程序中的共用物件（每個名稱只建立一份）"""
+    with _objects_lock:
+        if name not in _objects:
+            _objects[name] = _factories[name]()
+        return _objects[name]
+
+
+def register_shared(name: str, factory: Callable[[], Any], proxytype=None):
+    """登記共用物件；服務模式下各程序取得的是服務程序中同一物件的代理"""
+    if name in _factories:
+        return
+    _factories[name] = factory
+    StateManager.register(name, callable=partial(_local_object, name), proxytype=proxytype)
+
+
+register_shared("data_lock", threading.RLock, proxytype=AcquirerProxy)
+register_shared("shared_cache", SharedCache)
+
+
+# ============================================
+# 連線
+# ============================================
+def service_address() -> Optional[Tuple[str, int]]:
+    """服務位址：環境變數優先，其次為 config；未設定時為 None（本機模式）"""
+    value = os.environ.get(ADDRESS_ENV)
+    if value:
+        host, _, port = value.rpartition(":")
+        return (host or "127.0.0.1", int(port))
+    return tuple(STATE_SERVICE_ADDRESS) if STATE_SERVICE_ADDRESS else None
+
+
+def service_mode() -> str:
+    """目前模式：service（連線共用狀態服務）或 local（同程序本機替代實作）"""
+    return "service" if service_address() and not _client["serving"] else "local"
+
+
+def _connect() -> StateManager:
+    with _client_lock:
+        if _client["manager"] is None:
+            manager = StateManager(address=service_address(), authkey=STATE_SERVICE_AUTHKEY.encode("utf-8"))
+            manager.connect()
+            _client["manager"] = manager
+        return _client["manager"]
+
+
+def get_shared(name: str):
+    """取得共用物件：服務模式為代理物件（每個程序快取一份），本機模式為同程序物件"""
+    if service_mode() == "local":
+        return _local_object(name)
+    proxy = _client["proxies"].get(name)
+    if proxy is None:
+        proxy = getattr(_connect(), name)()
+        with _client_lock:
+            proxy = _client["proxies"].setdefault(name, proxy)
+    return proxy
+
+
+class SharedRef:
+    """共用物件的延遲參照：第一次呼叫方法時才取得物件（服務模式下此時才連線）
+
+    模組層級的全域實例使用此參照，匯入模組時不需要共用狀態服務已啟動。
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_shared(self._name), attr)
+
+    def __repr__(self):
+        return f"SharedRef({self._name!r})"
+
+
+def connection_error() -> Optional[str]:
+    """服務模式下嘗試連線，失敗時回傳錯誤訊息；本機模式或已連線時為 None"""
+    if service_mode() == "local":
+        return None
+    try:
+        _connect()
+    except (OSError, EOFError) as e:
+        address = service_address()
+        return f"{address[0]}:{address[1]}（{e}）"
+    return None
+
+
+def data_lock():
+    """資料檔寫入鎖（可用於 with 敘述）"""
+    return get_shared("data_lock")
+
+
+def cached(key: str, version, compute: Callable[[], Any]):
+    """由共用快取取得 key 在此版本的值，未命中時計算並寫回"""
+    cache = get_shared("shared_cache")
+    hit, value = cache.get(key, version)
+    if not hit:
+        value = compute()
+        cache.set(key, version, value)
+    return value
+
+
+# ============================================
+# 服務端
+# ============================================
+def serve(address: Optional[Tuple[str, int]] = None, authkey: Optional[str] = None, background: bool = False):
+    """啟動共用狀態服務；background=True 時在背景執行緒執行並回傳執行緒"""
+    # 服務程序內的共用物件一律使用本機實作，並先載入需要登記共用物件的模組
+    _client["serving"] = True
+    import education_system  # noqa: F401
+
+    address = address or service_address() or ("127.0.0.1", 50055)
+    authkey = (authkey or STATE_SERVICE_AUTHKEY).encode("utf-8")
+    server = StateManager(address=address, authkey=authkey).get_server()
+    _client["serving"] = not background
+    if not background:
+        logger.info("共用狀態服務啟動：%s:%s", address[0], address[1])
+        server.serve_forever()
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="state-service", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # 以模組名稱載入，與其他模組 import 的 state_service 共用同一份登記
+    import state_service
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    state_service.serve()
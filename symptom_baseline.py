@@ -0,0 +1,52 @@
+"""
+AI-CARE Lung Pro - 症狀基準值
+==============================
+
+每位病人每個症狀的基準值，隨回報逐筆更新，保存在病人資料的 baselines 欄位：
+- Welford 演算法累計平均與變異數（n、mean、m2），不需保留歷史回報
+- 指數加權移動平均（ewma）反映近期水準
+警示判定與儀表板直接讀取病人資料中的基準值，不需重新讀取、排序回報。
+"""
+
+import math
+from typing import Dict, Iterable, Optional
+
+from alert_scoring import OVERALL, report_scores
+
+try:
+    from config import BASELINE_EWMA_ALPHA
+except ImportError:
+    BASELINE_EWMA_ALPHA = 0.3
+
+
+def update_baselines(baselines: Dict, scores: Dict[str, float], alpha: float = BASELINE_EWMA_ALPHA) -> Dict:
+    """以一筆回報的分數更新基準值（就地修改並回傳）"""
+    for symptom, score in scores.items():
+        entry = baselines.get(symptom)
+        if entry is None:
+            baselines[symptom] = {"n": 1, "mean": score, "m2": 0.0, "ewma": score, "last": score}
+            continue
+        entry["n"] += 1
+        delta = score - entry["mean"]
+        entry["mean"] += delta / entry["n"]
+        entry["m2"] += delta * (score - entry["mean"])
+        entry["ewma"] = alpha * score + (1 - alpha) * entry["ewma"]
+        entry["last"] = score
+    return baselines
+
+
+def build_baselines(reports: Iterable[Dict]) -> Dict:
+    """由既有回報（依時間順序）建立基準值，用於補建舊資料"""
+    baselines = {}
+    for report in sorted(reports, key=lambda r: r.get("timestamp") or ""):
+        update_baselines(baselines, report_scores(report))
+    return baselines
+
+
+def baseline_summary(baselines: Optional[Dict], symptom: str = OVERALL) -> Optional[Dict]:
+    """症狀基準值摘要：n、mean、std、ewma"""
+    entry = (baselines or {}).get(symptom)
+    if not entry:
+        return None
+    variance = entry["m2"] / (entry["n"] - 1) if entry["n"] > 1 else 0.0
+    return {"n": entry["n"], "mean": entry["mean"], "std": math.sqrt(max(variance, 0.0)), "ewma": entry["ewma"]}
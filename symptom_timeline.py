@@ -0,0 +1,171 @@
+"""
+AI-CARE Lung Pro - 症狀趨勢
+============================
+
+病人完整追蹤期間的症狀分數時間序列：
+- 依病人建立時間序列索引（回報時間、整體分數、各症狀分數），資料檔異動時只處理新增的回報
+- 繪圖前在伺服器端降採樣（LTTB 或每日最高分），一年份的每日回報也只送出數百個點
+"""
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+
+OVERALL = "整體分數"
+DEFAULT_MAX_POINTS = 200
+DOWNSAMPLE_MODES = {"lttb": "保留趨勢（LTTB）", "daily_max": "每日最高分", "raw": "全部資料"}
+
+
+# ============================================
+# 降採樣
+# ============================================
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets 降採樣，回傳保留的索引
+
+    保留首尾兩點，其餘依時間分成 threshold - 2 個區間，
+    每個區間選出與前一個保留點、下一區間平均點構成最大三角形的點。
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def daily_max(t: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """每日最高分（t 為 datetime64）"""
+    days = t.astype("datetime64[D]")
+    unique_days, inverse = np.unique(days, return_inverse=True)
+    result = np.full(len(unique_days), -np.inf)
+    np.maximum.at(result, inverse, y)
+    return unique_days, result
+
+
+# ============================================
+# 時間序列索引
+# ============================================
+class _PatientSeries:
+    """單一病人的回報時間序列（依寫入順序附加，讀取時轉為已排序的陣列）"""
+
+    def __init__(self):
+        self.times: List[str] = []
+        self.values: Dict[str, Tuple[List[int], List[float]]] = {}  # 症狀 -> (回報位置, 分數)
+        self._arrays = None
+
+    def append(self, report: Dict):
+        pos = len(self.times)
+        self.times.append(report.get("timestamp"))
+        scores = {OVERALL: report.get("overall_score"), **(report.get("scores") or {})}
+        for symptom, score in scores.items():
+            try:
+                score = float(score)
+            except (TypeError, ValueError):
+                continue
+            positions, values = self.values.setdefault(symptom, ([], []))
+            positions.append(pos)
+            values.append(score)
+        self._arrays = None
+
+    def arrays(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """症狀 -> (時間, 分數)，依時間排序"""
+        if self._arrays is None:
+            times = pd.to_datetime(pd.Series(self.times, dtype=object), errors="coerce", format="ISO8601").to_numpy()
+            arrays = {}
+            for symptom, (positions, values) in self.values.items():
+                t = times[np.array(positions, dtype=np.int64)]
+                v = np.array(values, dtype=np.float64)
+                valid = ~np.isnat(t)
+                t, v = t[valid], v[valid]
+                order = np.argsort(t, kind="stable")
+                arrays[symptom] = (t[order], v[order])
+            self._arrays = arrays
+        return self._arrays
+
+
+class SymptomTimelineIndex:
+    """病人 -> 症狀時間序列"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.n_reports = 0
+        self.series: Dict[str, _PatientSeries] = {}
+
+    def refresh(self):
+        with self._lock:
+            version = data_manager.data_version()
+            if version == self.version:
+                return
+            reports = data_manager.load_data().get("reports", [])
+            if len(reports) < self.n_reports:
+                self.series = {}
+                self.n_reports = 0
+            for report in reports[self.n_reports:]:
+                self.series.setdefault(report.get("patient_id"), _PatientSeries()).append(report)
+            self.n_reports = len(reports)
+            self.version = version
+
+    def symptoms(self, patient_id: str) -> List[str]:
+        """病人曾回報的症狀（依回報次數排序，整體分數在最前）"""
+        series = self.series.get(patient_id)
+        if series is None:
+            return []
+        others = sorted((s for s in series.values if s != OVERALL), key=lambda s: -len(series.values[s][0]))
+        return ([OVERALL] if OVERALL in series.values else []) + others
+
+    def count(self, patient_id: str) -> int:
+        series = self.series.get(patient_id)
+        return len(series.times) if series else 0
+
+    def timeline(self, patient_id: str, symptoms: Optional[List[str]] = None, mode: str = "lttb",
+                 max_points: int = DEFAULT_MAX_POINTS) -> pd.DataFrame:
+        """繪圖用的長表（timestamp, symptom, score），每個症狀降採樣後最多 max_points 點"""
+        series = self.series.get(patient_id)
+        frames = []
+        if series is not None:
+            arrays = series.arrays()
+            for symptom in symptoms or self.symptoms(patient_id):
+                if symptom not in arrays:
+                    continue
+                t, v = arrays[symptom]
+                if mode == "daily_max":
+                    t, v = daily_max(t, v)
+                    t = t.astype("datetime64[ns]")
+                elif mode == "lttb":
+                    keep = lttb(t.astype("datetime64[s]").astype(np.float64), v, max_points)
+                    t, v = t[keep], v[keep]
+                frames.append(pd.DataFrame({"timestamp": t, "symptom": symptom, "score": v}))
+        if not frames:
+            return pd.DataFrame({"timestamp": pd.Series(dtype="datetime64[ns]"), "symptom": [], "score": []})
+        return pd.concat(frames, ignore_index=True)
+
+
+_index = SymptomTimelineIndex()
+
+
+def get_timeline_index() -> SymptomTimelineIndex:
+    """取得已同步資料檔的症狀時間序列索引"""
+    _index.refresh()
+    return _index
+
+
+def get_symptom_timeline(patient_id: str, symptoms: Optional[List[str]] = None, mode: str = "lttb",
+                         max_points: int = DEFAULT_MAX_POINTS) -> pd.DataFrame:
+    return get_timeline_index().timeline(patient_id, symptoms, mode, max_points)
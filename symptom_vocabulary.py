@@ -0,0 +1,171 @@
+"""
+AI-CARE Lung Pro - 症狀詞彙標準化
+==================================
+
+聊天機器人回報的症狀為自由文字（如「有點喘」「晚上睡不著」），
+寫入回報時對應到標準症狀代碼（symptom_codes），後續統計與衛教推送規則以整數代碼比對：
+- 標準詞彙與同義詞預先編譯為 Aho–Corasick 自動機，每段文字只需掃描一次
+- 重疊時取最左、最長的詞（「咳血」不會同時算成「咳嗽」）
+- 詞前緊接否定詞（沒有、不會、無…）者不計
+- 可用 add_synonyms() 加入院內常用說法
+"""
+
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 標準症狀：(代碼, 名稱, 同義詞)；代碼寫入資料檔，既有代碼不可更改
+SYMPTOM_VOCABULARY = [
+    (1, "疼痛", ["痛", "疼", "胸痛", "酸痛", "刺痛", "抽痛", "悶痛"]),
+    (2, "呼吸困難", ["喘", "氣喘", "呼吸急促", "氣促", "呼吸不順", "上氣不接下氣", "胸悶"]),
+    (3, "咳嗽", ["咳", "乾咳", "咳痰", "有痰", "痰多"]),
+    (4, "咳血", ["咯血", "血痰", "痰中帶血"]),
+    (5, "發燒", ["發熱", "體溫高", "畏寒"]),
+    (6, "疲勞", ["疲倦", "倦怠", "累", "沒力氣", "無力", "虛弱"]),
+    (7, "睡眠", ["失眠", "睡不著", "睡不好", "難入睡", "淺眠"]),
+    (8, "焦慮", ["緊張", "擔心", "不安", "害怕", "煩躁"]),
+    (9, "憂鬱", ["心情低落", "沮喪", "難過"]),
+    (10, "傷口", ["傷口紅腫", "滲液", "化膿"]),
+    (11, "食慾不振", ["食慾差", "吃不下", "沒胃口"]),
+    (12, "噁心", ["想吐", "嘔吐", "反胃"]),
+    (13, "便秘", ["排便困難"]),
+    (14, "頭暈", ["暈眩", "頭昏"]),
+]
+
+NEGATION_PREFIXES = ("沒有", "不會", "沒", "不", "無")
+
+OTHER = 0
+OTHER_NAME = "其他"
+
+
+# ============================================
+# Aho–Corasick 自動機
+# ============================================
+class SymptomMatcher:
+    """多詞比對自動機：每個節點記錄以此結尾的詞（長度, 代碼）與輸出連結（失敗鏈上下一個有詞的節點）"""
+
+    def __init__(self, terms: Iterable[Tuple[str, int]] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[Tuple[int, int]]] = [None]
+        self._link: List[int] = [0]
+        for term, code in terms:
+            self._add(term, code)
+        self._build()
+
+    def _add(self, term: str, code: int):
+        node = 0
+        for ch in term:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+                self._link.append(0)
+            node = nxt
+        self._out[node] = (len(term), code)
+
+    def _build(self):
+        """以廣度優先建立失敗連結與輸出連結"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0) if node else 0
+                target = self._fail[child]
+                self._link[child] = target if self._out[target] is not None else self._link[target]
+
+    def match(self, text: str) -> List[Tuple[int, int, int]]:
+        """文字中的詞：[(起點, 終點, 代碼)]，取最左最長且互不重疊"""
+        found = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            # 以此字結尾的所有詞（含較短的詞，重疊時才能取到後面不重疊的詞）
+            out = node if self._out[node] is not None else self._link[node]
+            while out:
+                length, code = self._out[out]
+                found.append((i + 1 - length, i + 1, code))
+                out = self._link[out]
+
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        matches, end = [], 0
+        for start, stop, code in found:
+            if start >= end:
+                matches.append((start, stop, code))
+                end = stop
+        return matches
+
+    def codes(self, text: str) -> List[int]:
+        """文字對應的症狀代碼（略過前面緊接否定詞者）"""
+        return [code for start, _, code in self.match(text)
+                if not text[:start].endswith(NEGATION_PREFIXES)]
+
+
+# ============================================
+# 詞彙
+# ============================================
+_lock = threading.Lock()
+_names: Dict[int, str] = {code: name for code, name, _ in SYMPTOM_VOCABULARY}
+_terms: Dict[str, int] = {}
+for _code, _name, _synonyms in SYMPTOM_VOCABULARY:
+    for _term in [_name, *_synonyms]:
+        _terms.setdefault(_term, _code)
+_matcher = SymptomMatcher(_terms.items())
+
+
+def add_synonyms(name: str, terms: Iterable[str]):
+    """為標準症狀加入同義詞（重新編譯自動機）"""
+    global _matcher
+    code = symptom_code(name)
+    if code is None:
+        raise KeyError(f"未知的標準症狀：{name}")
+    with _lock:
+        for term in terms:
+            _terms[term] = code
+        _matcher = SymptomMatcher(_terms.items())
+        text_codes.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def text_codes(text: str) -> Tuple[int, ...]:
+    """單段文字的症狀代碼（相同文字只比對一次）"""
+    return tuple(_matcher.codes(text))
+
+
+def normalize_symptoms(symptoms: Iterable[str]) -> List[int]:
+    """自由文字症狀 → 標準症狀代碼（排序、不重複）"""
+    codes = set()
+    for symptom in symptoms if symptoms is not None else []:
+        if symptom:
+            codes.update(text_codes(str(symptom)))
+    return sorted(codes)
+
+
+def report_symptom_codes(report: Dict) -> List[int]:
+    """回報的症狀代碼：優先使用寫入時的 symptom_codes，舊資料即時換算"""
+    codes = report.get("symptom_codes")
+    if codes is None:
+        codes = normalize_symptoms(report.get("symptoms"))
+    return codes
+
+
+def symptom_name(code: int) -> str:
+    return _names.get(code, OTHER_NAME)
+
+
+def symptom_code(name: str) -> Optional[int]:
+    """標準症狀名稱 → 代碼"""
+    for code, vocab_name in _names.items():
+        if vocab_name == name:
+            return code
+    return None
@@ -0,0 +1,101 @@
+"""警示合併與升級：逾期未回報警示不與症狀警示合併，升為紅燈時由升級時間起算處理時限"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import alert_scoring
+import data_manager
+from alert_escalation import ALERT_ESCALATION_MINUTES, EscalationScheduler
+
+PATIENT_ID = "P1"
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data_manager, "_open_alerts",
+                        {"version": None, "n_seen": 0, "by_patient": {}, "missed": {}})
+    monkeypatch.setattr(alert_scoring, "_engine", alert_scoring.AlertScoringEngine())
+    data_manager.save_data({
+        "patients": {PATIENT_ID: {"id": PATIENT_ID, "name": "王小明", "surgery_date": "2026-09-01",
+                                  "created_at": "2026-09-01T08:00:00"}},
+        "reports": [], "alerts": [], "interventions": [],
+    })
+
+
+def _report(score):
+    return {"symptoms": ["疼痛"], "scores": {"疼痛": score}, "overall_score": score}
+
+
+def _alerts():
+    return data_manager.load_data()["alerts"]
+
+
+def test_symptom_alert_is_not_merged_into_missed_report_alert(data):
+    missed = data_manager.create_missed_report_alerts(
+        [{"patient_id": PATIENT_ID, "basis": "2026-09-01", "days_since": 5, "interval": 2}])
+    assert len(missed) == 1
+
+    data_manager.save_report(PATIENT_ID, _report(8))
+    missed_alert, symptom_alert = _alerts()
+    assert missed_alert["type"] == "missed_report" and missed_alert["level"] == "yellow"
+    assert missed_alert["score"] == 0 and missed_alert["symptoms"] == []
+    assert symptom_alert.get("type") is None and symptom_alert["level"] == "red"
+
+
+def test_missed_report_alert_not_duplicated_while_pending(data):
+    item = {"patient_id": PATIENT_ID, "basis": "2026-09-01", "days_since": 5, "interval": 2}
+    data_manager.create_missed_report_alerts([item])
+    assert data_manager.create_missed_report_alerts([{**item, "basis": "2026-09-03"}]) == []
+
+
+def test_repeated_trigger_upgrade_records_upgraded_at(data):
+    data_manager.save_report(PATIENT_ID, _report(5))
+    assert "upgraded_at" not in _alerts()[0]
+    data_manager.save_report(PATIENT_ID, _report(8))
+    (alert,) = _alerts()
+    assert alert["level"] == "red" and alert["count"] == 2
+    assert alert["upgraded_at"] >= alert["timestamp"]
+
+
+def _scheduler_for(alert):
+    data_manager.save_data({**data_manager.load_data(), "alerts": [alert]})
+    scheduler = EscalationScheduler()
+    scheduler.sync()
+    return scheduler
+
+
+def test_upgraded_alert_escalates_from_upgrade_time(data, monkeypatch):
+    now = time.time()
+    created = datetime.fromtimestamp(now) - timedelta(hours=5)
+    alert = {"id": "A1", "patient_id": PATIENT_ID, "level": "red", "status": "pending",
+             "timestamp": created.isoformat(), "upgraded_at": datetime.fromtimestamp(now).isoformat()}
+    scheduler = _scheduler_for(alert)
+    (entry,) = scheduler.triage_queue()
+    assert entry["escalation"] == 0
+
+    first, second = ALERT_ESCALATION_MINUTES["red"]
+    assert scheduler.fire_due(now + first * 60 - 1) == []
+    assert [e["stage"] for e in scheduler.fire_due(now + first * 60 + 1)] == [1]
+    assert [e["stage"] for e in scheduler.fire_due(now + second * 60 + 1)] == [2]
+
+
+def test_stale_yellow_schedule_is_ignored_after_upgrade(data):
+    now = time.time()
+    yellow_first = ALERT_ESCALATION_MINUTES["yellow"][0]
+    red_first = ALERT_ESCALATION_MINUTES["red"][0]
+    # 黃燈即將在 5 分鐘後逾時，此時合併升為紅燈
+    created = datetime.fromtimestamp(now) - timedelta(minutes=yellow_first - 5)
+    alert = {"id": "A1", "patient_id": PATIENT_ID, "level": "yellow", "status": "pending",
+             "timestamp": created.isoformat()}
+    scheduler = _scheduler_for(alert)
+
+    time.sleep(0.01)
+    upgraded = {**alert, "level": "red", "upgraded_at": datetime.fromtimestamp(now).isoformat()}
+    data_manager.save_data({**data_manager.load_data(), "alerts": [upgraded]})
+    scheduler.sync()
+
+    assert scheduler.fire_due(now + 6 * 60) == []
+    assert [e["stage"] for e in scheduler.fire_due(now + red_first * 60 + 1)] == [1]
@@ -0,0 +1,62 @@
+"""警示升級排程：依等級時限逐級升級，已處理的警示不再升級"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import data_manager
+from alert_escalation import ALERT_ESCALATION_MINUTES, EscalationScheduler
+
+
+@pytest.fixture
+def save_alerts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def save(alerts):
+        time.sleep(0.01)
+        data_manager.save_data({"patients": {}, "reports": [], "alerts": alerts, "interventions": []})
+
+    return save
+
+
+def _alert(level, created, **fields):
+    return {"id": f"A-{level}", "patient_id": "P1", "level": level, "status": "pending",
+            "timestamp": created.isoformat(), **fields}
+
+
+def test_stages_fire_in_order_at_level_thresholds(save_alerts):
+    now = time.time()
+    save_alerts([_alert("yellow", datetime.fromtimestamp(now))])
+    scheduler = EscalationScheduler()
+    scheduler.sync()
+
+    first, second = ALERT_ESCALATION_MINUTES["yellow"]
+    assert scheduler.fire_due(now + first * 60 - 1) == []
+    events = scheduler.fire_due(now + first * 60 + 1)
+    assert [(e["alert_id"], e["stage"]) for e in events] == [("A-yellow", 1)]
+    assert [e["stage"] for e in scheduler.fire_due(now + second * 60 + 1)] == [2]
+    assert scheduler.fire_due(now + second * 60 * 10) == []
+    assert scheduler.triage_queue()[0]["escalation"] == 2
+
+
+def test_resolved_alert_does_not_escalate(save_alerts):
+    now = time.time()
+    alert = _alert("red", datetime.fromtimestamp(now))
+    save_alerts([alert])
+    scheduler = EscalationScheduler()
+    scheduler.sync()
+
+    save_alerts([{**alert, "status": "resolved"}])
+    scheduler.sync()
+    assert scheduler.fire_due(now + ALERT_ESCALATION_MINUTES["red"][-1] * 60 + 1) == []
+    assert scheduler.triage_queue() == []
+
+
+def test_overdue_alert_at_startup_gets_stage_without_events(save_alerts):
+    first = ALERT_ESCALATION_MINUTES["red"][0]
+    save_alerts([_alert("red", datetime.now() - timedelta(minutes=first + 1))])
+    scheduler = EscalationScheduler()
+    scheduler.sync()
+    assert scheduler.fire_due() == []
+    assert scheduler.triage_queue()[0]["escalation"] == 1
@@ -0,0 +1,23 @@
+"""閾值規則：整體閾值只用於整體分數，個別症狀只判斷有設定閾值者"""
+
+from alert_scoring import OVERALL, SYMPTOM_ALERT_THRESHOLDS, ScoringContext, ThresholdRule
+
+
+def evaluate(scores):
+    return ThresholdRule().evaluate(scores, ScoringContext("P1", None, {}))
+
+
+def test_unlisted_symptom_does_not_alert_on_its_own():
+    assert "疼痛" not in SYMPTOM_ALERT_THRESHOLDS
+    assert evaluate({OVERALL: 2, "疼痛": 8}) == []
+
+
+def test_overall_score_uses_overall_thresholds():
+    assert [level for level, _ in evaluate({OVERALL: 4})] == ["yellow"]
+    assert [level for level, _ in evaluate({OVERALL: 7})] == ["red"]
+
+
+def test_listed_symptom_uses_its_own_thresholds():
+    symptom, limits = next(iter(SYMPTOM_ALERT_THRESHOLDS.items()))
+    assert [level for level, _ in evaluate({OVERALL: 0, symptom: limits["yellow"]})] == ["yellow"]
+    assert [level for level, _ in evaluate({OVERALL: 0, symptom: limits["red"]})] == ["red"]
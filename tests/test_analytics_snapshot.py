@@ -0,0 +1,47 @@
+"""研究分析快照：不得寫入姓名、電話、自由文字與人員帳號"""
+
+import glob
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+import analytics_snapshot
+import data_manager
+
+IDENTIFIERS = ["王小明", "0912-345-678", "nurse01", "nurse02"]
+
+
+@pytest.fixture
+def records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = {
+        "patients": {"P1": {"id": "P1", "name": "王小明", "phone": "0912-345-678", "created_at": "2026-09-01"}},
+        "reports": [{
+            "id": "R1", "patient_id": "P1", "timestamp": "2026-09-02T09:00:00", "symptoms": ["疼痛"],
+            "scores": {"疼痛": 3}, "overall_score": 3, "status": "completed",
+            "conversation": [{"role": "user", "content": "我是王小明"}],
+        }],
+        "alerts": [{
+            "id": "A1", "patient_id": "P1", "patient_name": "王小明", "level": "yellow", "score": 5,
+            "symptoms": ["疼痛"], "timestamp": "2026-09-02T09:00:00", "status": "resolved",
+            "handled_by": "nurse01", "handled_at": "2026-09-02T10:00:00", "notes": "已致電王小明 0912-345-678",
+        }],
+        "interventions": [{
+            "id": "I1", "patient_id": "P1", "timestamp": "2026-09-02T10:00:00", "type": "電話",
+            "content": "王小明表示疼痛改善，回電 0912-345-678", "duration": "10 分鐘", "nurse": "nurse02",
+        }],
+    }
+    data_manager.save_data(data)
+    return data
+
+
+def test_snapshot_has_no_identifying_columns(records):
+    manifest = analytics_snapshot.write_snapshot(force=True, tables=["reports", "alerts", "interventions", "clinical"])
+    assert manifest["tables"]["alerts"]["rows"] == 1
+    paths = glob.glob(f"{analytics_snapshot.SNAPSHOT_DIR}/**/*.parquet", recursive=True)
+    assert paths
+    for path in paths:
+        content = str(pq.read_table(path).to_pylist())
+        for identifier in IDENTIFIERS:
+            assert identifier not in content
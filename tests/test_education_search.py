@@ -0,0 +1,57 @@
+"""衛教單張檢索：中文單字查詢展開為含此字的雙字；單張編輯寫入資料檔"""
+
+import os
+import subprocess
+import sys
+
+import education_system
+from education_system import (
+    EDUCATION_MATERIALS, EducationSearchIndex, education_search_index, search_materials, update_material,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MATERIALS = {
+    "PAIN": {"title": "術後疼痛控制", "category": "術後照護", "content": "傷口痛時可冰敷"},
+    "COUGH": {"title": "咳嗽與咳痰", "category": "呼吸照護", "content": "有效咳嗽的方法"},
+}
+
+
+def test_single_character_query_matches_bigrams():
+    index = EducationSearchIndex(MATERIALS)
+    assert [key for key, _ in index.search("痛")] == ["PAIN"]
+    assert [key for key, _ in index.search("咳")] == ["COUGH"]
+
+
+def test_removed_material_is_not_found_by_single_character():
+    index = EducationSearchIndex(MATERIALS)
+    index.remove("COUGH")
+    assert index.search("咳") == []
+    assert "咳" not in index.chars
+
+
+def test_builtin_library_single_character_search():
+    assert len(search_materials("痛")) >= len(search_materials("疼痛")) > 0
+
+
+def test_material_edit_persists_across_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(education_system, "_material_edits", {"version": None, "applied": {}})
+    key = next(iter(EDUCATION_MATERIALS))
+    original = dict(EDUCATION_MATERIALS[key])
+    try:
+        update_material(key, updated_by="nurse01", title="獨特測試標題")
+        assert search_materials("獨特測試")[0]["key"] == key
+
+        # 新的程序（重新啟動或其他工作程序）由資料檔套用編輯
+        code = ("from education_system import search_materials, get_material_by_id; "
+                f"print(get_material_by_id({key!r})['title'], search_materials('獨特測試')[0]['key'])")
+        env = {**os.environ, "PYTHONPATH": ROOT}
+        env.pop("AICARE_STATE_SERVICE", None)
+        out = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env,
+                             capture_output=True, text=True, timeout=60)
+        assert out.returncode == 0, out.stderr
+        assert out.stdout.split() == ["獨特測試標題", key]
+    finally:
+        EDUCATION_MATERIALS[key].update(original)
+        education_search_index.add(key, EDUCATION_MATERIALS[key])
@@ -0,0 +1,55 @@
+"""背景匯出工作：移出工作表與超過保留時數的匯出檔會刪除"""
+
+import os
+import time
+
+import pytest
+
+import data_manager
+import export_jobs
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(export_jobs, "_jobs", {})
+    monkeypatch.setattr(export_jobs, "_owned", set())
+    monkeypatch.setattr(export_jobs, "_loaded", {"done": False, "mtime": None, "swept": 0.0})
+    data_manager.save_data({
+        "patients": {"P1": {"id": "P1", "name": "王小明", "phone": "0912-345-678"}},
+        "reports": [], "alerts": [], "interventions": [],
+    })
+    return export_jobs
+
+
+def _wait(module, job):
+    deadline = time.time() + 30
+    while module.get_job(job["id"])["status"] in ("queued", "running"):
+        assert time.time() < deadline
+        time.sleep(0.05)
+    return module.get_job(job["id"])
+
+
+def test_evicted_job_output_is_deleted(jobs, monkeypatch):
+    monkeypatch.setattr(jobs, "MAX_JOBS_KEPT", 1)
+    first = _wait(jobs, jobs.submit_export("json", ["clinical"], deidentify=False, requested_by="nurse01"))
+    assert first["status"] == "done" and os.path.exists(first["output"])
+
+    second = _wait(jobs, jobs.submit_export("csv", ["clinical"], deidentify=False, requested_by="nurse01"))
+    assert second["status"] == "done"
+    assert not os.path.exists(first["output"])
+    assert [job["id"] for job in jobs.list_jobs()] == [second["id"]]
+
+
+def test_retention_sweep_deletes_old_exports(jobs):
+    job = _wait(jobs, jobs.submit_export("json", ["clinical"], deidentify=False, requested_by="nurse01"))
+    old = time.time() - (jobs.EXPORT_RETENTION_HOURS * 3600 + 60)
+    os.utime(job["output"], (old, old))
+
+    assert jobs.sweep_exports() == 1
+    assert not os.path.exists(job["output"])
+    assert jobs.get_job(job["id"])["status"] == "expired"
+
+    # 過期後相同請求重新匯出
+    again = _wait(jobs, jobs.submit_export("json", ["clinical"], deidentify=False, requested_by="nurse01"))
+    assert again["id"] != job["id"] and again["status"] == "done"
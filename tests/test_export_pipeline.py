@@ -0,0 +1,85 @@
+"""去識別化匯出：輸出中不得出現原始識別資料"""
+
+import json
+import zipfile
+
+import pytest
+
+import clinical_store
+import data_manager
+from export_pipeline import EXPORT_TABLES, run_export
+
+PATIENT_ID = "P0912"
+IDENTIFIERS = ["王小明", "0912-345-678", "nurse01", "nurse02", PATIENT_ID]
+
+
+@pytest.fixture
+def records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = {
+        "patients": {
+            PATIENT_ID: {
+                "id": PATIENT_ID, "name": "王小明", "phone": "0912-345-678", "age": 66,
+                "surgery_date": "2026-09-01", "created_at": "2026-09-01T08:00:00",
+            },
+        },
+        "reports": [{
+            "id": "R1", "patient_id": PATIENT_ID, "timestamp": "2026-09-02T09:00:00", "date": "2026-09-02",
+            "time": "09:00", "symptoms": ["疼痛"], "scores": {"疼痛": 3}, "overall_score": 3, "status": "completed",
+            "conversation": [{"role": "user", "content": "我是王小明"}],
+        }],
+        "alerts": [{
+            "id": "A1", "patient_id": PATIENT_ID, "patient_name": "王小明", "level": "yellow", "score": 5,
+            "symptoms": ["疼痛"], "timestamp": "2026-09-02T09:00:00", "status": "resolved",
+            "handled_by": "nurse01", "handled_at": "2026-09-02T10:00:00", "notes": "已致電王小明 0912-345-678",
+        }],
+        "interventions": [{
+            "id": "I1", "patient_id": PATIENT_ID, "timestamp": "2026-09-02T10:00:00", "date": "2026-09-02",
+            "time": "10:00", "type": "電話", "content": "王小明表示疼痛改善，回電 0912-345-678",
+            "duration": "10 分鐘", "referral": None, "nurse": "nurse02",
+        }],
+    }
+    data_manager.save_data(data)
+    return data
+
+
+def _read_output(path, fmt):
+    if fmt == "xlsx":
+        openpyxl = pytest.importorskip("openpyxl")
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        return json.dumps([[list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook],
+                          ensure_ascii=False, default=str)
+    if fmt == "csv":
+        with zipfile.ZipFile(path) as archive:
+            return "".join(archive.read(name).decode("utf-8-sig") for name in archive.namelist())
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("fmt", ["csv", "json", "xlsx"])
+def test_deidentified_export_has_no_raw_identifiers(records, tmp_path, fmt):
+    path = run_export(fmt, EXPORT_TABLES, deidentify=True, output_path=str(tmp_path / f"out.{fmt}"))
+    output = _read_output(path, fmt)
+    for identifier in IDENTIFIERS:
+        assert identifier not in output
+
+
+def test_staff_hashed_consistently_within_export(records, tmp_path):
+    path = run_export("json", ["alerts", "interventions"], deidentify=True, output_path=str(tmp_path / "out.json"))
+    with open(path, encoding="utf-8") as f:
+        exported = json.load(f)
+    alert, intervention = exported["alerts"][0], exported["interventions"][0]
+    assert "notes" not in alert and "content" not in intervention
+    assert alert["handled_by"].startswith("U") and intervention["nurse"].startswith("U")
+    assert alert["handled_by"] != intervention["nurse"]
+
+
+def test_clinical_export_uses_edited_values(records, tmp_path):
+    records["patients"][PATIENT_ID]["clinical"] = legacy = {"age": 60}
+    data_manager.save_data(records)
+    clinical_store.save_clinical_changes(PATIENT_ID, legacy, {"age": 70}, user="nurse01", legacy=legacy)
+    assert clinical_store.get_clinical(PATIENT_ID, legacy)["age"] == 70
+    path = run_export("json", ["clinical"], deidentify=False, output_path=str(tmp_path / "out.json"))
+    with open(path, encoding="utf-8") as f:
+        exported = json.load(f)
+    assert exported["clinical"][0]["age"] == 70
@@ -0,0 +1,62 @@
+"""逾期未回報偵測：到逾期日才列入，恢復回報後移除，每次逾期只建立一筆警示"""
+
+import time
+from datetime import date
+
+import pytest
+
+import data_manager
+from missed_reports import MissedReportIndex
+
+PATIENT = {"id": "P1", "name": "王小明", "surgery_date": "2026-09-01", "created_at": "2026-09-01T08:00:00"}
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data_manager, "_open_alerts",
+                        {"version": None, "n_seen": 0, "by_patient": {}, "missed": {}})
+    data = {"patients": {"P1": dict(PATIENT)}, "reports": [], "alerts": [], "interventions": []}
+    data_manager.save_data(data)
+    return data
+
+
+def _save(data):
+    time.sleep(0.01)
+    data_manager.save_data(data)
+
+
+def test_patient_listed_only_after_grace_period(data):
+    # 術後第一個月每日回報：收案 9/1 → 最晚 9/2 回報，寬限 2 天後 9/5 起逾期
+    index = MissedReportIndex(grace_days=2)
+    index.sync()
+    assert index.sweep(date(2026, 9, 4)) == []
+    (item,) = index.sweep(date(2026, 9, 5))
+    assert item["patient_id"] == "P1" and item["basis"] == "2026-09-01"
+    assert index.overdue_patients(date(2026, 9, 5))[0]["days_since"] == 4
+
+
+def test_report_clears_overdue_and_reschedules(data):
+    index = MissedReportIndex(grace_days=2)
+    index.sync()
+    index.sweep(date(2026, 9, 5))
+
+    data["reports"].append({"id": "R1", "patient_id": "P1", "date": "2026-09-05", "timestamp": "2026-09-05T09:00:00"})
+    _save(data)
+    index.sync()
+    assert index.overdue_patients(date(2026, 9, 5)) == []
+    assert index.sweep(date(2026, 9, 8)) == []
+    assert [item["basis"] for item in index.sweep(date(2026, 9, 9))] == ["2026-09-05"]
+
+
+def test_one_alert_per_missed_period(data):
+    index = MissedReportIndex(grace_days=2)
+    index.sync()
+    index.sweep(date(2026, 9, 5))
+    (alert,) = index.raise_alerts(date(2026, 9, 5))
+    assert alert["type"] == "missed_report" and alert["missed_since"] == "2026-09-01"
+
+    index.sync()
+    index.sweep(date(2026, 9, 6))
+    assert index.raise_alerts(date(2026, 9, 6)) == []
+    assert len(data_manager.load_data()["alerts"]) == 1
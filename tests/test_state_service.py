@@ -0,0 +1,70 @@
+"""共用狀態服務：服務與工作程序分屬不同程序時，推送紀錄經代理共用"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import json
+import analytics_snapshot
+from education_system import EDUCATION_MATERIALS, education_manager
+material_id = next(iter(EDUCATION_MATERIALS))
+education_manager.push_material("P1", "測試", material_id, pushed_by="nurse01")
+if analytics_snapshot.PARQUET_AVAILABLE:
+    manifest = analytics_snapshot.write_snapshot(tables=["pushes"])
+    result = {"version": manifest["source_version"], "pushes": manifest["tables"]["pushes"]["rows"]}
+else:
+    result = {"version": analytics_snapshot._source_version(),
+              "pushes": len(analytics_snapshot._source_records({}, "pushes"))}
+print(json.dumps(result))
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def service(tmp_path):
+    port = _free_port()
+    env = {**os.environ, "AICARE_STATE_SERVICE": f"127.0.0.1:{port}", "PYTHONPATH": ROOT}
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "state_service.py")], cwd=tmp_path, env=env)
+    try:
+        deadline = time.time() + 20
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        yield env
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def _run_worker(env, cwd):
+    out = subprocess.run([sys.executable, "-c", WORKER], cwd=cwd, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_push_history_is_shared_between_worker_processes(service, tmp_path):
+    first = _run_worker(service, tmp_path)
+    second = _run_worker(service, tmp_path)
+    assert first["pushes"] == 1
+    assert second["pushes"] == 2
+    assert first["version"][2] == [1, 0]
+    assert second["version"][2] == [2, 0]
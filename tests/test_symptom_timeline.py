@@ -0,0 +1,22 @@
+"""LTTB 降採樣：保留首尾與尖峰，輸出點數等於門檻且依時間排序"""
+
+import numpy as np
+
+from symptom_timeline import lttb
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[437] = 10.0
+    selected = lttb(x, y, 50)
+    assert len(selected) == 50
+    assert selected[0] == 0 and selected[-1] == 999
+    assert np.all(np.diff(selected) > 0)
+    assert 437 in selected
+
+
+def test_lttb_returns_all_points_below_threshold():
+    x = np.arange(10, dtype=float)
+    assert list(lttb(x, x, 20)) == list(range(10))
+    assert list(lttb(x, x, 2)) == list(range(10))
@@ -0,0 +1,52 @@
+"""症狀詞彙標準化：Aho–Corasick 比對取最左最長、略過否定詞"""
+
+import random
+
+import symptom_vocabulary
+from symptom_vocabulary import SymptomMatcher, normalize_symptoms, symptom_code
+
+
+def test_longest_match_wins_over_prefix():
+    assert normalize_symptoms(["咳血"]) == [symptom_code("咳血")]
+    assert normalize_symptoms(["痰中帶血"]) == [symptom_code("咳血")]
+
+
+def test_multiple_symptoms_in_free_text():
+    codes = normalize_symptoms(["有點喘，晚上睡不著"])
+    assert codes == sorted([symptom_code("呼吸困難"), symptom_code("睡眠")])
+
+
+def test_negated_symptom_is_skipped():
+    assert normalize_symptoms(["沒有發燒"]) == []
+    assert normalize_symptoms(["沒有發燒但是會咳"]) == [symptom_code("咳嗽")]
+
+
+def test_matcher_leftmost_longest_non_overlapping():
+    matcher = SymptomMatcher([("ab", 1), ("abc", 2), ("bcd", 3), ("d", 4)])
+    assert matcher.match("abcd") == [(0, 3, 2), (3, 4, 4)]
+
+
+def test_shorter_term_after_overlapping_longer_one():
+    # 「胸悶」之後的「痛」：以「悶痛」結尾的節點也要輸出較短的「痛」
+    assert normalize_symptoms(["胸悶痛"]) == sorted([symptom_code("呼吸困難"), symptom_code("疼痛")])
+
+
+def test_matches_agree_with_naive_leftmost_longest_scan():
+    terms = dict(symptom_vocabulary._terms)
+
+    def naive(text):
+        found, i = [], 0
+        while i < len(text):
+            best = max((t for t in terms if text.startswith(t, i)), key=len, default=None)
+            if best is None:
+                i += 1
+            else:
+                found.append((i, i + len(best), terms[best]))
+                i += len(best)
+        return found
+
+    rng = random.Random(0)
+    words = list(terms)
+    for _ in range(2000):
+        text = "".join(rng.choice(words) for _ in range(3))[rng.randint(0, 2):]
+        assert symptom_vocabulary._matcher.match(text) == naive(text)